@@ -0,0 +1,263 @@
+"""
+Benchmarks for the simulation and label pipeline
+
+Runs under plain CPython against the bpy, bmesh and mathutils stand-ins in benchmarks/stubs, and records the
+results as JSON so that regressions show up between commits. Run from the root of the project, e.g.
+python benchmarks/run.py --output benchmarks/results/latest.json --compare benchmarks/results/previous.json
+
+With --blender the end-to-end render time per frame is also measured by rendering a short job in a background
+Blender process with --profile-output
+"""
+import os
+import sys
+import json
+import time
+import random
+import platform
+import argparse
+import tempfile
+import subprocess
+import numpy as np
+
+BENCHMARK_PATH = os.path.dirname(os.path.realpath(__file__))
+SCRIPTS_PATH = os.path.join(os.path.dirname(BENCHMARK_PATH), 'blender_scripts')
+sys.path.append(SCRIPTS_PATH)
+sys.path.insert(0, os.path.join(BENCHMARK_PATH, 'stubs'))
+import bpy
+
+from arena import FIELD_X, FIELD_Y, WALL_WIDTH, WALL_HEIGHT, ALL_BLOCKS, ROBOT_RADIUS, ROBOT_Z, block_corners
+from distance_field import load_distance_field
+from motion import RobotState, make_spatial_hash
+from pathfinder import CollisionWorld, simulate_motion
+from spawn import SpawnSampler
+from labels import make_label_writer
+from profiler import profiler
+import render
+
+EXTRA_OBSTACLE_SIZE = 0.2
+
+
+def box_geometry(corners, height, first_vertex=0):
+    """Returns the vertices and polygons of a box standing on the floor with the given xy corners"""
+    vertices = [(x, y, 0) for x, y in corners] + [(x, y, height) for x, y in corners]
+    polygons = [[first_vertex + i for i in polygon] for polygon in
+                [[0, 1, 2, 3], [4, 5, 6, 7], [0, 1, 5, 4], [1, 2, 6, 5], [2, 3, 7, 6], [3, 0, 4, 7]]]
+    return vertices, polygons
+
+
+def build_stub_arena(scene, extra_obstacles=0, rng=None):
+    """
+    Adds the wall, the arena blocks and extra_obstacles randomly placed small blocks to a stub scene
+    Returns the names of the obstacle objects
+    """
+    vertices = []
+    polygons = []
+    for x0, y0, x1, y1 in [(-WALL_WIDTH, -WALL_WIDTH, 0, FIELD_Y + WALL_WIDTH),
+                           (FIELD_X, -WALL_WIDTH, FIELD_X + WALL_WIDTH, FIELD_Y + WALL_WIDTH),
+                           (0, -WALL_WIDTH, FIELD_X, 0),
+                           (0, FIELD_Y, FIELD_X, FIELD_Y + WALL_WIDTH)]:
+        box_vertices, box_polygons = box_geometry([(x0, y0), (x0, y1), (x1, y1), (x1, y0)], WALL_HEIGHT,
+                                                  len(vertices))
+        vertices.extend(box_vertices)
+        polygons.extend(box_polygons)
+    scene.link(bpy.Object('wall_obj', bpy.Mesh('wall_mesh', vertices, polygons)))
+    obstacle_list = ['wall_obj']
+
+    for block_id, block in ALL_BLOCKS.items():
+        name = f'block_{block_id}_obj'
+        scene.link(bpy.Object(name, bpy.Mesh(name, *box_geometry(block_corners(block_id), block['size']['z']))))
+        obstacle_list.append(name)
+
+    rng = rng or np.random.default_rng(0)
+    for index in range(extra_obstacles):
+        x, y = rng.uniform((0, 0), (FIELD_X - EXTRA_OBSTACLE_SIZE, FIELD_Y - EXTRA_OBSTACLE_SIZE))
+        corners = [(x, y), (x, y + EXTRA_OBSTACLE_SIZE),
+                   (x + EXTRA_OBSTACLE_SIZE, y + EXTRA_OBSTACLE_SIZE), (x + EXTRA_OBSTACLE_SIZE, y)]
+        name = f'extra_obstacle_{index}_obj'
+        scene.link(bpy.Object(name, bpy.Mesh(name, *box_geometry(corners, 0.4))))
+        obstacle_list.append(name)
+    return obstacle_list
+
+
+def place_robots(scene, count, rng):
+    """Adds count robots to a stub scene, at random positions clear of the arena blocks and wall"""
+    distance_field = load_distance_field()
+    robot_names = []
+    while len(robot_names) < count:
+        x, y = rng.uniform((0, 0), (FIELD_X, FIELD_Y))
+        if distance_field.distance(x, y) > ROBOT_RADIUS:
+            name = f'r{len(robot_names) + 1}_base'
+            scene.link(bpy.Object(name, location=(x, y, ROBOT_Z)))
+            robot_names.append(name)
+    return robot_names
+
+
+def reset_scene():
+    bpy.data.scenes[0] = bpy.Scene()
+    return bpy.data.scenes[0]
+
+
+def bench_simulate_motion(robot_count, extra_obstacles, backend, frames):
+    """Returns the frames per second of simulate_motion for the given number of robots and obstacles"""
+    scene = reset_scene()
+    rng = np.random.default_rng(0)
+    obstacle_list = build_stub_arena(scene, extra_obstacles, rng)
+    robot_names = place_robots(scene, robot_count, rng)
+    np.random.seed(0)
+
+    robot_state = RobotState(robot_names, [tuple(scene.objects[robot].location) for robot in robot_names])
+    spatial_hash = make_spatial_hash()
+    if backend == 'mesh':
+        collision_world = CollisionWorld(obstacle_list)
+    else:
+        collision_world = load_distance_field()
+
+    start = time.perf_counter()
+    for frame in range(frames):
+        simulate_motion(robot_state, collision_world, spatial_hash, frame)
+    elapsed = time.perf_counter() - start
+    return {
+        'backend': backend,
+        'robots': robot_count,
+        'obstacles': len(obstacle_list),
+        'frames': frames,
+        'fps': frames / elapsed
+    }
+
+
+def bench_spawn(iterations, spawn_mode, robot_count=4):
+    """Returns the spawns per second of render.spawn_robots in the given spawn mode"""
+    scene = reset_scene()
+    robot_names = [f'r{i}_base' for i in range(1, robot_count + 1)]
+    for robot in robot_names:
+        scene.link(bpy.Object(robot))
+    random.seed(0)
+    np.random.seed(0)
+    spawn_sampler = SpawnSampler(load_distance_field()) if spawn_mode == 'free_space' else None
+
+    start = time.perf_counter()
+    for _ in range(iterations):
+        render.spawn_robots(robot_names, render.render_configs['spawn_blocks'], spawn_sampler)
+    elapsed = time.perf_counter() - start
+    return {'spawn_mode': spawn_mode, 'robots': robot_count, 'iterations': iterations,
+            'spawns_per_second': iterations / elapsed}
+
+
+def bench_labels(label_format, frames, robot_count):
+    """Returns the records per second written by the label writer of the given format"""
+    robot_names = [f'r{i}_base' for i in range(1, robot_count + 1)]
+    positions = np.random.default_rng(0).uniform(0, 4, (frames, robot_count, 3)).tolist()
+    with tempfile.TemporaryDirectory() as output_path:
+        start = time.perf_counter()
+        label_writer = make_label_writer(label_format, output_path, robot_names=robot_names, frames=range(frames))
+        for frame in range(frames):
+            for index, robot in enumerate(robot_names):
+                x, y, z = positions[frame][index]
+                label_writer.write('simulation_number0', frame, robot, {'x': x, 'y': y, 'z': z})
+        label_writer.close()
+        elapsed = time.perf_counter() - start
+    records = frames * robot_count
+    return {'format': label_format, 'records': records, 'records_per_second': records / elapsed}
+
+
+def bench_render(blender, frames, render_profile):
+    """
+    Renders a short job in a background Blender process and returns its render and file write time per frame
+    """
+    with tempfile.TemporaryDirectory() as output_path:
+        profile_path = os.path.join(output_path, 'profile.json')
+        command = [blender, '-b', '--python-exit-code', '1', '-P', os.path.join(SCRIPTS_PATH, 'blender_env.py'),
+                   '--', 'render', '--seed', '0', '--simulations', '0', '--frames', f'0:{frames}',
+                   '--render-profile', render_profile, '--output', output_path, '--profile-output', profile_path]
+        subprocess.run(command, check=True, stdout=subprocess.DEVNULL)
+        with open(profile_path) as f:
+            stages = json.load(f)['stages']
+    result = {'render_profile': render_profile, 'frames': frames}
+    for stage in ['scene_build', 'render', 'file_write']:
+        if stage in stages:
+            result[f'{stage}_mean'] = stages[stage]['mean']
+            result[f'{stage}_p90'] = stages[stage]['p90']
+    return result
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=BENCHMARK_PATH, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, previous):
+    """Prints the change of every throughput against a previous results file"""
+    for name, runs in results['benchmarks'].items():
+        for run, previous_run in zip(runs, previous['benchmarks'].get(name, [])):
+            throughputs = [key for key in run if key.endswith(('fps', 'per_second'))]
+            settings = ', '.join(f'{key}={value}' for key, value in run.items() if key not in throughputs)
+            for key in throughputs:
+                if previous_run.get(key):
+                    print(f'{name} ({settings}): {key} {run[key] / previous_run[key]:.2f}x')
+
+
+def parse_benchmark_args(argv):
+    parser = argparse.ArgumentParser(description='Benchmark the simulation and label pipeline')
+    parser.add_argument('--robots', default='4,16,64', help='comma separated robot counts')
+    parser.add_argument('--obstacles', default='0,40,160', help='comma separated extra obstacle counts')
+    parser.add_argument('--frames', type=int, default=250, help='frames simulated per run')
+    parser.add_argument('--spawns', type=int, default=1000, help='spawns sampled')
+    parser.add_argument('--label-frames', type=int, default=5000, help='frames of labels written per format')
+    parser.add_argument('--blender', help='Blender executable, also benchmarks rendering end to end')
+    parser.add_argument('--render-frames', type=int, default=5, help='frames rendered in Blender')
+    parser.add_argument('--render-profile', default='draft', help='render profile used in Blender')
+    parser.add_argument('--output', help='JSON file to write the results to')
+    parser.add_argument('--compare', help='results JSON of an earlier run to compare against')
+    return parser.parse_args(argv)
+
+
+def run_benchmarks(benchmark_args):
+    # The stage timings are not needed here, only their overhead is kept
+    profiler.reset()
+    robot_counts = [int(i) for i in benchmark_args.robots.split(',')]
+    obstacle_counts = [int(i) for i in benchmark_args.obstacles.split(',')]
+
+    benchmarks = {'simulate_motion': [], 'spawn': [], 'labels': []}
+    for robot_count in robot_counts:
+        for extra_obstacles in obstacle_counts:
+            benchmarks['simulate_motion'].append(
+                bench_simulate_motion(robot_count, extra_obstacles, 'mesh', benchmark_args.frames))
+        # The distance field covers the arena only, so its cost does not depend on the obstacle count
+        benchmarks['simulate_motion'].append(
+            bench_simulate_motion(robot_count, 0, 'distance_field', benchmark_args.frames))
+    benchmarks['spawn'].append(bench_spawn(benchmark_args.spawns, 'blocks'))
+    # Only as many robots as fit the free space of the arena can be spawned
+    spawn_capacity = SpawnSampler(load_distance_field()).capacity
+    for robot_count in robot_counts:
+        if robot_count <= spawn_capacity:
+            benchmarks['spawn'].append(bench_spawn(benchmark_args.spawns, 'free_space', robot_count))
+    for label_format in ['json', 'jsonl', 'npy']:
+        benchmarks['labels'].append(bench_labels(label_format, benchmark_args.label_frames, 4))
+    if benchmark_args.blender:
+        benchmarks['render'] = [bench_render(benchmark_args.blender, benchmark_args.render_frames,
+                                             benchmark_args.render_profile)]
+
+    return {
+        'commit': git_commit(),
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'machine': platform.machine(),
+        'benchmarks': benchmarks
+    }
+
+
+if __name__ == '__main__':
+    benchmark_args = parse_benchmark_args(sys.argv[1:])
+    results = run_benchmarks(benchmark_args)
+    print(json.dumps(results, indent=4))
+    if benchmark_args.output:
+        os.makedirs(os.path.dirname(os.path.abspath(benchmark_args.output)), exist_ok=True)
+        with open(benchmark_args.output, 'w') as f:
+            json.dump(results, f, indent=4)
+    if benchmark_args.compare:
+        with open(benchmark_args.compare) as f:
+            compare(results, json.load(f))
@@ -0,0 +1,25 @@
+'''
+Minimal stand-in for the parts of bmesh used by the simulation, see bpy.py
+'''
+import numpy as np
+
+
+class BMesh():
+    def __init__(self):
+        self.vertices = np.zeros((0, 3))
+        self.polygons = []
+
+    def from_mesh(self, mesh):
+        self.vertices = mesh.vertices.copy()
+        self.polygons = [list(polygon) for polygon in mesh.polygons]
+
+    def transform(self, matrix):
+        matrix = np.asarray(matrix)
+        self.vertices = self.vertices @ matrix[:3, :3].T + matrix[:3, 3]
+
+    def free(self):
+        pass
+
+
+def new():
+    return BMesh()
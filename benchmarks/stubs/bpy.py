@@ -0,0 +1,77 @@
+'''
+Minimal stand-in for the parts of bpy used by the simulation, so that it can be benchmarked under plain CPython
+
+Only object transforms and mesh geometry are kept, nothing can be rendered
+'''
+import numpy as np
+
+
+class Vector():
+    def __init__(self, values=(0, 0, 0)):
+        self.x, self.y, self.z = [float(v) for v in values]
+
+    def __iter__(self):
+        return iter((self.x, self.y, self.z))
+
+    def __len__(self):
+        return 3
+
+    def __getitem__(self, index):
+        return (self.x, self.y, self.z)[index]
+
+
+class Mesh():
+    def __init__(self, name, vertices, polygons):
+        self.name = name
+        self.vertices = np.asarray(vertices, dtype=float).reshape(-1, 3)
+        self.polygons = [list(polygon) for polygon in polygons]
+
+
+class Object():
+    '''Mesh geometry is kept in world space, so matrix_world only holds the location'''
+
+    def __init__(self, name, mesh=None, location=(0, 0, 0)):
+        self.name = name
+        self.data = mesh
+        self.location = location
+        self.rotation_euler = Vector()
+
+    @property
+    def location(self):
+        return self._location
+
+    @location.setter
+    def location(self, values):
+        self._location = Vector(values)
+
+    @property
+    def matrix_world(self):
+        matrix = np.identity(4)
+        matrix[:3, 3] = tuple(self.location)
+        return matrix
+
+
+class Scene():
+    def __init__(self):
+        self.objects = {}
+
+    def link(self, obj):
+        self.objects[obj.name] = obj
+        return obj
+
+
+class ViewLayer():
+    def update(self):
+        pass
+
+
+class data():
+    scenes = [Scene()]
+
+
+class context():
+    view_layer = ViewLayer()
+
+
+class types():
+    Object = Object
@@ -0,0 +1,3 @@
+'''
+Minimal stand-in for the parts of mathutils used by the simulation, see bpy.py
+'''
@@ -0,0 +1,27 @@
+'''
+Stand-in BVH tree that tests polygon bounding boxes against each other
+
+Overlaps are conservative compared to Blender's triangle tests, but the simulation only checks whether there are any
+'''
+import numpy as np
+
+
+class BVHTree():
+    def __init__(self, vertices, polygons):
+        vertices = np.asarray(vertices, dtype=float).reshape(-1, 3)
+        self.mins = np.array([vertices[polygon].min(axis=0) for polygon in polygons]).reshape(-1, 3)
+        self.maxs = np.array([vertices[polygon].max(axis=0) for polygon in polygons]).reshape(-1, 3)
+
+    @classmethod
+    def FromBMesh(cls, bm):
+        return cls(bm.vertices, bm.polygons)
+
+    @classmethod
+    def FromPolygons(cls, vertices, polygons):
+        return cls(vertices, polygons)
+
+    def overlap(self, other):
+        '''Returns the index pairs of the polygons whose bounding boxes overlap'''
+        overlapping = np.all((self.mins[:, None] <= other.maxs[None]) & (other.mins[None] <= self.maxs[:, None]),
+                             axis=2)
+        return list(zip(*np.nonzero(overlapping)))
@@ -0,0 +1,121 @@
+'''
+Fixed layout of the arena, shared by the Blender scene and the pathfinder
+
+Holds the field and wall dimensions, the size, location and rotation of every block, the floor corners of a
+block and the spawn blocks robots are placed in when spawning one robot per block.
+'''
+import random
+from math import radians, sqrt, cos, sin
+
+FIELD_X = 8.08  # length
+FIELD_Y = 4.48  # width
+
+WALL_WIDTH = 0.410
+WALL_HEIGHT = 0.50
+
+# Radius of a circle around the robot's footprint, used where robots are treated as discs
+ROBOT_RADIUS = 0.3
+# Height of the robot origin above the floor
+ROBOT_Z = 0.03
+
+# block name, size, location and rotation maps
+BLOCK_SIZES = {
+    'S6': {'x': 1, 'y': 0.2, 'z': 0.4, },
+    'S2': {'x': 0.8, 'y': 0.2, 'z': 0.4, },
+    'S1': {'x': 0.25, 'y': 0.25, 'z': 0.4, },
+}
+
+ALL_BLOCKS = {
+    'B1': {'size': BLOCK_SIZES['S6'],
+           'location': {'x': 0, 'y': 3.280},
+           'rot': 0, },
+    'B2': {'size': BLOCK_SIZES['S2'],
+           'location': {'x': 1.5, 'y': 2.140},
+           'rot': 0, },
+    'B3': {'size': BLOCK_SIZES['S6'],
+           'location': {'x': 1.5 + 0.2, 'y': 0},
+           'rot': radians(90), },
+    'B4': {'size': BLOCK_SIZES['S6'],
+           'location': {'x': 3.54, 'y': 4.48 - 0.935 - 0.2},
+           'rot': radians(0), },
+    'B5': {'size': BLOCK_SIZES['S1'],
+           'location': {'x': 4.04 - (0.25 / sqrt(2)), 'y': 2.240},
+           'rot': radians(-45), },
+    'B6': {'size': BLOCK_SIZES['S6'],
+           'location': {'x': 3.54, 'y': 0.935},
+           'rot': 0, },
+    'B7': {'size': BLOCK_SIZES['S6'],
+           'location': {'x': 8.08 - 1.5 - 0.2, 'y': 4.480},
+           'rot': radians(-90), },
+    'B8': {'size': BLOCK_SIZES['S2'],
+           'location': {'x': 8.08 - 1.5 - 0.8, 'y': 2.140},
+           'rot': 0, },
+    'B9': {'size': BLOCK_SIZES['S6'],
+           'location': {'x': 8.08, 'y': 4.480 - 3.280},
+           'rot': radians(180), },
+}
+
+
+def block_corners(block_id):
+    '''Returns the world xy coordinates of the four floor corners of a block'''
+    block = ALL_BLOCKS[block_id]
+    x = block['size']['x']
+    y = block['size']['y']
+    rot = block['rot']
+    corners = []
+    for local_x, local_y in [(0, 0), (0, y), (x, y), (x, 0)]:
+        corners.append((block['location']['x'] + local_x * cos(rot) - local_y * sin(rot),
+                        block['location']['y'] + local_x * sin(rot) + local_y * cos(rot)))
+    return corners
+
+
+# Rectangles robots are spawned in, one robot per block
+SPAWN_BLOCKS = [
+    {
+        'block_name': 'A',
+        'x_range': (1.7, 2.9),
+        'y_range': (3.0, 3.8)
+    },
+    {
+        'block_name': 'B',
+        'x_range': (5.2, 5.8),
+        'y_range': (3.0, 3.8)
+    },
+    {
+        'block_name': 'C',
+        'x_range': (7.4, 7.4),
+        'y_range': (1.7, 3.5)
+    },
+    {
+        'block_name': 'D',
+        'x_range': (5.3, 6.3),
+        'y_range': (0.6, 1.5)
+    },
+    {
+        'block_name': 'E',
+        'x_range': (2.4, 2.9),
+        'y_range': (0.7, 1.5)
+    },
+    {
+        'block_name': 'F',
+        'x_range': (0.76, 0.76),
+        'y_range': (1, 2.5)
+    }
+]
+
+
+def sample_block_spawns(count, spawn_blocks):
+    '''
+    Returns count random (x, y, z) spawn positions, each in a different one of the given spawn blocks
+    Draws from the random module, so that seeding it reproduces the spawns
+    '''
+    if count > len(spawn_blocks):
+        raise ValueError(f'Cannot spawn {count} robots in {len(spawn_blocks)} spawn blocks')
+    # Shuffle a copy so that the block order does not depend on earlier simulations
+    spawn_blocks = random.sample(spawn_blocks, len(spawn_blocks))
+    positions = []
+    for spawn_block in spawn_blocks[:count]:
+        x = random.uniform(spawn_block['x_range'][0], spawn_block['x_range'][1])
+        y = random.uniform(spawn_block['y_range'][0], spawn_block['y_range'][1])
+        positions.append((x, y, ROBOT_Z))
+    return positions
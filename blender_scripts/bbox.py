@@ -0,0 +1,163 @@
+'''
+2D bounding boxes of the robots projected into every camera
+
+The bounding box corners of every robot part are read from the scene once per simulation, as offsets from the
+robot's origin. Robots only move and turn about z while simulating, so the corners of every part of every robot
+are moved and projected through all cameras in one batched NumPy step per frame. Boxes are the extent of the
+projected corners, clipped to the image, and do not account for occlusion.
+Does not import bpy, the scene helpers only read the objects they are given
+'''
+import numpy as np
+
+# Template names of the armor panel and light bar parts, see AIRobot.color_panels
+PANEL_PARTS = ('AM', 'LI')
+
+
+class BoundingBoxProjector():
+    '''
+    Projects the bounding boxes of every robot, and optionally of their panel parts, into every camera
+
+    :param part_names: template names of the parts, shared by every robot
+    :param corners: world space corners of every part when the simulation starts, [robots, parts, 8, 3]
+    :param origins: locations of the robots when the simulation starts, [robots, 3]
+    :param rotations: z rotations of the robots when the simulation starts, [robots]
+    '''
+
+    def __init__(self, part_names, corners, origins, rotations, include_panels=False):
+        self.part_names = list(part_names)
+        self.origins = np.asarray(origins, dtype=float)
+        self.offsets = np.asarray(corners, dtype=float) - self.origins[:, None, None]
+        self.start_rotations = np.asarray(rotations, dtype=float)
+        self.panels = [index for index, part in enumerate(self.part_names) if part.startswith(PANEL_PARTS)]
+        self.include_panels = include_panels and bool(self.panels)
+        self.view_projections = None
+        self.resolution = None
+
+    def set_cameras(self, view_projections, resolution):
+        '''
+        :param view_projections: projection @ world to camera matrix of every camera, [cameras, 4, 4]
+        :param resolution: (width, height) of the rendered images in pixels
+        '''
+        self.view_projections = np.asarray(view_projections, dtype=float)
+        self.resolution = np.asarray(resolution, dtype=float)
+
+    def corners(self, locations, rotations):
+        '''Returns the world space corners of every part for the given robot locations and z rotations'''
+        angle = np.asarray(rotations, dtype=float) - self.start_rotations
+        cos, sin = np.cos(angle)[:, None, None], np.sin(angle)[:, None, None]
+        x, y = self.offsets[..., 0], self.offsets[..., 1]
+        rotated = np.stack((x * cos - y * sin, x * sin + y * cos, self.offsets[..., 2]), axis=-1)
+        return rotated + np.asarray(locations, dtype=float)[:, None, None]
+
+    def robot_transforms(self, locations, rotations):
+        '''
+        Returns the [robots, 4, 4] transforms that move every robot from its start pose to the given locations
+        and z rotations, e.g. to find where a camera parented to a robot has moved to
+        '''
+        locations = np.asarray(locations, dtype=float)
+        angle = np.asarray(rotations, dtype=float) - self.start_rotations
+        transforms = np.tile(np.identity(4), (len(angle), 1, 1))
+        transforms[:, 0, 0] = transforms[:, 1, 1] = np.cos(angle)
+        transforms[:, 1, 0] = np.sin(angle)
+        transforms[:, 0, 1] = -transforms[:, 1, 0]
+        # Rotate about the start location, then move to the new location
+        transforms[:, :3, 3] = locations - np.einsum('rij,rj->ri', transforms[:, :3, :3], self.origins)
+        return transforms
+
+    def project(self, corners):
+        '''
+        Returns the pixel coordinates [cameras, ..., 2] of the given world space points [..., 3], and a mask of the
+        points in front of each camera. Pixel rows start at the top of the image
+        '''
+        points = np.concatenate((corners, np.ones(corners.shape[:-1] + (1,))), axis=-1)
+        clip = np.einsum('cij,...j->c...i', self.view_projections, points)
+        in_front = clip[..., 3] > 0
+        w = np.where(in_front, clip[..., 3], 1)
+        pixels = np.stack(((clip[..., 0] / w + 1) / 2 * self.resolution[0],
+                           (1 - clip[..., 1] / w) / 2 * self.resolution[1]), axis=-1)
+        return pixels, in_front
+
+    def boxes(self, pixels, in_front, axes):
+        '''
+        Returns [x_min, y_min, x_max, y_max] boxes of the extent of the pixels over the given axes, clipped to the
+        image, and a mask of the boxes that are fully in front of the camera and overlap the image
+        '''
+        box_min = pixels.min(axis=axes)
+        box_max = pixels.max(axis=axes)
+        visible = in_front.all(axis=axes) & np.all(box_max > 0, axis=-1) & np.all(box_min < self.resolution, axis=-1)
+        clipped = np.concatenate((np.clip(box_min, 0, self.resolution), np.clip(box_max, 0, self.resolution)), axis=-1)
+        return clipped, visible
+
+    def robot_boxes(self, locations, rotations):
+        '''
+        Returns the boxes of every robot in every camera as [cameras, robots, 4] with a [cameras, robots] visibility
+        mask, and the boxes of the panel parts as [cameras, robots, panels, 4] with their mask, or None
+        '''
+        pixels, in_front = self.project(self.corners(locations, rotations))
+        robot_boxes = self.boxes(pixels, in_front, axes=(2, 3))
+        if not self.include_panels:
+            return robot_boxes, None
+        panel_boxes = self.boxes(pixels[:, :, self.panels], in_front[:, :, self.panels], axes=3)
+        return robot_boxes, panel_boxes
+
+    def labels(self, locations, rotations, camera_names):
+        '''
+        Returns the bounding box labels of every robot, indexed like the robots, as a dict of camera name to box
+        Robots that are behind a camera or outside its image get a None box, and hidden panels are left out
+        The cameras must have been set with set_cameras()
+        '''
+        (boxes, visible), panels = self.robot_boxes(locations, rotations)
+        boxes = boxes.tolist()
+        labels = []
+        for robot in range(len(self.offsets)):
+            robot_labels = {'bbox': {}}
+            if panels is not None:
+                robot_labels['panel_bboxes'] = {}
+            for camera, camera_name in enumerate(camera_names):
+                robot_labels['bbox'][camera_name] = boxes[camera][robot] if visible[camera, robot] else None
+                if panels is not None:
+                    panel_boxes, panel_visible = panels
+                    robot_labels['panel_bboxes'][camera_name] = {
+                        self.part_names[part]: panel_boxes[camera, robot, index].tolist()
+                        for index, part in enumerate(self.panels) if panel_visible[camera, robot, index]
+                    }
+            labels.append(robot_labels)
+        return labels
+
+
+def projector_from_scene(scene, robot_names, include_panels=False):
+    '''
+    Returns a projector of the robots' current bounding box corners, without cameras
+    Must be called while the robots are at their start poses, after spawning and before simulating
+    '''
+    part_names = []
+    corners = []
+    for robot in robot_names:
+        base = scene.objects[robot]
+        # Robot parts are named after the robot, e.g. r1_base and r1_AM_F0
+        prefix = robot[:-len('base')]
+        parts = sorted((obj for obj in base.users_collection[0].objects if obj.type == 'MESH'),
+                       key=lambda obj: obj.name)
+        part_names = [obj.name[len(prefix):] for obj in parts]
+        robot_corners = []
+        for obj in parts:
+            matrix = np.array(obj.matrix_world)
+            robot_corners.append(np.array(obj.bound_box) @ matrix[:3, :3].T + matrix[:3, 3])
+        corners.append(robot_corners)
+
+    origins = [tuple(scene.objects[robot].location) for robot in robot_names]
+    rotations = [scene.objects[robot].rotation_euler.z for robot in robot_names]
+    return BoundingBoxProjector(part_names, corners, origins, rotations, include_panels)
+
+
+def render_resolution(scene):
+    '''Returns the (width, height) in pixels of the images rendered with the scene's current settings'''
+    scale = scene.render.resolution_percentage / 100
+    return int(scene.render.resolution_x * scale), int(scene.render.resolution_y * scale)
+
+
+def camera_projection(scene, camera, depsgraph, resolution):
+    '''Returns the projection matrix of a camera for images of the given resolution'''
+    return np.array(camera.calc_matrix_camera(depsgraph, x=resolution[0], y=resolution[1],
+                                              scale_x=scene.render.pixel_aspect_x,
+                                              scale_y=scene.render.pixel_aspect_y))
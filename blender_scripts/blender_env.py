@@ -1,52 +1,102 @@
 import sys
 import bpy
 import os
+import json
+import hashlib
 
 dirname = os.path.dirname(os.path.realpath(__file__))
 sys.path.append(dirname)
 
 from myrobot import AIRobot
+from arena import FIELD_X, FIELD_Y, WALL_WIDTH, WALL_HEIGHT, ALL_BLOCKS
+from markers import load_marker_atlas, make_marker_material, get_base_uvs, set_marker_uvs, NUM_MARKERS, \
+    MARKER_TEXTURE_PATH, CACHE_PATH
 
 import numpy as np
 import sys
 from random import random
 from random import randint
 from random import uniform
-from math import radians, sqrt
+from math import radians
 from math import pi as PI
 
 blender_path = os.path.join(os.getcwd(), 'blender_scripts')
 if not blender_path in sys.path:
     sys.path.append(blender_path)
 
-from render import render
+from render import render, parse_render_args, seed_scene
+from calibrate import calibrate
+from profiler import profiler
 
-FIELD_X = 8.08  # length
-FIELD_Y = 4.48  # width
 BASE_TEXTURE_PATH = os.path.join(os.getcwd(), "assets/base_v1.png")
-MARKER_TEXTURE_PATH = os.path.join(os.getcwd(), "assets/vision_markers/")
 
-WALL_WIDTH = 0.410
-WALL_HEIGHT = 0.50
 WALL_COLOR = (44 / 255, 44 / 255, 44 / 255, 1)  # #2C2C2C hex color
 BLOCK_COLOR = (139 / 255, 139 / 255, 139 / 255, 1)  # #8B8B8B hex color
 
+# The static arena (field, blocks, markers and robots) is built once and saved as a .blend in the cache,
+# later runs append it and only apply the per-run randomization
+USE_ARENA_SNAPSHOT = True
+# Bump to invalidate saved snapshots when the scene construction changes in a way the cache key misses
+ARENA_SNAPSHOT_VERSION = 1
+ARENA_COLLECTIONS = ['field', 'blocks', 'robots']
+
+
+def arena_snapshot_path():
+    '''
+    Returns the path of the arena snapshot, named by a hash of the arena constants, the assets,
+    the scene construction code and the Blender version
+    '''
+    key = hashlib.sha256(json.dumps({
+        'version': ARENA_SNAPSHOT_VERSION,
+        'blender': bpy.app.version_string,
+        'field': (FIELD_X, FIELD_Y, WALL_WIDTH, WALL_HEIGHT),
+        'blocks': ALL_BLOCKS,
+    }, sort_keys=True).encode())
+
+    assets = [AIRobot.FBX_PATH, BASE_TEXTURE_PATH]
+    assets.extend(os.path.join(MARKER_TEXTURE_PATH, filename) for filename in sorted(os.listdir(MARKER_TEXTURE_PATH)))
+    assets.extend(os.path.join(dirname, source) for source in ['blender_env.py', 'myrobot.py', 'markers.py'])
+    for asset in assets:
+        with open(asset, 'rb') as f:
+            key.update(f.read())
+    return os.path.join(CACHE_PATH, f'arena_{key.hexdigest()[:16]}.blend')
+
 
 class BlenderEnv():
     # constants
 
-    def __init__(self):
+    def __init__(self, use_snapshot=USE_ARENA_SNAPSHOT):
         self.clear_env()
 
+        snapshot_path = arena_snapshot_path()
+        if use_snapshot and os.path.isfile(snapshot_path):
+            self.load_arena(snapshot_path)
+        else:
+            self.build_arena()
+            if use_snapshot:
+                self.save_arena(snapshot_path)
+
+        # Lights are randomized on every run, so they are not part of the snapshot
+        self.lights_collection = bpy.data.collections.new('lights')
+        bpy.context.scene.collection.children.link(self.lights_collection)
+
+        # self.make_lights('POINT', 10, 75, 60)
+        # self.make_lights('POINT', 10, 75, 60, light_color=(1,1,1))
+        # self.make_lights('SPOT', 10, 150, 60)
+        self.make_lights('SPOT', 15, 150, 60, light_color=(1, 1, 1))
+
+        self.randomize_markers()
+        self.randomize_robot_poses()
+
+    def build_arena(self):
+        '''Builds the static part of the scene: field, wall, blocks, markers and robots'''
         # Make collections
         self.field_collection = bpy.data.collections.new('field')
-        self.lights_collection = bpy.data.collections.new('lights')
         self.blocks_collection = bpy.data.collections.new('blocks')
         self.robots_collection = bpy.data.collections.new('robots')
-        
+
         # Add collections to scene
         bpy.context.scene.collection.children.link(self.field_collection)
-        bpy.context.scene.collection.children.link(self.lights_collection)
         bpy.context.scene.collection.children.link(self.blocks_collection)
         bpy.context.scene.collection.children.link(self.robots_collection)
 
@@ -55,31 +105,46 @@ class BlenderEnv():
         self.make_wall()
         self.make_blocks()
 
-        # self.make_lights('POINT', 10, 75, 60)
-        # self.make_lights('POINT', 10, 75, 60, light_color=(1,1,1))
-        # self.make_lights('SPOT', 10, 150, 60)
-        self.make_lights('SPOT', 15, 150, 60, light_color=(1, 1, 1))
-
         self.robots = {}
         self.robots['r1'] = AIRobot('r1', self.robots_collection, 'blue')
         self.robots['r2'] = AIRobot('r2', self.robots_collection, 'blue')
         self.robots['r3'] = AIRobot('r3', self.robots_collection, 'red')
         self.robots['r4'] = AIRobot('r4', self.robots_collection, 'red')
-        
-        #random spawning and rotation, for demo only
-        for robot in self.robots.values():
-            robot_box = 0.2
-            x = uniform(robot_box, FIELD_X-robot_box)
-            y = uniform(robot_box, FIELD_Y-robot_box)
-            theta = uniform(0, 2*PI)
-            theta_yaw = uniform(-PI/2, PI/2)
-            theta_pitch = uniform(-PI/6, PI/6)
 
-            robot.base_obj.location = (x, y, 0)
-            robot.base_obj.delta_rotation_euler = (0, 0, 0)
-            robot.barrel_obj.delta_rotation_euler = (theta_pitch, 0, 0)
-            robot.yaw_obj.delta_rotation_euler = (0, 0, theta_yaw)
+    def save_arena(self, snapshot_path):
+        '''Saves the static arena collections and everything they use to a .blend'''
+        if not os.path.isdir(CACHE_PATH):
+            os.makedirs(CACHE_PATH)
+        # Write to a temporary file first, so that concurrent workers never load a partly written snapshot
+        temp_path = f'{snapshot_path}.{os.getpid()}.tmp'
+        bpy.data.libraries.write(temp_path, {self.field_collection, self.blocks_collection, self.robots_collection},
+                                 fake_user=True)
+        os.replace(temp_path, snapshot_path)
+
+    def load_arena(self, snapshot_path):
+        '''Appends the static arena collections from a snapshot and restores the references to their objects'''
+        with bpy.data.libraries.load(snapshot_path, link=False) as (data_from, data_to):
+            data_to.collections = [name for name in data_from.collections if name in ARENA_COLLECTIONS]
+
+        collections = {collection.name: collection for collection in data_to.collections}
+        self.field_collection = collections['field']
+        self.blocks_collection = collections['blocks']
+        self.robots_collection = collections['robots']
+        for collection in data_to.collections:
+            bpy.context.scene.collection.children.link(collection)
 
+        self.blocks = {}
+        self.markers = []
+        for obj in self.blocks_collection.objects:
+            if obj.name.startswith('block_'):
+                self.blocks[obj.name.split('_')[1]] = obj
+            else:
+                self.markers.append((obj.data, get_base_uvs(obj.data)))
+
+        self.robots = {}
+        for collection in self.robots_collection.children:
+            name = collection.name[:-len('_collection')]
+            self.robots[name] = AIRobot.from_collection(name, collection)
 
     def make_base(self):
         '''base of field'''
@@ -163,43 +228,6 @@ class BlenderEnv():
 
     def make_blocks(self):
         ''' Makes all blocks '''
-        # block name, size, location and rotation maps
-        block_sizes = {
-            'S6': {'x': 1, 'y': 0.2, 'z': 0.4, },
-            'S2': {'x': 0.8, 'y': 0.2, 'z': 0.4, },
-            'S1': {'x': 0.25, 'y': 0.25, 'z': 0.4, },
-        }
-
-        all_blocks = {
-            'B1': {'size': block_sizes['S6'],
-                   'location': {'x': 0, 'y': 3.280},
-                   'rot': 0, },
-            'B2': {'size': block_sizes['S2'],
-                   'location': {'x': 1.5, 'y': 2.140},
-                   'rot': 0, },
-            'B3': {'size': block_sizes['S6'],
-                   'location': {'x': 1.5 + 0.2, 'y': 0},
-                   'rot': radians(90), },
-            'B4': {'size': block_sizes['S6'],
-                   'location': {'x': 3.54, 'y': 4.48 - 0.935 - 0.2},
-                   'rot': radians(0), },
-            'B5': {'size': block_sizes['S1'],
-                   'location': {'x': 4.04 - (0.25 / sqrt(2)), 'y': 2.240},
-                   'rot': radians(-45), },
-            'B6': {'size': block_sizes['S6'],
-                   'location': {'x': 3.54, 'y': 0.935},
-                   'rot': 0, },
-            'B7': {'size': block_sizes['S6'],
-                   'location': {'x': 8.08 - 1.5 - 0.2, 'y': 4.480},
-                   'rot': radians(-90), },
-            'B8': {'size': block_sizes['S2'],
-                   'location': {'x': 8.08 - 1.5 - 0.8, 'y': 2.140},
-                   'rot': 0, },
-            'B9': {'size': block_sizes['S6'],
-                   'location': {'x': 8.08, 'y': 4.480 - 3.280},
-                   'rot': radians(180), },
-        }
-
         def generate_block_mesh(size, block_id):
             'x, y, z are length width and height of block'
             x = size['x']
@@ -227,11 +255,11 @@ class BlenderEnv():
             return block_obj
 
         self.blocks = {}
-        for block in all_blocks:
-            self.blocks[block] = generate_block_mesh(all_blocks[block]['size'], block)
-            self.blocks[block].delta_location[0] = all_blocks[block]['location']['x']
-            self.blocks[block].delta_location[1] = all_blocks[block]['location']['y']
-            self.blocks[block].delta_rotation_euler[2] = all_blocks[block]['rot']
+        for block in ALL_BLOCKS:
+            self.blocks[block] = generate_block_mesh(ALL_BLOCKS[block]['size'], block)
+            self.blocks[block].delta_location[0] = ALL_BLOCKS[block]['location']['x']
+            self.blocks[block].delta_location[1] = ALL_BLOCKS[block]['location']['y']
+            self.blocks[block].delta_rotation_euler[2] = ALL_BLOCKS[block]['rot']
 
         # create texture on plane for image
         block_mat = bpy.data.materials.new(name="block_mat")
@@ -243,33 +271,6 @@ class BlenderEnv():
         for block_id in self.blocks:
             self.blocks[block_id].data.materials.append(block_mat)
 
-        def get_mat(index):
-
-            # Add random image as texture from image markers
-            image_filename = '00' + str(randint(1, 44)).zfill(2) + '.jpg'
-            img = bpy.data.images.load(filepath=MARKER_TEXTURE_PATH + image_filename)
-
-            mat = bpy.data.materials.get("mat-" + str(index))
-            if mat is None:
-                mat = bpy.data.materials.new(name="mat-" + str(index))
-
-            mat.use_nodes = True
-
-            list_of_nodes = mat.node_tree.nodes.keys()
-            if "Image Texture" in list_of_nodes:
-                old_node = mat.node_tree.nodes["Image Texture"]
-                mat.node_tree.nodes.remove(old_node)
-
-            node_tree = bpy.data.materials["mat-" + str(index)].node_tree
-            bsdf = mat.node_tree.nodes["Principled BSDF"]
-            texture_node = node_tree.nodes.new('ShaderNodeTexImage')
-
-            texture_node.image = img
-
-            mat.node_tree.links.new(bsdf.inputs['Base Color'], texture_node.outputs['Color'])
-
-            return mat
-
         def generate_marker_plane(index, marker_info):
 
             name, attributes = marker_info
@@ -286,14 +287,11 @@ class BlenderEnv():
 
             self.blocks_collection.objects.link(d)
             d.parent = self.blocks['B' + name[1]]
-            
-            mat = get_mat(index)
+
             d.delta_location = attributes['location']
             d.delta_rotation_euler = attributes['rotation']
-            if d.data.materials:
-                d.data.materials[0] = mat
-            else:
-                d.data.materials.append(mat)
+            d.data.materials.append(marker_mat)
+            self.markers.append((m, get_base_uvs(m)))
             mod = d.modifiers.new(name + '_mod', 'SOLIDIFY')
             mod.thickness = -0.0005
             mod.offset = 1
@@ -346,6 +344,9 @@ class BlenderEnv():
             'E9-3': {'location': (0.5, 0.2, 0.2), 'rotation': (radians(-90), radians(180), 0)},
         }
 
+        # All markers share one material and pick their image from the atlas through their UVs
+        marker_mat = make_marker_material(load_marker_atlas())
+        self.markers = []
         for i, marker in enumerate(all_markers.items()):
             generate_marker_plane(i, marker)
 
@@ -353,13 +354,22 @@ class BlenderEnv():
         # use children relative locations for blocks
         # ie set parent of plane to be a block, then set the delta_location and delta_rotation_euler to desired location
 
+    def randomize_markers(self):
+        '''Assigns a random marker image to every marker plane by rewriting its UVs'''
+        for mesh, base_uvs in self.markers:
+            set_marker_uvs(mesh, base_uvs, randint(0, NUM_MARKERS - 1))
+
     def make_lights(self, type_of_light, number_of_lights, base_power, power_variance,
                     light_color='random', color_min=0, color_max=1):
         '''Generate randomly placed lights around the base'''
-
-        # Get size of field to generate range of positions
-        base_loc = np.array(self.field_collection.objects['base_obj'].location)
-        base_dim = np.array(self.field_collection.objects['base_obj'].dimensions)
+        # Kept so that randomize_lights can draw new values from the same ranges
+        self.light_settings = {
+            'base_power': base_power,
+            'power_variance': power_variance,
+            'light_color': light_color,
+            'color_min': color_min,
+            'color_max': color_max
+        }
 
         for _ in range(number_of_lights):
             # Create light datablock, set attributes
@@ -370,27 +380,65 @@ class BlenderEnv():
                 light_data.spot_blend = 0.1
                 light_data.spot_size = 1.5
 
-            # Calculate random power value
-            light_data.energy = random() * power_variance + base_power
-
-            # Choose light color
-            if light_color == 'random':
-                light_data.color = tuple(np.random.uniform(color_min, color_max, 3))
-            else:
-                light_data.color = light_color
-
             # Make new light object
             light_object = bpy.data.objects.new(name="light", object_data=light_data)
-
-            # Set random location near arena
-            x_coord = np.random.randint(-base_dim[0] / 1.5, base_dim[0] / 1.5)
-            y_coord = np.random.randint(-base_dim[1] / 1.5, base_dim[1] / 1.5)
-            z_coord = np.random.randint(3, 6, size=1)
-            light_object.location = tuple(base_loc + base_dim / 2 + (x_coord, y_coord, z_coord))
+            self.randomize_light(light_object, **self.light_settings)
 
             # add to collections
             self.lights_collection.objects.link(light_object)
 
+    def randomize_light(self, light_object, base_power, power_variance, light_color='random', color_min=0,
+                        color_max=1):
+        '''Sets a random power, color and location near the arena on an existing light'''
+        # Get size of field to generate range of positions
+        base_loc = np.array(self.field_collection.objects['base_obj'].location)
+        base_dim = np.array(self.field_collection.objects['base_obj'].dimensions)
+
+        # Calculate random power value
+        light_object.data.energy = random() * power_variance + base_power
+
+        # Choose light color
+        if light_color == 'random':
+            light_object.data.color = tuple(np.random.uniform(color_min, color_max, 3))
+        else:
+            light_object.data.color = light_color
+
+        # Set random location near arena
+        x_coord = np.random.randint(-base_dim[0] / 1.5, base_dim[0] / 1.5)
+        y_coord = np.random.randint(-base_dim[1] / 1.5, base_dim[1] / 1.5)
+        z_coord = np.random.randint(3, 6, size=1)
+        light_object.location = tuple(base_loc + base_dim / 2 + (x_coord, y_coord, z_coord))
+
+    def randomize_lights(self, light_color=None):
+        '''
+        Re-randomizes every existing light in place
+        light_color overrides the color setting given to make_lights, e.g. 'random' to vary fixed color lights
+        '''
+        settings = dict(self.light_settings)
+        if light_color is not None:
+            settings['light_color'] = light_color
+        for light_object in self.lights_collection.objects:
+            self.randomize_light(light_object, **settings)
+
+    def randomize_robot_poses(self):
+        '''Random turret yaw and barrel pitch for every robot, locations are set when robots are spawned'''
+        for robot in self.robots.values():
+            theta_yaw = uniform(-PI/2, PI/2)
+            theta_pitch = uniform(-PI/6, PI/6)
+
+            robot.base_obj.delta_rotation_euler = (0, 0, 0)
+            robot.barrel_obj.delta_rotation_euler = (theta_pitch, 0, 0)
+            robot.yaw_obj.delta_rotation_euler = (0, 0, theta_yaw)
+
+    def randomize(self, light_color=None):
+        '''
+        Domain randomization between simulations: mutates the lights, markers and robot poses in place
+        without creating or deleting any objects. Seed the random generators first for reproducible results
+        '''
+        self.randomize_lights(light_color)
+        self.randomize_markers()
+        self.randomize_robot_poses()
+
     def clear_env(self):
         '''Function to clean environment'''
         data_blocks = [
@@ -417,5 +465,8 @@ class BlenderEnv():
 # blender_env = BlenderEnv()
 # print(type(__name__))
 if __name__ == '__main__' or __name__ == '<run_path>':
-    blender_env = BlenderEnv()
-    render()
+    seed_scene(parse_render_args(sys.argv).seed)
+    with profiler.stage('scene_build'):
+        blender_env = BlenderEnv()
+    render(blender_env)
+    calibrate(blender_env)
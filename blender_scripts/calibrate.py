@@ -0,0 +1,219 @@
+"""
+Render quality auto-tuner
+
+Renders reference frames of the arena with many samples, then measures the time per frame and the SSIM and PSNR
+against the references of Cycles settings derived from the configured render profile. The fastest setting that
+meets the quality target on every reference frame is saved as a render profile to render.TUNED_PROFILES_PATH,
+together with every measured setting in calibration.json in the output directory. Run with
+blender -b -P blender_scripts/blender_env.py -- calibrate --render-profile cpu-cycles --target-ssim 0.97
+then render with --render-profile tuned. Tuned profiles only hold for the machine they were measured on.
+
+Quality is assumed to grow with the sample count, so the lowest passing sample count of every combination of the
+other settings is found by bisection instead of rendering every sample count.
+"""
+import os
+import sys
+import json
+import time
+import logging
+import datetime
+import platform
+import itertools
+import bpy
+import numpy as np
+
+from render import render_configs, render_profiles, ROBOT_NAMES, parse_render_args, apply_render_args, \
+    apply_render_profile, initialise_camera, seed_simulation, jitter_cameras, spawn_robots, make_spawn_sampler, \
+    save_tuned_profile
+from image_writer import add_viewer_node, read_viewer_pixels, to_display
+from quality import ssim, psnr
+
+logger = logging.getLogger(__name__)
+
+# Settings that are searched, sample counts in increasing order
+CALIBRATION_SPACE = {
+    'samples': [1, 2, 4, 8, 16, 32, 64, 128],
+    'max_bounces': [1, 2, 4, 8],
+    'adaptive_threshold': [0.01, 0.05, 0.1],
+    'denoise': [False, True],
+    'tile_size': [32, 64, 128, 256]
+}
+REFERENCE_BOUNCES = 12
+# Blender's default noise threshold of adaptive sampling
+DEFAULT_ADAPTIVE_THRESHOLD = 0.01
+
+
+class Calibrator():
+    """
+    Renders the reference frames and measures settings against them
+    Every reference frame is set up from its own seed like a simulation, so it is reproduced exactly for every
+    setting, and rendered by one of the cameras in turn
+    """
+
+    def __init__(self, scene, camera_objects, base_profile, target_ssim, target_psnr=None, blender_env=None):
+        self.scene = scene
+        self.cameras = list(camera_objects.values())
+        self.camera_objects = camera_objects
+        self.base_profile = base_profile
+        self.target_ssim = target_ssim
+        self.target_psnr = target_psnr
+        self.blender_env = blender_env
+        self.spawn_sampler = make_spawn_sampler()
+        self.references = []
+        self.results = []
+
+    def set_frame(self, frame):
+        seed_simulation(frame)
+        if render_configs['domain_randomization']:
+            if self.blender_env is not None:
+                self.blender_env.randomize(render_configs['randomized_light_color'])
+            if any(render_configs['camera_jitter'].values()):
+                jitter_cameras(self.camera_objects, frame)
+        spawn_robots(ROBOT_NAMES, render_configs['spawn_blocks'], self.spawn_sampler, render_configs['spawn_teams'])
+        self.scene.camera = self.cameras[frame % len(self.cameras)]
+
+    def render(self, profile):
+        """Returns the render time in seconds and the grayscale display image [height, width] of a render"""
+        apply_render_profile(self.scene, profile)
+        start = time.perf_counter()
+        bpy.ops.render.render()
+        seconds = time.perf_counter() - start
+        gray = to_display(read_viewer_pixels(), {'color_mode': 'BW', 'bit_depth': 16})[..., 0] / 65535
+        return seconds, gray
+
+    def render_references(self, frame_count, reference_samples):
+        profile = dict(self.base_profile, samples=reference_samples, max_bounces=REFERENCE_BOUNCES,
+                       adaptive_sampling=False, denoise=False)
+        # The first render also compiles kernels and builds the scene, which would be timed with the first setting
+        self.set_frame(0)
+        self.render(self.base_profile)
+        for frame in range(frame_count):
+            self.set_frame(frame)
+            self.references.append(self.render(profile)[1])
+            logger.info('Rendered reference frame %d of %d', frame + 1, frame_count)
+
+    def evaluate(self, settings):
+        """
+        Renders every reference frame with the settings applied to the base profile
+        Returns the median time per frame, the lowest SSIM and PSNR and whether both meet the target
+        """
+        profile = dict(self.base_profile, adaptive_sampling=True, **settings)
+        times = []
+        ssims = []
+        psnrs = []
+        for frame, reference in enumerate(self.references):
+            self.set_frame(frame)
+            seconds, gray = self.render(profile)
+            times.append(seconds)
+            ssims.append(ssim(gray, reference))
+            psnrs.append(psnr(gray, reference))
+        result = {
+            'settings': settings,
+            'seconds_per_frame': float(np.median(times)),
+            'ssim': min(ssims),
+            'psnr': min(psnrs)
+        }
+        result['passed'] = result['ssim'] >= self.target_ssim and \
+            (self.target_psnr is None or result['psnr'] >= self.target_psnr)
+        self.results.append(result)
+        logger.info('%s: %.3fs per frame, SSIM %.4f, PSNR %.2f dB%s', settings, result['seconds_per_frame'],
+                    result['ssim'], result['psnr'], '' if result['passed'] else ', below target')
+        return result
+
+    def lowest_passing_samples(self, settings):
+        """Returns the result of the lowest sample count that meets the target with the other settings, or None"""
+        samples = CALIBRATION_SPACE['samples']
+        low, high = 0, len(samples) - 1
+        passing = None
+        while low <= high:
+            middle = (low + high) // 2
+            result = self.evaluate(dict(settings, samples=samples[middle]))
+            if result['passed']:
+                passing = result
+                high = middle - 1
+            else:
+                low = middle + 1
+        return passing
+
+    def search(self):
+        """Returns the result of the fastest setting that meets the target, or None"""
+        # The tile size only changes the speed, so it is picked first with the base profile's quality settings
+        tile_results = [self.evaluate({
+            'samples': self.base_profile['samples'],
+            'max_bounces': self.base_profile['max_bounces'],
+            'adaptive_threshold': self.base_profile.get('adaptive_threshold', DEFAULT_ADAPTIVE_THRESHOLD),
+            'denoise': self.base_profile.get('denoise', False),
+            'tile_size': tile_size
+        }) for tile_size in CALIBRATION_SPACE['tile_size']]
+        tile_size = min(tile_results, key=lambda result: result['seconds_per_frame'])['settings']['tile_size']
+
+        passing = [result for result in tile_results if result['passed']]
+        for denoise, max_bounces, adaptive_threshold in itertools.product(
+                CALIBRATION_SPACE['denoise'], CALIBRATION_SPACE['max_bounces'],
+                CALIBRATION_SPACE['adaptive_threshold']):
+            result = self.lowest_passing_samples({
+                'max_bounces': max_bounces,
+                'adaptive_threshold': adaptive_threshold,
+                'denoise': denoise,
+                'tile_size': tile_size
+            })
+            if result is not None:
+                passing.append(result)
+        if not passing:
+            return None
+        return min(passing, key=lambda result: result['seconds_per_frame'])
+
+
+def calibrate(blender_env=None):
+    """
+    Finds and saves the fastest render profile that meets the quality target given on the command line
+    blender_env is re-randomized for every reference frame when domain randomization is enabled
+    """
+    render_args = parse_render_args(sys.argv)
+    if render_args.command != 'calibrate':
+        return
+    apply_render_args(render_args)
+    logging.basicConfig(level=render_configs['log_level'], format='%(asctime)s %(name)s %(levelname)s: %(message)s')
+    base_name = render_configs['render_profile']
+    base_profile = render_profiles[base_name]
+    if base_profile['engine'] != 'CYCLES':
+        raise ValueError(f"Calibration tunes Cycles settings, but profile {base_name} uses {base_profile['engine']}")
+    os.makedirs(render_configs['output_path'], exist_ok=True)
+    if render_configs['seed'] is None:
+        render_configs['seed'] = 0
+
+    start_time = time.time()
+    scene = bpy.data.scenes[0]
+    cameras = {}
+    for index in render_configs['active_cameras']:
+        camera_config = render_configs['cameras'][index]
+        cameras[index] = initialise_camera(camera_config['location'], camera_config['rotation'])
+    add_viewer_node(scene)
+
+    calibrator = Calibrator(scene, cameras, base_profile, render_args.target_ssim, render_args.target_psnr,
+                            blender_env)
+    calibrator.render_references(render_args.calibration_frames, render_args.reference_samples)
+    best = calibrator.search()
+
+    with open(os.path.join(render_configs['output_path'], 'calibration.json'), 'w') as f:
+        json.dump({'base_profile': base_name, 'results': calibrator.results}, f, indent=4)
+    if best is None:
+        raise RuntimeError(f"No setting met the quality target, see {render_configs['output_path']}/calibration.json")
+
+    profile = dict(base_profile, adaptive_sampling=True, **best['settings'])
+    profile['calibration'] = {
+        'base_profile': base_name,
+        'seconds_per_frame': best['seconds_per_frame'],
+        'ssim': best['ssim'],
+        'psnr': best['psnr'],
+        'target_ssim': render_args.target_ssim,
+        'target_psnr': render_args.target_psnr,
+        'reference_frames': render_args.calibration_frames,
+        'reference_samples': render_args.reference_samples,
+        'machine': platform.node(),
+        'blender': bpy.app.version_string,
+        'date': datetime.date.today().isoformat()
+    }
+    save_tuned_profile(render_args.tuned_profile, profile)
+    logger.info('Saved profile %s with %s, %.3fs per frame, after calibrating for %.2fs', render_args.tuned_profile,
+                best['settings'], best['seconds_per_frame'], time.time() - start_time)
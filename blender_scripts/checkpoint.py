@@ -0,0 +1,155 @@
+"""
+Job manifests and simulation checkpoints for resuming preempted render jobs
+
+The manifest in <output>/job.json records the seed and settings of a job, and for every simulation the spawn poses
+of the robots, the frame of its last checkpoint and whether it completed. A checkpoint holds the movement state of
+the robots, the NumPy random state and the trajectory so far, so a resumed simulation continues from its last
+checkpoint instead of frame 0, and frames before it that lost their outputs are re-rendered from the trajectory.
+Both are written to a temporary file that is then renamed, so a preemption never leaves them half written.
+"""
+import os
+import json
+import numpy as np
+
+from labels import read_label_records
+
+MANIFEST_FILE = 'job.json'
+CHECKPOINT_PATH = 'checkpoints'
+ROBOT_STATE_FIELDS = ('position', 'bearing', 'translation_speed', 'scan_radius', 'is_turning', 'rotation_direction')
+
+
+class JobManifest():
+    """
+    Loads the manifest of a job from its output directory, or starts a new one
+    A job can only be resumed with the settings it was started with, as its outputs would not match otherwise
+    """
+
+    def __init__(self, output_path, settings):
+        self.output_path = output_path
+        self.path = os.path.join(output_path, MANIFEST_FILE)
+        # Settings are compared after a JSON round trip, which turns tuples into lists
+        settings = json.loads(json.dumps(settings))
+        if os.path.isfile(self.path):
+            with open(self.path) as f:
+                self.manifest = json.load(f)
+            if self.manifest['settings'] != settings:
+                raise ValueError(f'{output_path} holds a job with other settings, render to another output directory')
+        else:
+            self.manifest = {'seed': None, 'settings': settings, 'simulations': {}}
+
+    @property
+    def seed(self):
+        return self.manifest['seed']
+
+    def set_seed(self, seed):
+        if self.manifest['seed'] is not None and self.manifest['seed'] != seed:
+            raise ValueError(f"{self.output_path} holds a job started with seed {self.manifest['seed']}, not {seed}")
+        self.manifest['seed'] = seed
+        self.save()
+
+    def simulation(self, sim_no):
+        return self.manifest['simulations'].setdefault(sim_no, {'spawn': None, 'checkpoint': None, 'complete': False})
+
+    def is_complete(self, sim_no):
+        return sim_no in self.manifest['simulations'] and self.manifest['simulations'][sim_no]['complete']
+
+    def spawn(self, sim_no):
+        """Returns the recorded spawn locations [robots, 3] and z rotations [robots] of a simulation, or None"""
+        spawn = self.simulation(sim_no)['spawn']
+        if spawn is None:
+            return None
+        return np.array(spawn['locations']), np.array(spawn['rotations'])
+
+    def record_spawn(self, sim_no, locations, rotations):
+        self.simulation(sim_no)['spawn'] = {
+            'locations': np.asarray(locations).tolist(),
+            'rotations': np.asarray(rotations).tolist()
+        }
+        self.save()
+
+    def save_checkpoint(self, sim_no, frame, robot_state, locations, rotations):
+        """Saves the state of a simulation after the given frame has been simulated"""
+        save_checkpoint(self.checkpoint_path(sim_no), frame, robot_state, locations, rotations)
+        self.simulation(sim_no)['checkpoint'] = frame
+        self.save()
+
+    def load_checkpoint(self, sim_no):
+        """Returns the last checkpoint of a simulation as a dict, see save_checkpoint, or None"""
+        if self.simulation(sim_no)['checkpoint'] is None:
+            return None
+        return load_checkpoint(self.checkpoint_path(sim_no))
+
+    def checkpoint_path(self, sim_no):
+        return os.path.join(self.output_path, CHECKPOINT_PATH, f'{sim_no}.npz')
+
+    def complete(self, sim_no):
+        self.simulation(sim_no)['complete'] = True
+        self.save()
+
+    def save(self):
+        temp_path = f'{self.path}.tmp'
+        with open(temp_path, 'w') as f:
+            json.dump(self.manifest, f, indent=4)
+        os.replace(temp_path, self.path)
+
+
+def save_checkpoint(path, frame, robot_state, locations, rotations):
+    """
+    Saves the movement state of the robots, the NumPy random state and the locations [frames, robots, 3] and
+    z rotations [frames, robots] of every frame up to and including the given frame
+    """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    _, keys, position, has_gauss, cached_gaussian = np.random.get_state()
+    state = {field: getattr(robot_state, field) for field in ROBOT_STATE_FIELDS}
+    temp_path = f'{path}.tmp'
+    with open(temp_path, 'wb') as f:
+        np.savez(f, frame=frame, locations=locations[:frame + 1], rotations=rotations[:frame + 1],
+                 random_keys=keys, random_position=position, random_has_gauss=has_gauss,
+                 random_cached_gaussian=cached_gaussian, **state)
+    os.replace(temp_path, path)
+
+
+def load_checkpoint(path):
+    with np.load(path) as checkpoint:
+        return {name: checkpoint[name] for name in checkpoint.files}
+
+
+def restore_checkpoint(checkpoint, robot_state):
+    """Restores the movement state of the robots and the NumPy random state, returns the checkpoint's frame"""
+    for field in ROBOT_STATE_FIELDS:
+        setattr(robot_state, field, checkpoint[field].copy())
+    np.random.set_state(('MT19937', checkpoint['random_keys'], int(checkpoint['random_position']),
+                         int(checkpoint['random_has_gauss']), float(checkpoint['random_cached_gaussian'])))
+    return int(checkpoint['frame'])
+
+
+def labelled_frames(jsonl_path):
+    """
+    Returns the set of robots labelled in every (simulation, frame) of a JSON Lines label file
+    """
+    labelled = {}
+    if os.path.isfile(jsonl_path):
+        for record in read_label_records(jsonl_path):
+            labelled.setdefault((record['simulation'], record['frame']), set()).add(record['robot'])
+    return labelled
+
+
+def valid_image(path):
+    """
+    Returns whether an image file exists and is complete, judged by the end marker of PNGs and JPEGs and the
+    header size of WebPs
+    """
+    if not os.path.isfile(path) or os.path.getsize(path) == 0:
+        return False
+    size = os.path.getsize(path)
+    with open(path, 'rb') as f:
+        head = f.read(12)
+        f.seek(max(0, size - 12))
+        tail = f.read()
+    if path.endswith('.png'):
+        return head.startswith(b'\x89PNG') and tail.endswith(b'IEND\xaeB`\x82')
+    if path.endswith('.jpg'):
+        return head.startswith(b'\xff\xd8') and tail.endswith(b'\xff\xd9')
+    if path.endswith('.webp'):
+        return head.startswith(b'RIFF') and int.from_bytes(head[4:8], 'little') + 8 == size
+    return True
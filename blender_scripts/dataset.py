@@ -0,0 +1,181 @@
+"""
+Sharded dataset container for rendered frames and their labels
+
+DatasetWriter packs every frame into a WebDataset-style sample, the images of every camera and a JSON of every
+robot's labels stored as consecutive members of a tar shard named <key>.<name>, e.g.
+simulation_number0-frame12.camera0.png and simulation_number0-frame12.json. Once a shard would grow past
+max_shard_size bytes the next one is started, so a run writes a few large files that can be streamed sequentially
+with iter_samples. index.jsonl records the shard, data offset and size of every member, which DatasetReader uses to
+read single samples without scanning the shards.
+"""
+import io
+import os
+import json
+import math
+import time
+import tarfile
+from concurrent.futures import Future
+
+from labels import read_label_records, truncate_partial_record
+from write_queue import WriteQueue
+
+DEFAULT_SHARD_SIZE = 256 * 1024 ** 2
+INDEX_FILE = 'index.jsonl'
+
+
+def sample_key(sim_no, frame):
+    """Returns the key of a frame's sample, keys must not contain dots as those separate the member names"""
+    return f'{sim_no}-frame{frame}'
+
+
+def shard_name(shard_number):
+    return f'shard-{shard_number:06d}.tar'
+
+
+class DatasetWriter():
+    """
+    Writes samples to tar shards of at most max_shard_size bytes, unless a single sample is larger
+
+    Samples are written in order by a background thread, which waits for members that are still being encoded.
+    At most max_pending samples are queued
+    With append, a resumed job adds new shards after the existing ones and appends to their index
+    """
+
+    def __init__(self, path, max_shard_size=DEFAULT_SHARD_SIZE, max_pending=16, append=False):
+        os.makedirs(path, exist_ok=True)
+        self.path = path
+        self.max_shard_size = max_shard_size
+        self.shard_number = -1
+        if append:
+            self.shard_number += len([filename for filename in os.listdir(path) if filename.endswith('.tar')])
+            truncate_partial_record(os.path.join(path, INDEX_FILE))
+        self.tar = None
+        self.index = open(os.path.join(path, INDEX_FILE), 'a' if append else 'w')
+        # A single thread keeps the members of a sample together and the samples in order
+        self.queue = WriteQueue(1, max_pending)
+
+    def write(self, key, members):
+        """
+        :param members: dict of member name to its bytes, a future of its bytes or a JSON serializable label
+        """
+        self.queue.submit(key, self.write_sample, key, members)
+
+    def write_sample(self, key, members):
+        data = {}
+        for name, member in members.items():
+            if isinstance(member, Future):
+                member = member.result()
+            if not isinstance(member, bytes):
+                member = json.dumps(member).encode()
+            data[name] = member
+
+        # Every member takes a 512 byte header and is padded to a multiple of 512 bytes
+        sample_size = sum(len(member) + 1024 for member in data.values())
+        if self.tar is None or (self.tar.offset > 0 and self.tar.offset + sample_size > self.max_shard_size):
+            self.open_shard()
+
+        offsets = {}
+        for name, member in data.items():
+            info = tarfile.TarInfo(f'{key}.{name}')
+            info.size = len(member)
+            info.mtime = int(time.time())
+            self.tar.addfile(info, io.BytesIO(member))
+            # The data ends the member, padded to a multiple of 512 bytes
+            offsets[name] = [self.tar.offset - math.ceil(info.size / 512) * 512, info.size]
+        # The shard is flushed before the index, so that the index never points past the written data
+        self.tar.fileobj.flush()
+        self.index.write(json.dumps({'key': key, 'shard': shard_name(self.shard_number), 'members': offsets}) + '\n')
+        self.index.flush()
+
+    def open_shard(self):
+        if self.tar is not None:
+            self.tar.close()
+        self.shard_number += 1
+        self.tar = tarfile.open(os.path.join(self.path, shard_name(self.shard_number)), 'w')
+
+    def wait(self):
+        """Waits until every queued sample is written"""
+        self.queue.wait()
+
+    def close(self):
+        self.queue.close()
+        if self.tar is not None:
+            self.tar.close()
+        self.index.close()
+
+
+class DatasetReader():
+    """
+    Random access to the samples of a dataset through its index
+    Samples of the same key are merged, e.g. the cameras of one frame rendered by different launcher workers
+    """
+
+    def __init__(self, path):
+        self.path = path
+        # Key to member name to the (shard, offset, size) of the member
+        self.samples = {}
+        for record in read_label_records(os.path.join(path, INDEX_FILE)):
+            members = self.samples.setdefault(record['key'], {})
+            for name, (offset, size) in record['members'].items():
+                members[name] = (record['shard'], offset, size)
+
+    def keys(self):
+        return list(self.samples)
+
+    def read(self, key, name):
+        """Returns the bytes of a member of a sample, e.g. read('simulation_number0-frame12', 'camera0.png')"""
+        shard, offset, size = self.samples[key][name]
+        with open(os.path.join(self.path, shard), 'rb') as f:
+            f.seek(offset)
+            return f.read(size)
+
+    def labels(self, key):
+        return json.loads(self.read(key, 'json'))
+
+    def __getitem__(self, key):
+        return {name: self.read(key, name) for name in self.samples[key]}
+
+    def __len__(self):
+        return len(self.samples)
+
+
+def iter_samples(path):
+    """
+    Yields the (key, {member name: bytes}) of every sample of a dataset, reading the shards sequentially
+    Samples of the same key that were written separately are yielded separately
+    """
+    for filename in sorted(os.listdir(path)):
+        if not filename.endswith('.tar'):
+            continue
+        key = None
+        members = {}
+        # Stream mode reads the shard front to back without seeking
+        with tarfile.open(os.path.join(path, filename), 'r|') as tar:
+            for info in tar:
+                member_key, name = info.name.split('.', 1)
+                if member_key != key and members:
+                    yield key, members
+                    members = {}
+                key = member_key
+                members[name] = tar.extractfile(info).read()
+        if members:
+            yield key, members
+
+
+def merge_datasets(dataset_paths, output_path):
+    """
+    Moves the shards of several datasets into output_path, numbering them in order, and merges their indices
+    """
+    os.makedirs(output_path, exist_ok=True)
+    shard_number = 0
+    with open(os.path.join(output_path, INDEX_FILE), 'w') as index:
+        for dataset_path in dataset_paths:
+            renamed = {}
+            for filename in sorted(os.listdir(dataset_path)):
+                if filename.endswith('.tar'):
+                    renamed[filename] = shard_name(shard_number)
+                    os.replace(os.path.join(dataset_path, filename), os.path.join(output_path, renamed[filename]))
+                    shard_number += 1
+            for record in read_label_records(os.path.join(dataset_path, INDEX_FILE)):
+                record['shard'] = renamed[record['shard']]
+                index.write(json.dumps(record) + '\n')
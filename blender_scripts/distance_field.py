@@ -0,0 +1,110 @@
+'''
+Precomputed signed distance field of the arena obstacles
+
+The arena layout never changes, so the distance from every point on the floor to the nearest block or wall
+is rasterized once, cached to disk as a NumPy array and then answers clearance queries with a single lookup.
+'''
+import os
+import json
+import hashlib
+import numpy as np
+
+from arena import FIELD_X, FIELD_Y, ALL_BLOCKS
+
+DEFAULT_RESOLUTION = 0.01   # metres per cell
+CACHE_PATH = os.path.join(os.getcwd(), 'cache')
+# Bump when the rasterization changes so that stale cached fields are not reused
+DISTANCE_FIELD_VERSION = 1
+
+
+def layout_key(resolution: float):
+    '''Returns a hash of the arena layout and grid resolution, used to name the cached field'''
+    layout = {
+        'version': DISTANCE_FIELD_VERSION,
+        'field': (FIELD_X, FIELD_Y),
+        'blocks': ALL_BLOCKS,
+        'resolution': resolution
+    }
+    return hashlib.sha256(json.dumps(layout, sort_keys=True).encode()).hexdigest()[:16]
+
+
+def block_distance(xs, ys, block):
+    '''Signed distance from the given points to a block, negative inside the block'''
+    size_x = block['size']['x']
+    size_y = block['size']['y']
+    rot = block['rot']
+    # Move the points into the block's local frame, where it spans (0, 0) to (size_x, size_y)
+    dx = xs - block['location']['x']
+    dy = ys - block['location']['y']
+    local_x = dx * np.cos(rot) + dy * np.sin(rot)
+    local_y = -dx * np.sin(rot) + dy * np.cos(rot)
+
+    qx = np.abs(local_x - size_x / 2) - size_x / 2
+    qy = np.abs(local_y - size_y / 2) - size_y / 2
+    outside = np.hypot(np.maximum(qx, 0), np.maximum(qy, 0))
+    inside = np.minimum(np.maximum(qx, qy), 0)
+    return outside + inside
+
+
+def compute_distance_field(resolution: float = DEFAULT_RESOLUTION):
+    '''
+    Rasterizes the signed distance to the nearest obstacle at the centre of every cell of the field
+
+    Returns a float32 array indexed [x_cell, y_cell], negative inside blocks and outside the wall
+    '''
+    # The small tolerance stops float error in the division from adding an extra row of cells
+    xs = (np.arange(int(np.ceil(FIELD_X / resolution - 1e-9))) + 0.5) * resolution
+    ys = (np.arange(int(np.ceil(FIELD_Y / resolution - 1e-9))) + 0.5) * resolution
+    xs, ys = np.meshgrid(xs, ys, indexing='ij')
+
+    # The wall surrounds the field, so its distance is the distance to the field boundary
+    field = np.minimum(np.minimum(xs, FIELD_X - xs), np.minimum(ys, FIELD_Y - ys))
+    for block in ALL_BLOCKS.values():
+        field = np.minimum(field, block_distance(xs, ys, block))
+    return field.astype(np.float32)
+
+
+def load_distance_field(resolution: float = DEFAULT_RESOLUTION, cache_path: str = CACHE_PATH):
+    '''
+    Loads the distance field for the given resolution from the cache, computing and caching it if missing
+    '''
+    filename = os.path.join(cache_path, f'arena_sdf_{layout_key(resolution)}.npy')
+    if os.path.isfile(filename):
+        return DistanceField(np.load(filename), resolution)
+
+    field = compute_distance_field(resolution)
+    if not os.path.isdir(cache_path):
+        os.makedirs(cache_path)
+    # Written to a temporary file first, so that concurrent workers never load a partial field
+    temp_path = f'{filename}.{os.getpid()}.tmp'
+    with open(temp_path, 'wb') as f:
+        np.save(f, field)
+    os.replace(temp_path, filename)
+    return DistanceField(field, resolution)
+
+
+class DistanceField():
+    '''
+    Obstacle backend answering clearance queries from a precomputed distance field
+
+    Offers the same has_overlap interface as pathfinder.CollisionWorld
+    '''
+
+    def __init__(self, field: np.ndarray, resolution: float):
+        self.field = field
+        self.resolution = resolution
+
+    def distance(self, xs, ys):
+        '''Returns the distance to the nearest obstacle for the given points, accepts scalars or arrays'''
+        ix = np.clip((np.asarray(xs) / self.resolution).astype(int), 0, self.field.shape[0] - 1)
+        iy = np.clip((np.asarray(ys) / self.resolution).astype(int), 0, self.field.shape[1] - 1)
+        return self.field[ix, iy]
+
+    def has_overlap(self, robot_name: str, x: float, y: float, z: float, radius: float):
+        '''Returns true if any obstacle lies within radius of the given point'''
+        return bool(self.distance(x, y) < radius)
+
+    def overlaps(self, robot_names, positions: np.ndarray, radii: np.ndarray):
+        '''Returns a boolean array marking the positions that have an obstacle within their radius'''
+        positions = np.asarray(positions)
+        return self.distance(positions[:, 0], positions[:, 1]) < radii
@@ -0,0 +1,100 @@
+"""
+Generates robot trajectories and labels without Blender
+
+Runs the same motion model as the Blender pathfinder against the precomputed arena distance field and writes
+the labels in the formats of the render pipeline. Run with plain Python from the root of the project, e.g.
+python blender_scripts/headless.py --simulations 100 --frames 250 --seed 0 --label-format npy
+
+Simulation n is seeded with seed + n like in Blender, so spawns and motion match renders of the same seed that
+ran with domain randomization disabled and the distance field obstacle backend
+"""
+import os
+import sys
+import time
+import random
+import logging
+import argparse
+import numpy as np
+
+from arena import SPAWN_BLOCKS, sample_block_spawns
+from distance_field import load_distance_field, DEFAULT_RESOLUTION
+from motion import RobotState, make_spatial_hash, step_robots
+from spawn import SpawnSampler, TEAM_SIDES
+from labels import make_label_writer
+
+logger = logging.getLogger(__name__)
+
+
+def parse_headless_args(argv):
+    parser = argparse.ArgumentParser(description='Simulate robot trajectories and write labels without Blender')
+    parser.add_argument('--simulations', type=int, default=1, help='number of simulations')
+    parser.add_argument('--frames', type=int, default=250, help='frames per simulation')
+    parser.add_argument('--frame-range', help='start:end range of frames to label, end exclusive')
+    parser.add_argument('--seed', type=int, default=0, help='base seed, simulation n is seeded with seed + n')
+    parser.add_argument('--robots', type=int, default=4, help='number of robots')
+    parser.add_argument('--spawn-mode', choices=['free_space', 'blocks'], default='free_space',
+                        help='collision-free spawns anywhere in the arena or one robot per spawn block')
+    parser.add_argument('--teams', help=f'comma separated team of every robot, one of {", ".join(TEAM_SIDES)}, '
+                                        'to spawn robots on their team\'s side')
+    parser.add_argument('--resolution', type=float, default=DEFAULT_RESOLUTION, help='distance field resolution')
+    parser.add_argument('--no-robot-avoidance', action='store_true', help='robots do not see each other')
+    parser.add_argument('--label-format', choices=['json', 'jsonl', 'npy'], default='json',
+                        help='labels.json, streamed labels.jsonl or npy trajectory arrays')
+    parser.add_argument('--output', default=os.path.join(os.getcwd(), 'renders'),
+                        help='directory for the labels')
+    parser.add_argument('--log-level', choices=['DEBUG', 'INFO', 'WARNING', 'ERROR'], default='INFO')
+    return parser.parse_args(argv)
+
+
+def simulate(robot_names, collision_world, spatial_hash, frames, spawn_sampler=None, teams=None):
+    """
+    Spawns the robots and yields each frame of frames with the robot positions [robots, 3] after it
+    The simulation always starts from frame 0
+    """
+    if spawn_sampler is not None:
+        positions = spawn_sampler.sample(len(robot_names), teams)
+    else:
+        positions = sample_block_spawns(len(robot_names), SPAWN_BLOCKS)
+    robot_state = RobotState(robot_names, positions)
+    for frame in range(0, frames.stop):
+        step_robots(robot_state, collision_world, spatial_hash, frame)
+        if frame in frames:
+            yield frame, robot_state.position
+
+
+def generate(headless_args):
+    logging.basicConfig(level=headless_args.log_level, format='%(asctime)s %(name)s %(levelname)s: %(message)s')
+    os.makedirs(headless_args.output, exist_ok=True)
+
+    robot_names = [f'r{i}_base' for i in range(1, headless_args.robots + 1)]
+    if headless_args.frame_range:
+        start, end = headless_args.frame_range.split(':')
+        frames = range(int(start), int(end))
+    else:
+        frames = range(0, headless_args.frames)
+    collision_world = load_distance_field(headless_args.resolution)
+    spawn_sampler = SpawnSampler(collision_world) if headless_args.spawn_mode == 'free_space' else None
+    teams = headless_args.teams.split(',') if headless_args.teams else None
+    label_writer = make_label_writer(headless_args.label_format, headless_args.output,
+                                     robot_names=robot_names, frames=frames)
+
+    start_time = time.time()
+    for simulation_number in range(0, headless_args.simulations):
+        seed = headless_args.seed + simulation_number
+        random.seed(seed)
+        np.random.seed(seed)
+        sim_no = f'simulation_number{simulation_number}'
+        spatial_hash = None if headless_args.no_robot_avoidance else make_spatial_hash()
+        for frame, positions in simulate(robot_names, collision_world, spatial_hash, frames, spawn_sampler, teams):
+            for robot, (x, y, z) in zip(robot_names, positions.tolist()):
+                label_writer.write(sim_no, frame, robot, {"x": x, "y": y, "z": z})
+    label_writer.close()
+
+    elapsed = time.time() - start_time
+    simulated_frames = headless_args.simulations * frames.stop
+    logger.info('Simulated %d frames in %.2fs, %.0f frames per second', simulated_frames, elapsed,
+                simulated_frames / elapsed)
+
+
+if __name__ == '__main__':
+    generate(parse_headless_args(sys.argv[1:]))
@@ -0,0 +1,231 @@
+'''
+Saving of rendered frames, either by Blender or asynchronously in a thread pool
+
+In asynchronous mode the render loop only copies the pixels of the render result out of the compositor's viewer
+node and hands them to a thread pool, which converts, encodes and writes them while the next frame is simulated and
+rendered. PNGs are encoded with zlib, which releases the GIL while compressing, JPEG and WebP need Pillow.
+Pixels are converted with the sRGB transfer function, so the scene uses the Standard view transform in this mode.
+'''
+import io
+import os
+import zlib
+import shutil
+import struct
+import tempfile
+from concurrent.futures import Future
+import bpy
+import numpy as np
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+from write_queue import WriteQueue
+
+FILE_EXTENSIONS = {
+    'PNG': 'png',
+    'JPEG': 'jpg',
+    'WEBP': 'webp'
+}
+# Rec. 709 luminance weights, used for BW images
+LUMINANCE = np.array([0.2126, 0.7152, 0.0722], dtype=np.float32)
+
+
+def image_extension(image_format):
+    return FILE_EXTENSIONS[image_format['format']]
+
+
+def to_display(pixels, image_format):
+    '''
+    Converts linear float RGBA pixels [height, width, 4] to 8 or 16 bit integer pixels in the image format's
+    color mode, with the sRGB transfer function applied to the color channels
+    '''
+    rgb = np.clip(pixels[..., :3], 0, 1)
+    rgb = np.where(rgb <= 0.0031308, rgb * 12.92, 1.055 * np.power(rgb, 1 / 2.4) - 0.055)
+    if image_format['color_mode'] == 'BW':
+        display = (rgb @ LUMINANCE)[..., None]
+    elif image_format['color_mode'] == 'RGBA':
+        display = np.concatenate((rgb, np.clip(pixels[..., 3:], 0, 1)), axis=-1)
+    else:
+        display = rgb
+    if image_format['bit_depth'] == 16:
+        return np.round(display * 65535).astype(np.uint16)
+    return np.round(display * 255).astype(np.uint8)
+
+
+def png_chunk(tag, data):
+    return struct.pack('>I', len(data)) + tag + data + struct.pack('>I', zlib.crc32(tag + data))
+
+
+def encode_png(pixels, compression_level):
+    '''Encodes 8 or 16 bit pixels [height, width, channels] as a PNG with the given zlib compression level'''
+    height, width, channels = pixels.shape
+    bit_depth = 16 if pixels.dtype == np.uint16 else 8
+    color_type = {1: 0, 3: 2, 4: 6}[channels]
+    # PNG samples are big endian, and every row starts with its filter type, 0 for none
+    rows = pixels.astype('>u2' if bit_depth == 16 else np.uint8).reshape(height, -1).view(np.uint8)
+    rows = np.concatenate((np.zeros((height, 1), dtype=np.uint8), rows), axis=1)
+    header = struct.pack('>IIBBBBB', width, height, bit_depth, color_type, 0, 0, 0)
+    return b'\x89PNG\r\n\x1a\n' + png_chunk(b'IHDR', header) + \
+        png_chunk(b'IDAT', zlib.compress(rows.tobytes(), compression_level)) + png_chunk(b'IEND', b'')
+
+
+def encode_image(pixels, image_format):
+    '''Converts and encodes linear float RGBA pixels [height, width, 4], with the first row at the top'''
+    display = to_display(pixels, image_format)
+    if image_format['format'] == 'PNG':
+        # Blender's PNG compression is a percentage, zlib's is a level from 0 to 9
+        return encode_png(display, round(image_format['compression'] * 9 / 100))
+    image = Image.fromarray(display[..., 0] if display.shape[-1] == 1 else display)
+    encoded = io.BytesIO()
+    image.save(encoded, format=image_format['format'], quality=image_format['quality'])
+    return encoded.getvalue()
+
+
+def write_image(pixels, filepath, image_format):
+    '''
+    Encodes and writes pixels like encode_image
+    The image is written to a temporary file first, so that an interrupted write never leaves a partial image
+    '''
+    temp_path = f'{filepath}.tmp'
+    with open(temp_path, 'wb') as f:
+        f.write(encode_image(pixels, image_format))
+    os.replace(temp_path, filepath)
+
+
+class AsyncImageWriter():
+    '''Writes images in a pool of threads, with at most max_pending images queued'''
+
+    def __init__(self, image_format, threads=4, max_pending=16):
+        if image_format['format'] != 'PNG' and Image is None:
+            raise ValueError(f"Writing {image_format['format']} images asynchronously needs Pillow")
+        if image_format['format'] != 'PNG' and image_format['bit_depth'] != 8:
+            raise ValueError(f"{image_format['format']} images can only be 8 bit")
+        self.image_format = image_format
+        self.queue = WriteQueue(threads, max_pending)
+
+    def write(self, pixels, filepath):
+        self.queue.submit(filepath, write_image, pixels, filepath, self.image_format)
+
+    def encode(self, pixels):
+        '''Returns a future of the encoded image'''
+        return self.queue.submit(None, encode_image, pixels, self.image_format)
+
+    def copy(self, source, filepath):
+        '''Copies an image once it has been written, which may still be pending'''
+        self.queue.submit(filepath, copy_image, self.queue.find(source), source, filepath)
+
+    def wait(self):
+        '''Waits until every queued image is written'''
+        self.queue.wait()
+
+    def close(self):
+        self.queue.close()
+
+
+def copy_image(source_write, source, filepath):
+    # Writes are queued in order, so the source write has already started when its copy starts
+    if source_write is not None:
+        source_write.result()
+    shutil.copyfile(source, filepath)
+
+
+def apply_image_settings(scene, image_format):
+    '''Sets Blender's output format to the image format, used when Blender writes the images itself'''
+    settings = scene.render.image_settings
+    settings.file_format = image_format['format']
+    settings.color_mode = image_format['color_mode']
+    if image_format['format'] == 'PNG':
+        settings.color_depth = str(image_format['bit_depth'])
+        settings.compression = image_format['compression']
+    else:
+        settings.quality = image_format['quality']
+
+
+def add_viewer_node(scene):
+    '''
+    Links the render layers, or the compositor's denoise node if there is one, to a compositor viewer node, whose
+    image holds the pixels of every render
+    '''
+    scene.use_nodes = True
+    scene.render.use_compositing = True
+    tree = scene.node_tree
+    render_layers = next((node for node in tree.nodes if node.type == 'R_LAYERS'), None)
+    if render_layers is None:
+        render_layers = tree.nodes.new('CompositorNodeRLayers')
+    viewer = next((node for node in tree.nodes if node.type == 'VIEWER'), None)
+    if viewer is None:
+        viewer = tree.nodes.new('CompositorNodeViewer')
+    viewer.use_alpha = True
+    denoise = next((node for node in tree.nodes if node.type == 'DENOISE'), None)
+    source = render_layers if denoise is None else denoise
+    tree.links.new(source.outputs['Image'], viewer.inputs['Image'])
+
+
+def read_viewer_pixels():
+    '''Returns the linear float RGBA pixels [height, width, 4] of the last render, with the first row at the top'''
+    viewer = bpy.data.images['Viewer Node']
+    width, height = viewer.size
+    pixels = np.empty(width * height * 4, dtype=np.float32)
+    viewer.pixels.foreach_get(pixels)
+    # Blender images start at the bottom row
+    return pixels.reshape(height, width, 4)[::-1]
+
+
+class RenderResultWriter():
+    '''
+    Saves the result of the last render, through Blender or asynchronously through an AsyncImageWriter
+
+    :param image_format: dict of the 'format' (PNG, JPEG or WEBP), 'color_mode' (BW, RGB or RGBA), 'bit_depth'
+        (8 or 16, PNG only), PNG 'compression' (0-100) and JPEG/WebP 'quality' (0-100)
+    '''
+
+    def __init__(self, scene, image_format, asynchronous=False, threads=4, max_pending=16):
+        self.extension = image_extension(image_format)
+        apply_image_settings(scene, image_format)
+        self.async_writer = None
+        if asynchronous:
+            add_viewer_node(scene)
+            scene.view_settings.view_transform = 'Standard'
+            scene.view_settings.look = 'None'
+            self.async_writer = AsyncImageWriter(image_format, threads, max_pending)
+
+    def save(self, filepath):
+        if self.async_writer is None:
+            bpy.data.images['Render Result'].save_render(filepath=filepath)
+        else:
+            self.async_writer.write(read_viewer_pixels(), filepath)
+
+    def encode(self):
+        '''
+        Returns a future of the encoded image, e.g. to pack it into a dataset shard instead of saving it on its own
+        Blender can only encode images into files, so without the asynchronous writer it goes through a temporary file
+        '''
+        if self.async_writer is not None:
+            return self.async_writer.encode(read_viewer_pixels())
+        fd, temp_path = tempfile.mkstemp(suffix=f'.{self.extension}')
+        os.close(fd)
+        try:
+            bpy.data.images['Render Result'].save_render(filepath=temp_path)
+            with open(temp_path, 'rb') as f:
+                encoded = Future()
+                encoded.set_result(f.read())
+        finally:
+            os.remove(temp_path)
+        return encoded
+
+    def copy(self, source, filepath):
+        '''Saves a previously saved image again under another path'''
+        if self.async_writer is None:
+            shutil.copyfile(source, filepath)
+        else:
+            self.async_writer.copy(source, filepath)
+
+    def wait(self):
+        if self.async_writer is not None:
+            self.async_writer.wait()
+
+    def close(self):
+        if self.async_writer is not None:
+            self.async_writer.close()
@@ -0,0 +1,222 @@
+"""
+Label writers for the robot positions of every rendered frame
+
+JsonLabelWriter keeps every simulation in memory and writes the legacy labels.json when closed.
+JsonLinesLabelWriter streams one record per robot per frame to an append-only JSON Lines file, so memory stays
+flat and a crash only loses the records since the last flush. TrajectoryLabelWriter stores each simulation as a
+dense [frames, robots, dof] float32 .npy array with a small JSON sidecar, which load_trajectories memory maps.
+Run as a script to convert labels.jsonl to labels.json, e.g.
+python blender_scripts/labels.py renders/labels.jsonl renders/labels.json
+"""
+import os
+import sys
+import json
+import time
+import numpy as np
+
+TRAJECTORY_DOF = ('x', 'y', 'z')
+
+
+def save_labels_to_file(labels, path):
+    """
+    Saves the coordinates of the robot objects for each individual frame to a json file
+    File is overwritten if it already exists
+    """
+    with open(path, 'w+') as f:
+        json.dump(labels, f, sort_keys=True, indent=4, separators=(',', ': '))
+
+
+class JsonLabelWriter():
+    """
+    Collects labels as nested simulation logs and writes them as one labels.json when closed
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.simulations = {}
+
+    def write(self, sim_no: str, frame: int, robot: str, position: dict):
+        robots = self.simulations.setdefault(sim_no, {})
+        robots.setdefault(robot, {})[f'frame_{frame}'] = position
+
+    def close(self):
+        labels = [{sim_no: robots} for sim_no, robots in self.simulations.items()]
+        save_labels_to_file(labels, self.path)
+
+
+class JsonLinesLabelWriter():
+    """
+    Appends one JSON record per robot per frame to a JSON Lines file
+
+    Records are buffered and flushed to disk once flush_every records are pending or flush_interval seconds
+    have passed since the last flush, whichever comes first.
+    """
+
+    def __init__(self, path, flush_every=1000, flush_interval=5.0, mode='w'):
+        self.path = path
+        self.flush_every = flush_every
+        self.flush_interval = flush_interval
+        self.file = open(path, mode)
+        self.buffer = []
+        self.last_flush = time.time()
+
+    def write(self, sim_no: str, frame: int, robot: str, position: dict):
+        record = {'simulation': sim_no, 'frame': frame, 'robot': robot}
+        record.update(position)
+        self.buffer.append(json.dumps(record) + '\n')
+        if len(self.buffer) >= self.flush_every or time.time() - self.last_flush >= self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        self.file.write(''.join(self.buffer))
+        self.file.flush()
+        self.buffer = []
+        self.last_flush = time.time()
+
+    def close(self):
+        self.flush()
+        self.file.close()
+
+
+class TrajectoryLabelWriter():
+    """
+    Writes each simulation's trajectories to trajectories/{sim_no}.npy as a memory mapped float32 array of shape
+    [frames, robots, dof], with the robot names, frame range and dof names in a {sim_no}.json sidecar
+    Frames that were never written are left as NaN
+    """
+
+    def __init__(self, path, robot_names, frames):
+        self.path = path
+        self.robot_names = list(robot_names)
+        self.robot_index = {robot: index for index, robot in enumerate(self.robot_names)}
+        self.frames = frames
+        self.sim_no = None
+        self.trajectories = None
+        os.makedirs(path, exist_ok=True)
+
+    def open_simulation(self, sim_no):
+        self.close()
+        self.sim_no = sim_no
+        self.trajectories = np.lib.format.open_memmap(
+            os.path.join(self.path, f'{sim_no}.npy'), mode='w+', dtype=np.float32,
+            shape=(len(self.frames), len(self.robot_names), len(TRAJECTORY_DOF)))
+        self.trajectories[:] = np.nan
+        sidecar = {
+            'robots': self.robot_names,
+            'frame_start': self.frames.start,
+            'frame_stop': self.frames.stop,
+            'dof': TRAJECTORY_DOF
+        }
+        with open(os.path.join(self.path, f'{sim_no}.json'), 'w') as f:
+            json.dump(sidecar, f, indent=4)
+
+    def write(self, sim_no: str, frame: int, robot: str, position: dict):
+        if sim_no != self.sim_no:
+            self.open_simulation(sim_no)
+        self.trajectories[frame - self.frames.start, self.robot_index[robot]] = [position[d] for d in TRAJECTORY_DOF]
+
+    def close(self):
+        if self.trajectories is not None:
+            self.trajectories.flush()
+            self.trajectories = None
+
+
+def load_trajectories(path, sim_no, mmap=True):
+    """
+    Returns the [frames, robots, dof] trajectory array of a simulation and its sidecar
+    With mmap the array is memory mapped read only, so slices of it are never copied into memory
+    """
+    with open(os.path.join(path, f'{sim_no}.json')) as f:
+        sidecar = json.load(f)
+    trajectories = np.load(os.path.join(path, f'{sim_no}.npy'), mmap_mode='r' if mmap else None)
+    return trajectories, sidecar
+
+
+def merge_trajectories(shard_paths, output_path):
+    """
+    Merges trajectory stores holding frame ranges of the same simulations into one array per simulation
+    """
+    shards = {}
+    for shard_path in shard_paths:
+        for filename in sorted(os.listdir(shard_path)):
+            if filename.endswith('.json'):
+                sim_no = filename[:-len('.json')]
+                shards.setdefault(sim_no, []).append(load_trajectories(shard_path, sim_no))
+
+    for sim_no, parts in shards.items():
+        frames = range(min(sidecar['frame_start'] for _, sidecar in parts),
+                       max(sidecar['frame_stop'] for _, sidecar in parts))
+        writer = TrajectoryLabelWriter(output_path, parts[0][1]['robots'], frames)
+        writer.open_simulation(sim_no)
+        for trajectories, sidecar in parts:
+            writer.trajectories[sidecar['frame_start'] - frames.start:sidecar['frame_stop'] - frames.start] = \
+                trajectories
+        writer.close()
+
+
+def make_label_writer(label_format, output_path, flush_every=1000, flush_interval=5.0, robot_names=None,
+                      frames=None, append=False):
+    """
+    Returns the label writer for the given format, 'json' for labels.json, 'jsonl' for labels.jsonl or
+    'npy' for dense trajectory arrays in the trajectories directory, which needs the robot names and frame range
+    With append, a resumed job adds its records to an existing labels.jsonl
+    """
+    if label_format == 'json':
+        return JsonLabelWriter(os.path.join(output_path, 'labels.json'))
+    if label_format == 'jsonl':
+        jsonl_path = os.path.join(output_path, 'labels.jsonl')
+        if append:
+            truncate_partial_record(jsonl_path)
+        return JsonLinesLabelWriter(jsonl_path, flush_every, flush_interval, 'a' if append else 'w')
+    if label_format == 'npy':
+        return TrajectoryLabelWriter(os.path.join(output_path, 'trajectories'), robot_names, frames)
+    raise ValueError(f'Unknown label format {label_format}')
+
+
+def read_label_records(jsonl_path):
+    """
+    Yields the records of a JSON Lines label file, skipping a truncated last line left by a crash
+    """
+    with open(jsonl_path) as f:
+        for line in f:
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError:
+                continue
+
+
+def truncate_partial_record(jsonl_path, chunk_size=65536):
+    """
+    Removes a truncated last line left by a crash, so that records appended to the file start on their own line
+    """
+    if not os.path.isfile(jsonl_path):
+        return
+    with open(jsonl_path, 'rb+') as f:
+        end = f.seek(0, os.SEEK_END)
+        position = end
+        while position > 0:
+            start = max(0, position - chunk_size)
+            f.seek(start)
+            newline = f.read(position - start).rfind(b'\n')
+            if newline != -1:
+                f.truncate(start + newline + 1)
+                return
+            position = start
+        f.truncate(0)
+
+
+def convert_to_legacy(jsonl_path, json_path):
+    """
+    Converts a JSON Lines label file to the labels.json shape written by JsonLabelWriter
+    """
+    writer = JsonLabelWriter(json_path)
+    for record in read_label_records(jsonl_path):
+        sim_no = record.pop('simulation')
+        frame = record.pop('frame')
+        robot = record.pop('robot')
+        writer.write(sim_no, frame, robot, record)
+    writer.close()
+
+
+if __name__ == '__main__':
+    convert_to_legacy(sys.argv[1], sys.argv[2])
@@ -0,0 +1,198 @@
+"""
+Splits a render job into shards, renders them in parallel background Blender processes and merges the
+frames and labels of every shard into the normal renders/cameraN layout and labels.json
+
+Run with plain Python from the root of the project, e.g.
+python blender_scripts/launcher.py --workers 8 --simulations 4 --cameras 0,1
+"""
+import os
+import sys
+import json
+import math
+import logging
+import shutil
+import argparse
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+from labels import save_labels_to_file, merge_trajectories
+from dataset import merge_datasets
+
+logger = logging.getLogger(__name__)
+
+SCRIPT_PATH = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'blender_env.py')
+
+
+def parse_launcher_args(argv):
+    parser = argparse.ArgumentParser(description='Render simulations across several background Blender processes')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help='number of concurrent Blender processes')
+    parser.add_argument('--blender', default='blender', help='path to the Blender executable')
+    parser.add_argument('--simulations', type=int, default=1, help='number of simulations to render')
+    parser.add_argument('--frames', type=int, default=250, help='frames per simulation')
+    parser.add_argument('--cameras', default='0', help='comma separated indices of the cameras to render')
+    parser.add_argument('--frames-per-shard', type=int,
+                        help='frames rendered by each worker, by default the frames are split so every worker is busy')
+    parser.add_argument('--seed', type=int, default=0, help='base seed, simulation n is seeded with seed + n')
+    parser.add_argument('--render-profile', default='cpu-cycles', help='render profile used by every worker')
+    parser.add_argument('--device', choices=['CPU', 'GPU'], help='Cycles render device, overrides the profile')
+    parser.add_argument('--label-format', choices=['json', 'jsonl', 'npy'], default='json',
+                        help='labels.json, streamed labels.jsonl or npy trajectory arrays')
+    parser.add_argument('--output-mode', choices=['files', 'shards'], default='files',
+                        help='one image file per frame and camera or tar shards of frames and labels')
+    parser.add_argument('--output', default=os.path.join(os.getcwd(), 'renders'),
+                        help='directory for the merged frames and labels')
+    return parser.parse_args(argv)
+
+
+def plan_shards(simulations, cameras, frames, frames_per_shard=None, workers=1):
+    """
+    Splits simulations x cameras x frame ranges into shards, returned as a list of dicts
+    Every shard of a simulation uses the same seed, so frame ranges of one simulation stay consistent
+    """
+    if frames_per_shard is None:
+        chunks = max(1, math.ceil(workers / (simulations * len(cameras))))
+        frames_per_shard = math.ceil(frames / chunks)
+
+    shards = []
+    for simulation in range(0, simulations):
+        for camera in cameras:
+            for start in range(0, frames, frames_per_shard):
+                shards.append({
+                    'simulation': simulation,
+                    'camera': camera,
+                    'frames': (start, min(start + frames_per_shard, frames))
+                })
+    return shards
+
+
+def shard_command(launcher_args, shard, shard_path, threads):
+    """
+    Returns the Blender command line that renders a single shard into shard_path
+    """
+    command = [
+        launcher_args.blender, '-b', '-t', str(threads), '--python-exit-code', '1', '-P', SCRIPT_PATH, '--', 'render',
+        '--seed', str(launcher_args.seed),
+        '--simulations', str(shard['simulation']),
+        '--cameras', str(shard['camera']),
+        '--frames', f'{shard["frames"][0]}:{shard["frames"][1]}',
+        '--render-profile', launcher_args.render_profile,
+        '--label-format', launcher_args.label_format,
+        '--output-mode', launcher_args.output_mode,
+        '--output', shard_path
+    ]
+    if launcher_args.device:
+        command.extend(['--device', launcher_args.device])
+    return command
+
+
+def run_shard(command, shard_path):
+    """
+    Runs a worker process, logging its output next to its frames, and returns its exit code
+    """
+    os.makedirs(shard_path, exist_ok=True)
+    with open(os.path.join(shard_path, 'worker.log'), 'w') as log:
+        return subprocess.run(command, stdout=log, stderr=subprocess.STDOUT).returncode
+
+
+def simulation_sort_key(simulation_log):
+    sim_no = next(iter(simulation_log))
+    return int(sim_no.replace('simulation_number', ''))
+
+
+def merge_labels(label_files):
+    """
+    Merges the labels.json of several shards into the list of simulation logs written by save_labels_to_file
+    """
+    simulations = {}
+    for label_file in label_files:
+        with open(label_file) as f:
+            shard_labels = json.load(f)
+        for simulation_log in shard_labels:
+            for sim_no, robots in simulation_log.items():
+                merged_robots = simulations.setdefault(sim_no, {})
+                for robot, frames in robots.items():
+                    merged_robots.setdefault(robot, {}).update(frames)
+
+    return sorted([{sim_no: robots} for sim_no, robots in simulations.items()], key=simulation_sort_key)
+
+
+def merge_shards(shard_paths, output_path):
+    """
+    Moves the frames of every shard into output_path/cameraN or its dataset shards into output_path/dataset, and
+    writes the merged labels.json, labels.jsonl or trajectory arrays and camera poses
+    """
+    label_files = []
+    jsonl_files = []
+    pose_files = []
+    trajectory_paths = []
+    dataset_paths = []
+    for shard_path in shard_paths:
+        for entry in sorted(os.listdir(shard_path)):
+            entry_path = os.path.join(shard_path, entry)
+            if entry.startswith('camera') and os.path.isdir(entry_path):
+                camera_path = os.path.join(output_path, entry)
+                os.makedirs(camera_path, exist_ok=True)
+                for filename in os.listdir(entry_path):
+                    os.replace(os.path.join(entry_path, filename), os.path.join(camera_path, filename))
+        if os.path.isfile(os.path.join(shard_path, 'labels.json')):
+            label_files.append(os.path.join(shard_path, 'labels.json'))
+        if os.path.isfile(os.path.join(shard_path, 'labels.jsonl')):
+            jsonl_files.append(os.path.join(shard_path, 'labels.jsonl'))
+        if os.path.isfile(os.path.join(shard_path, 'camera_poses.jsonl')):
+            pose_files.append(os.path.join(shard_path, 'camera_poses.jsonl'))
+        if os.path.isdir(os.path.join(shard_path, 'trajectories')):
+            trajectory_paths.append(os.path.join(shard_path, 'trajectories'))
+        if os.path.isdir(os.path.join(shard_path, 'dataset')):
+            dataset_paths.append(os.path.join(shard_path, 'dataset'))
+
+    if label_files:
+        save_labels_to_file(merge_labels(label_files), os.path.join(output_path, 'labels.json'))
+    if jsonl_files:
+        # Records are self-describing, so the shards can simply be concatenated
+        with open(os.path.join(output_path, 'labels.jsonl'), 'w') as merged:
+            for jsonl_file in jsonl_files:
+                with open(jsonl_file) as f:
+                    shutil.copyfileobj(f, merged)
+    if pose_files:
+        # Every frame range of a simulation jitters its cameras the same way, so each pose is written once
+        poses = []
+        for pose_file in pose_files:
+            with open(pose_file) as f:
+                poses.extend(line for line in f if line not in poses)
+        with open(os.path.join(output_path, 'camera_poses.jsonl'), 'w') as merged:
+            merged.writelines(poses)
+    if trajectory_paths:
+        merge_trajectories(trajectory_paths, os.path.join(output_path, 'trajectories'))
+    if dataset_paths:
+        merge_datasets(dataset_paths, os.path.join(output_path, 'dataset'))
+
+
+def launch(launcher_args):
+    cameras = [int(i) for i in launcher_args.cameras.split(',')]
+    shards = plan_shards(launcher_args.simulations, cameras, launcher_args.frames,
+                         launcher_args.frames_per_shard, launcher_args.workers)
+    # Split the cores between the workers so concurrent Cycles processes do not oversubscribe the machine
+    threads = max(1, os.cpu_count() // launcher_args.workers)
+    shards_path = os.path.join(launcher_args.output, 'shards')
+    shard_paths = [os.path.join(shards_path, f'shard_{index:04d}') for index in range(len(shards))]
+    logger.info('Rendering %d shards on %d workers with %d threads each', len(shards), launcher_args.workers, threads)
+
+    with ThreadPoolExecutor(max_workers=launcher_args.workers) as executor:
+        futures = [executor.submit(run_shard, shard_command(launcher_args, shard, shard_path, threads), shard_path)
+                   for shard, shard_path in zip(shards, shard_paths)]
+        exit_codes = [future.result() for future in futures]
+
+    failed = [path for path, code in zip(shard_paths, exit_codes) if code != 0]
+    merge_shards([path for path, code in zip(shard_paths, exit_codes) if code == 0], launcher_args.output)
+    if failed:
+        logger.error('%d shards failed, see worker.log in %s', len(failed), ', '.join(failed))
+        return 1
+
+    shutil.rmtree(shards_path)
+    logger.info('Merged %d shards into %s', len(shards), launcher_args.output)
+    return 0
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(name)s %(levelname)s: %(message)s')
+    sys.exit(launch(parse_launcher_args(sys.argv[1:])))
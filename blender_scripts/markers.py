@@ -0,0 +1,98 @@
+'''
+Vision marker texture atlas
+
+The 44 marker images are packed into one atlas texture that is built once and cached to disk. Every marker
+plane uses one shared material and picks its marker through its UVs, so re-randomizing markers only rewrites UVs.
+'''
+import os
+import hashlib
+import bpy
+import numpy as np
+
+MARKER_TEXTURE_PATH = os.path.join(os.getcwd(), "assets/vision_markers/")
+CACHE_PATH = os.path.join(os.getcwd(), 'cache')
+NUM_MARKERS = 44
+ATLAS_COLUMNS = 7
+ATLAS_ROWS = 7
+ATLAS_TILE_SIZE = 256   # pixels per side of each marker in the atlas
+
+
+def marker_filename(index):
+    '''marker images are numbered from 0001.jpg'''
+    return str(index + 1).zfill(4) + '.jpg'
+
+
+def atlas_key(tile_size):
+    '''Returns a hash of the marker images and atlas layout, used to name the cached atlas'''
+    key = hashlib.sha256(f'{tile_size}-{ATLAS_COLUMNS}-{ATLAS_ROWS}'.encode())
+    for index in range(NUM_MARKERS):
+        with open(MARKER_TEXTURE_PATH + marker_filename(index), 'rb') as f:
+            key.update(f.read())
+    return key.hexdigest()[:16]
+
+
+def load_marker_atlas(tile_size=ATLAS_TILE_SIZE):
+    '''Loads the marker atlas image from the cache, building and caching it if missing'''
+    atlas_path = os.path.join(CACHE_PATH, f'marker_atlas_{atlas_key(tile_size)}.png')
+    if os.path.isfile(atlas_path):
+        return bpy.data.images.load(filepath=atlas_path, check_existing=True)
+
+    # Image pixels start at the bottom left, matching the direction of the UV coordinates
+    pixels = np.ones((ATLAS_ROWS * tile_size, ATLAS_COLUMNS * tile_size, 4), dtype=np.float32)
+    tile = np.empty(tile_size * tile_size * 4, dtype=np.float32)
+    for index in range(NUM_MARKERS):
+        img = bpy.data.images.load(filepath=MARKER_TEXTURE_PATH + marker_filename(index))
+        img.scale(tile_size, tile_size)
+        img.pixels.foreach_get(tile)
+        bpy.data.images.remove(img)
+        row, column = divmod(index, ATLAS_COLUMNS)
+        pixels[row * tile_size:(row + 1) * tile_size, column * tile_size:(column + 1) * tile_size] = \
+            tile.reshape(tile_size, tile_size, 4)
+
+    atlas = bpy.data.images.new('marker_atlas', ATLAS_COLUMNS * tile_size, ATLAS_ROWS * tile_size)
+    atlas.pixels.foreach_set(pixels.ravel())
+    if not os.path.isdir(CACHE_PATH):
+        os.makedirs(CACHE_PATH)
+    # Saved to a temporary file first, so that concurrent workers never load a partial atlas
+    temp_path = f'{atlas_path[:-len(".png")]}.{os.getpid()}.tmp.png'
+    atlas.filepath_raw = temp_path
+    atlas.file_format = 'PNG'
+    atlas.save()
+    os.replace(temp_path, atlas_path)
+    atlas.filepath_raw = atlas_path
+    return atlas
+
+
+def make_marker_material(atlas):
+    '''Makes the material shared by every marker plane'''
+    mat = bpy.data.materials.new(name='marker_mat')
+    mat.use_nodes = True
+    bsdf = mat.node_tree.nodes["Principled BSDF"]
+    texture_node = mat.node_tree.nodes.new('ShaderNodeTexImage')
+    texture_node.image = atlas
+    mat.node_tree.links.new(bsdf.inputs['Base Color'], texture_node.outputs['Color'])
+    return mat
+
+
+def get_base_uvs(mesh):
+    '''
+    Returns the default unit square UVs of a marker plane
+    They are read once when the plane is made and kept on the mesh, so they survive saving the arena snapshot
+    '''
+    if 'base_uvs' in mesh:
+        return np.array(mesh['base_uvs'], dtype=np.float32)
+    base_uvs = np.empty(len(mesh.uv_layers.active.data) * 2, dtype=np.float32)
+    mesh.uv_layers.active.data.foreach_get('uv', base_uvs)
+    mesh['base_uvs'] = base_uvs.tolist()
+    return base_uvs
+
+
+def set_marker_uvs(mesh, base_uvs, marker_index, tile_size=ATLAS_TILE_SIZE):
+    '''Maps the marker plane onto the atlas tile of the given marker'''
+    row, column = divmod(marker_index, ATLAS_COLUMNS)
+    # Inset by half a texel so that filtering does not bleed in the neighbouring tiles
+    inset = 0.5 / tile_size
+    uvs = base_uvs.reshape(-1, 2) * (1 - 2 * inset) + inset
+    uvs = (uvs + (column, row)) / (ATLAS_COLUMNS, ATLAS_ROWS)
+    mesh.uv_layers.active.data.foreach_set('uv', uvs.astype(np.float32).ravel())
+    mesh.update()
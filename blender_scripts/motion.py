@@ -0,0 +1,138 @@
+"""
+Motion model of the robots, shared by the Blender pathfinder and the headless trajectory generator
+
+Robots drive straight at full speed and full scanning range until an obstacle or another robot enters their scan
+disc, then slow down, shrink the disc and turn in a random direction until the way is clear again.
+"""
+import math
+import logging
+import numpy as np
+from typing import List
+
+from arena import ROBOT_RADIUS
+from spatial_hash import SpatialHash
+from profiler import profiler
+
+logger = logging.getLogger(__name__)
+
+MAX_SPEED = 0.03300
+MIN_SPEED = 0.00800
+SPEED_DELTA = 0.00132
+
+MAX_SCAN = 0.7
+MIN_SCAN = 0.38
+SCAN_INCREMENT_DELTA = 0.0040
+SCAN_DECREMENT_DELTA = 0.0100
+
+ROTATION_DELTA = ((math.pi * 2.7) / 180)
+# Bearings are measured in radians, clockwise from the positive y-axis
+
+
+def motion_parameters():
+    """
+    Returns the constants that determine how robots move, used to key cached trajectories
+    """
+    return {
+        'speed': (MAX_SPEED, MIN_SPEED, SPEED_DELTA),
+        'scan': (MAX_SCAN, MIN_SCAN, SCAN_INCREMENT_DELTA, SCAN_DECREMENT_DELTA),
+        'rotation_delta': ROTATION_DELTA
+    }
+
+
+def make_spatial_hash():
+    """
+    Returns the spatial hash used for robot-robot avoidance
+    With cells as large as the furthest a robot can see, every query only touches the 3x3 cells around it
+    """
+    return SpatialHash(MAX_SCAN + ROBOT_RADIUS)
+
+
+class RobotState():
+    """
+    Movement state of every robot in a simulation, stored as one array per field (indexed like robot_names)
+    so that all robots are stepped with batched array operations
+    """
+
+    def __init__(self, robot_names: List[str], positions: np.ndarray):
+        count = len(robot_names)
+        self.robot_names = list(robot_names)
+        self.position = np.array(positions, dtype=float).reshape(count, 3)
+        self.bearing = np.full(count, math.pi/2)   # Initialised to face up
+        self.translation_speed = np.full(count, MAX_SPEED)
+        self.scan_radius = np.full(count, MAX_SCAN)
+        self.is_turning = np.zeros(count, dtype=bool)
+        self.rotation_direction = np.zeros(count, dtype=int)    # 0 means turn clockwise, 1 means turn anti-clockwise
+
+
+def has_obstacles_in_path(robot_state: RobotState, collision_world, spatial_hash: SpatialHash):
+    """
+    Checks which robots have obstacles or other robots in their scanning range, using a disc placed
+    underneath each robot
+    """
+    scan_positions = robot_state.position - (0, 0, 0.01)
+    obstructed = collision_world.overlaps(robot_state.robot_names, scan_positions, robot_state.scan_radius)
+    if spatial_hash is not None:
+        # Other robots are treated as discs, so they are in range once their footprint touches the scan disc
+        spatial_hash.update(robot_state.position)
+        obstructed |= spatial_hash.robots_in_range(robot_state.position, robot_state.scan_radius + ROBOT_RADIUS)
+    return obstructed
+
+
+def slow_down_and_turn(robot_state: RobotState, obstructed: np.ndarray):
+    """
+    Sets the obstructed robots to turning mode if not turning, turns them, then reduces speed and scanning range
+    """
+    starts_turning = obstructed & ~robot_state.is_turning
+    robot_state.is_turning[starts_turning] = True
+    robot_state.rotation_direction[starts_turning] = np.random.randint(0, 2, size=np.count_nonzero(starts_turning))
+
+    turn = np.where(robot_state.rotation_direction == 0, ROTATION_DELTA, -ROTATION_DELTA)
+    robot_state.bearing[obstructed] += turn[obstructed]
+    robot_state.translation_speed[obstructed] = np.maximum(
+        robot_state.translation_speed[obstructed] - SPEED_DELTA, MIN_SPEED)
+    robot_state.scan_radius[obstructed] = np.maximum(
+        robot_state.scan_radius[obstructed] - SCAN_DECREMENT_DELTA, MIN_SCAN)
+
+
+def continue_moving(robot_state: RobotState, clear: np.ndarray):
+    """
+    Stops the clear robots from turning and attempts to increase their speed and scanning range
+    """
+    robot_state.is_turning[clear] = False
+    robot_state.translation_speed[clear] = np.minimum(
+        robot_state.translation_speed[clear] + SPEED_DELTA, MAX_SPEED)
+    robot_state.scan_radius[clear] = np.minimum(
+        robot_state.scan_radius[clear] + SCAN_INCREMENT_DELTA, MAX_SCAN)
+
+
+def move_robots(robot_state: RobotState):
+    """
+    Changes every robot's location depending on its speed and bearing
+    """
+    robot_state.position[:, 0] += robot_state.translation_speed * np.cos(robot_state.bearing)
+    robot_state.position[:, 1] += robot_state.translation_speed * np.sin(robot_state.bearing)
+
+
+def step_robots(robot_state: RobotState, collision_world, spatial_hash: SpatialHash, frame: int):
+    """
+    Steps every robot by one frame and returns the boolean array of robots that were obstructed and turned
+
+    :param collision_world: obstacle backend with an overlaps() method, pathfinder.CollisionWorld or
+        distance_field.DistanceField
+    :param spatial_hash: spatial hash of the robot positions, None if robots do not avoid each other
+    """
+    with profiler.stage('collision_check'):
+        obstructed = has_obstacles_in_path(robot_state, collision_world, spatial_hash)
+    # Formatting a line per robot per frame is expensive, so skip it entirely unless debug logging is on
+    if logger.isEnabledFor(logging.DEBUG):
+        for robot_name, robot_obstructed in zip(robot_state.robot_names, obstructed):
+            if robot_obstructed:
+                logger.debug('%s found an obstacle at frame-%d, slow down and turn!', robot_name, frame)
+            else:
+                logger.debug('%s found no obstacles at frame-%d, keep moving...', robot_name, frame)
+
+    with profiler.stage('motion'):
+        slow_down_and_turn(robot_state, obstructed)
+        continue_moving(robot_state, ~obstructed)
+        move_robots(robot_state)
+    return obstructed
@@ -1,17 +1,67 @@
 import bpy
 import os
 
+
+def color_hex(color):
+    '''Returns an rgba color as a hex string, used to name shared materials'''
+    return ''.join(f'{round(c * 255):02x}' for c in color)
+
+
+def is_alive(id_block):
+    '''Returns false if the datablock is None or was removed from bpy.data, e.g. by BlenderEnv.clear_env'''
+    if id_block is None:
+        return False
+    try:
+        id_block.name
+    except ReferenceError:
+        return False
+    return True
+
+
 class AIRobot():
 
     FBX_PATH = 'assets/robot_mesh_split_v1.fbx'
 
+    # Shared by all robots, see load_template()
+    template_collection = None
+    materials = {}
+
+    @classmethod
+    def load_template(cls):
+        '''
+        Imports the robot FBX once into a collection that is not linked to the scene and returns its objects
+        Robots are spawned as duplicates of these objects that share their mesh data
+        '''
+        if is_alive(cls.template_collection):
+            return list(cls.template_collection.objects)
+
+        old_objs = set(bpy.data.objects)
+        bpy.ops.import_scene.fbx(filepath=cls.FBX_PATH)
+        objs = set(bpy.data.objects) - old_objs
+
+        cls.template_collection = bpy.data.collections.new('robot_template')
+        # The collection is not linked to the scene, so it needs a fake user to be kept
+        cls.template_collection.use_fake_user = True
+        for obj in objs:
+            for collection in obj.users_collection:
+                collection.objects.unlink(obj)
+            cls.template_collection.objects.link(obj)
+            # Materials are linked per object, so the shared meshes only need an empty slot
+            if obj.type == 'MESH' and not obj.data.materials:
+                obj.data.materials.append(None)
+
+        bpy.ops.object.select_all(action='DESELECT')
+        return list(objs)
+
+    @classmethod
+    def get_material(cls, name, make_material):
+        '''Returns the cached material with the given name, creating it with make_material if missing'''
+        if not is_alive(cls.materials.get(name)):
+            cls.materials[name] = make_material(name)
+        return cls.materials[name]
+
     def __init__(self, name, super_collection, color):
         ''' robot class '''
-        old_objs = set(bpy.context.scene.objects)
-        bpy.ops.import_scene.fbx(filepath=self.FBX_PATH)
-        new_objs = set(bpy.context.scene.objects)
-        objs = new_objs - old_objs
-
         self.robot_collection = bpy.data.collections.new(name+'_collection')
 
         self.base_obj = None
@@ -19,36 +69,52 @@ class AIRobot():
         self.yaw_obj = None
         self.name = name
         self.all_objs = []
-        for obj in objs:
-            obj.name = name + '_' + obj.name
-            self.all_objs.append(obj)
-            if 'base' in obj.name:
-                self.base_obj = obj
-            if 'body_a' in obj.name:
-                self.barrel_obj = obj
-            if 'body_b' in obj.name:
-                self.yaw_obj = obj
 
-        #recusrively move objects to collection
-        def tranverse_tree(t):
-            yield t
-            for c in t.children:
-                yield from tranverse_tree(c)
-        
-        current_collection = self.base_obj.users_collection[0]
-        for c in tranverse_tree(self.base_obj):
-            current_collection.objects.unlink(c)
-            self.robot_collection.objects.link(c) 
+        # Duplicate the template hierarchy, the copies share the template meshes
+        copies = {}
+        for template_obj in self.load_template():
+            obj = template_obj.copy()
+            obj.name = name + '_' + template_obj.name
+            copies[template_obj] = obj
+        for template_obj, obj in copies.items():
+            if template_obj.parent in copies:
+                obj.parent = copies[template_obj.parent]
+            self.robot_collection.objects.link(obj)
+        self.find_parts(copies.values())
+
         if color=='blue':
             self.color_panels(color=(0/255, 0/255,255/255, 1))
         elif color == 'red':
             self.color_panels(color=(255/255, 0/255, 0/255, 1))
         self.color_robot()
         self.make_camera()
-        
-        bpy.ops.object.select_all(action='DESELECT')
+
         super_collection.children.link(self.robot_collection)
 
+    @classmethod
+    def from_collection(cls, name, robot_collection):
+        ''' Wraps a robot that already exists in the scene, e.g. one appended from the arena snapshot '''
+        robot = cls.__new__(cls)
+        robot.robot_collection = robot_collection
+        robot.base_obj = None
+        robot.barrel_obj = None
+        robot.yaw_obj = None
+        robot.name = name
+        robot.all_objs = []
+        robot.find_parts([obj for obj in robot_collection.objects if obj.type == 'MESH'])
+        return robot
+
+    def find_parts(self, objs):
+        ''' Keeps the robot's objects and picks out the base, barrel and yaw parts by name '''
+        for obj in objs:
+            self.all_objs.append(obj)
+            if 'base' in obj.name:
+                self.base_obj = obj
+            if 'body_a' in obj.name:
+                self.barrel_obj = obj
+            if 'body_b' in obj.name:
+                self.yaw_obj = obj
+
     def make_camera(self):
         #make camera
         cam_data = bpy.data.cameras.new(name=self.name + '_camera')
@@ -59,30 +125,38 @@ class AIRobot():
         cam_obj.delta_location = [-0.026, -0.2, 0.03]
 
     def color_panels(self, color=(255/255, 0/255, 0/255, 1), strength=4.0):
-        '''only can call once, need to remove old materials for multiple add'''
-        #create texture on plane for image
-        panel_mat = bpy.data.materials.new(name=self.name + '_panel_light_mat')
-        panel_mat.use_nodes = True
-        out = panel_mat.node_tree.nodes["Material Output"]
-        em = panel_mat.node_tree.nodes.new(type="ShaderNodeEmission")
+        '''sets the panel lights to a shared emission material of the given color'''
+        def make_panel_material(name):
+            panel_mat = bpy.data.materials.new(name=name)
+            panel_mat.use_nodes = True
+            out = panel_mat.node_tree.nodes["Material Output"]
+            em = panel_mat.node_tree.nodes.new(type="ShaderNodeEmission")
 
-        panel_mat.node_tree.links.new(out.inputs['Surface'], em.outputs['Emission'])
-        em.inputs['Color'].default_value = color
-        em.inputs['Strength'].default_value = strength
+            panel_mat.node_tree.links.new(out.inputs['Surface'], em.outputs['Emission'])
+            em.inputs['Color'].default_value = color
+            em.inputs['Strength'].default_value = strength
+            return panel_mat
 
+        panel_mat = self.get_material(f'panel_light_mat_{color_hex(color)}_{strength}', make_panel_material)
         for obj in self.all_objs:
             if any(x in obj.name for x in ['AM', 'LI']):
-                obj.data.materials.append(panel_mat)
-    
+                obj.material_slots[0].link = 'OBJECT'
+                obj.material_slots[0].material = panel_mat
+
     def color_robot(self, color=(44/255, 44/255, 44/255, 1)):
-        '''only can call once, right now, need to remove old materials for multiple add'''
-        robot_mat = bpy.data.materials.new(name=self.name + '_robot_mat')
-        robot_mat.use_nodes = True
-        bsdf = robot_mat.node_tree.nodes["Principled BSDF"]
-        bsdf.inputs['Base Color'].default_value = color
+        '''sets the base and body to a shared material of the given color'''
+        def make_robot_material(name):
+            robot_mat = bpy.data.materials.new(name=name)
+            robot_mat.use_nodes = True
+            bsdf = robot_mat.node_tree.nodes["Principled BSDF"]
+            bsdf.inputs['Base Color'].default_value = color
+            return robot_mat
+
+        robot_mat = self.get_material(f'robot_mat_{color_hex(color)}', make_robot_material)
         for obj in self.all_objs:
             if any(x in obj.name for x in ['base', 'body']):
-                obj.data.materials.append(robot_mat)
+                obj.material_slots[0].link = 'OBJECT'
+                obj.material_slots[0].material = robot_mat
 
     def get_collection(self):
         return self.robot_collection
@@ -0,0 +1,171 @@
+'''
+Rendering of the robots' onboard cameras
+
+Every robot carries a camera parented to its barrel, see AIRobot.make_camera. PovRenderer renders all of them
+into output/pov/<robot>/ with their own render profile, and writes labels per robot of where the other robots
+are and their bounding boxes in that robot's camera. The camera poses follow from the robots' simulated
+locations and rotations, so they are computed for every robot at once without re-evaluating the scene.
+'''
+import os
+import bpy
+import numpy as np
+
+from bbox import projector_from_scene, render_resolution, camera_projection
+from labels import make_label_writer
+from checkpoint import labelled_frames, valid_image
+from profiler import profiler
+
+
+def pov_camera_name(robot):
+    '''Returns the name of the onboard camera of a robot, e.g. r1_camera for r1_base'''
+    return robot[:-len('base')] + 'camera'
+
+
+class PovRenderer():
+    '''
+    Renders the onboard camera of every robot and writes their labels, one label writer per robot
+    With skip_unchanged, frames where no robot has moved since the last rendered frame reuse its images, as an
+    onboard image shows the other robots as well as depending on the robot's own camera
+    With append, a resumed job adds to the labels.jsonl of every robot
+    '''
+
+    def __init__(self, robot_names, output_path, frames, label_format, image_writer, include_panels=False,
+                 skip_unchanged=False, flush_every=1000, flush_interval=5.0, append=False):
+        self.robot_names = list(robot_names)
+        self.image_writer = image_writer
+        self.include_panels = include_panels
+        self.skip_unchanged = skip_unchanged
+        self.robot_paths = {}
+        self.label_writers = {}
+        self.labelled = {}
+        for robot in self.robot_names:
+            robot_path = os.path.join(output_path, 'pov', robot[:-len('_base')])
+            os.makedirs(robot_path, exist_ok=True)
+            self.robot_paths[robot] = robot_path
+            if append:
+                self.labelled[robot] = labelled_frames(os.path.join(robot_path, 'labels.jsonl'))
+            self.label_writers[robot] = make_label_writer(label_format, robot_path, flush_every, flush_interval,
+                                                          self.robot_names, frames, append)
+
+    def start_simulation(self, scene, simulation_number):
+        '''
+        Reads the robots' parts and cameras at their start poses, with the POV render profile applied
+        Must be called after spawning and before simulating
+        '''
+        self.simulation_number = simulation_number
+        self.sim_no = f'simulation_number{simulation_number}'
+        self.bbox_projector = projector_from_scene(scene, self.robot_names, self.include_panels)
+        self.cameras = [scene.objects[pov_camera_name(robot)] for robot in self.robot_names]
+        self.start_cameras = np.array([np.array(camera.matrix_world) for camera in self.cameras])
+        self.resolution = render_resolution(scene)
+        depsgraph = bpy.context.evaluated_depsgraph_get()
+        self.projections = np.array([camera_projection(scene, camera, depsgraph, self.resolution)
+                                     for camera in self.cameras])
+        # Robot locations and rotations of the frame that rendered_files show
+        self.rendered_state = None
+        self.rendered_files = {}
+
+    def frame_complete(self, frame, sample_members=None):
+        '''
+        Returns whether an earlier run of a resumed job wrote the images and labels of every onboard camera
+        for a frame, the images being members of the frame's dataset sample when packing into shards
+        '''
+        for robot in self.robot_names:
+            others = set(self.robot_names) - {robot}
+            if not others <= self.labelled.get(robot, {}).get((self.sim_no, frame), set()):
+                return False
+            member = f'{robot[:-len("_base")]}.{self.image_writer.extension}'
+            if sample_members is not None:
+                if member not in sample_members:
+                    return False
+            elif not valid_image(os.path.join(self.robot_paths[robot], self.image_filename(frame))):
+                return False
+        return True
+
+    def image_filename(self, frame):
+        return f'Simulation{self.simulation_number}-frame{frame}.{self.image_writer.extension}'
+
+    def camera_matrices(self, locations, rotations):
+        '''Returns the world matrices [robots, 4, 4] of the onboard cameras for the given robot poses'''
+        return self.bbox_projector.robot_transforms(locations, rotations) @ self.start_cameras
+
+    def render_frame(self, scene, frame, locations, rotations, sample=None):
+        '''
+        Renders every onboard camera for a frame that the scene has been updated to
+        Given the dataset sample of the frame, the encoded images are added to it as <robot>.<extension> instead
+        of being saved, e.g. r1.png
+        '''
+        camera_matrices = self.camera_matrices(locations, rotations)
+        unchanged = self.skip_unchanged and self.rendered_state is not None and \
+            np.allclose(locations, self.rendered_state[0], atol=1e-6) and \
+            np.allclose(rotations, self.rendered_state[1], atol=1e-6)
+        for index, robot in enumerate(self.robot_names):
+            filepath = os.path.join(self.robot_paths[robot], self.image_filename(frame))
+            member = f'{robot[:-len("_base")]}.{self.image_writer.extension}'
+            if unchanged:
+                with profiler.stage('file_write'):
+                    if sample is None:
+                        self.image_writer.copy(self.rendered_files[robot], filepath)
+                    else:
+                        sample[member] = self.rendered_files[robot]
+                continue
+
+            scene.camera = self.cameras[index]
+            with profiler.stage('render'):
+                bpy.ops.render.render()
+            with profiler.stage('file_write'):
+                if sample is None:
+                    self.image_writer.save(filepath)
+                    self.rendered_files[robot] = filepath
+                else:
+                    # The previous image of a robot is kept as its encoded future in place of its file
+                    sample[member] = self.rendered_files[robot] = self.image_writer.encode()
+        self.rendered_state = (np.array(locations), np.array(rotations))
+        self.write_labels(frame, locations, rotations, camera_matrices)
+
+    def render_animation(self, scene, frames, locations, rotations, resume=False):
+        '''
+        Renders every onboard camera as one animation job, for robots baked to keyframes
+        When resuming, Blender skips the frames whose images exist, so incomplete ones are removed beforehand,
+        and labels are only written for frames that miss some of them
+        '''
+        for index, robot in enumerate(self.robot_names):
+            if resume:
+                for frame in frames:
+                    filepath = os.path.join(self.robot_paths[robot], self.image_filename(frame))
+                    if os.path.isfile(filepath) and not valid_image(filepath):
+                        os.remove(filepath)
+            # Blender replaces the # with the frame number and appends the file extension
+            scene.render.filepath = os.path.join(self.robot_paths[robot], f'Simulation{self.simulation_number}-frame#')
+            scene.camera = self.cameras[index]
+            bpy.ops.render.render(animation=True)
+        for frame in frames:
+            if resume and all(set(self.robot_names) - {robot} <= self.labelled[robot].get((self.sim_no, frame), set())
+                              for robot in self.robot_names):
+                continue
+            self.write_labels(frame, locations[frame], rotations[frame],
+                              self.camera_matrices(locations[frame], rotations[frame]))
+
+    def write_labels(self, frame, locations, rotations, camera_matrices):
+        '''Writes the position of every other robot, and its bounding boxes in each robot's camera'''
+        with profiler.stage('label_write'):
+            self.bbox_projector.set_cameras(self.projections @ np.linalg.inv(camera_matrices), self.resolution)
+            box_labels = self.bbox_projector.labels(locations, rotations, self.robot_names)
+            positions = np.asarray(locations).tolist()
+            for camera_robot, label_writer in self.label_writers.items():
+                for index, robot in enumerate(self.robot_names):
+                    if robot == camera_robot:
+                        continue
+                    x, y, z = positions[index]
+                    position = {"x": x, "y": y, "z": z, 'bbox': box_labels[index]['bbox'][camera_robot]}
+                    if 'panel_bboxes' in box_labels[index]:
+                        position['panel_bboxes'] = box_labels[index]['panel_bboxes'][camera_robot]
+                    label_writer.write(self.sim_no, frame, robot, position)
+
+    def flush(self):
+        for label_writer in self.label_writers.values():
+            label_writer.flush()
+
+    def close(self):
+        for label_writer in self.label_writers.values():
+            label_writer.close()
@@ -0,0 +1,74 @@
+'''
+Per-stage wall clock profiler for the render pipeline
+
+Stages are timed with profiler.stage('name') blocks on the shared module level profiler, and every timing is kept
+so that the summary can report percentiles as well as totals. The summary is written as JSON with
+profiler.write(path) at the end of a run.
+'''
+import json
+import time
+from contextlib import contextmanager
+import numpy as np
+
+PERCENTILES = (50, 90, 99)
+
+
+class Profiler():
+    '''
+    Collects the duration of every timed stage, keyed by stage name
+    A disabled profiler only checks a flag per stage
+    '''
+
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self.timings = {}
+        self.start_time = time.time()
+
+    @contextmanager
+    def stage(self, name):
+        if not self.enabled:
+            yield
+            return
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.timings.setdefault(name, []).append(time.perf_counter() - start)
+
+    def record(self, name, seconds):
+        '''Adds a duration measured elsewhere, e.g. by a Blender handler'''
+        if self.enabled:
+            self.timings.setdefault(name, []).append(seconds)
+
+    def reset(self):
+        self.timings = {}
+        self.start_time = time.time()
+
+    def summary(self):
+        '''Returns the count, total, mean, max and percentiles in seconds of every stage'''
+        stages = {}
+        for name, timings in self.timings.items():
+            timings = np.asarray(timings)
+            stage = {
+                'count': len(timings),
+                'total': float(timings.sum()),
+                'mean': float(timings.mean()),
+                'max': float(timings.max())
+            }
+            for percentile, value in zip(PERCENTILES, np.percentile(timings, PERCENTILES).tolist()):
+                stage[f'p{percentile}'] = value
+            stages[name] = stage
+        return stages
+
+    def write(self, path, metadata=None):
+        '''Writes the summary of every stage, the run's wall clock time and the given metadata as JSON'''
+        report = {
+            'wall_time': time.time() - self.start_time,
+            'metadata': metadata or {},
+            'stages': self.summary()
+        }
+        with open(path, 'w') as f:
+            json.dump(report, f, sort_keys=True, indent=4)
+
+
+profiler = Profiler()
@@ -0,0 +1,44 @@
+'''
+Full reference image quality metrics, used to compare fast renders against a high quality reference
+
+Images are float grayscale arrays [height, width] in display space with values from 0 to 1.
+SSIM follows Wang et al. 2004 with an 11 tap Gaussian window of standard deviation 1.5.
+'''
+import numpy as np
+
+SSIM_WINDOW = 11
+SSIM_SIGMA = 1.5
+SSIM_C1 = 0.01 ** 2
+SSIM_C2 = 0.03 ** 2
+
+
+def psnr(image, reference):
+    '''Returns the peak signal to noise ratio in dB, inf for identical images'''
+    mse = np.mean((np.asarray(image, dtype=np.float64) - reference) ** 2)
+    if mse == 0:
+        return float('inf')
+    return float(10 * np.log10(1 / mse))
+
+
+def gaussian_filter(image):
+    '''Filters an image with the normalized SSIM window, separably and keeping only fully covered pixels'''
+    taps = np.arange(SSIM_WINDOW) - SSIM_WINDOW // 2
+    weights = np.exp(-taps ** 2 / (2 * SSIM_SIGMA ** 2))
+    weights /= weights.sum()
+    height, width = image.shape
+    rows = sum(weight * image[offset:height - SSIM_WINDOW + 1 + offset] for offset, weight in enumerate(weights))
+    return sum(weight * rows[:, offset:width - SSIM_WINDOW + 1 + offset] for offset, weight in enumerate(weights))
+
+
+def ssim(image, reference):
+    '''Returns the mean structural similarity of two images, 1 for identical images'''
+    image = np.asarray(image, dtype=np.float64)
+    reference = np.asarray(reference, dtype=np.float64)
+    mean_image = gaussian_filter(image)
+    mean_reference = gaussian_filter(reference)
+    variance_image = gaussian_filter(image * image) - mean_image ** 2
+    variance_reference = gaussian_filter(reference * reference) - mean_reference ** 2
+    covariance = gaussian_filter(image * reference) - mean_image * mean_reference
+    similarity = ((2 * mean_image * mean_reference + SSIM_C1) * (2 * covariance + SSIM_C2)) / \
+        ((mean_image ** 2 + mean_reference ** 2 + SSIM_C1) * (variance_image + variance_reference + SSIM_C2))
+    return float(similarity.mean())
@@ -1,24 +1,39 @@
 import bpy
 import os
-import bmesh
 import random
-import json
 import sys
 import time
 import math
-from mathutils.bvhtree import BVHTree
+import logging
+import json
+import argparse
+import numpy as np
 from typing import List
 
+from arena import SPAWN_BLOCKS, sample_block_spawns
+from distance_field import load_distance_field
+from spawn import SpawnSampler
+from bbox import projector_from_scene, render_resolution, camera_projection
+from pov import PovRenderer
+from motion import motion_parameters
 from pathfinder import simulate_motion, initialise_pathfinder
+from labels import make_label_writer, truncate_partial_record
+from image_writer import RenderResultWriter, image_extension
+from dataset import DatasetWriter, DatasetReader, sample_key, DEFAULT_SHARD_SIZE, INDEX_FILE
+from checkpoint import JobManifest, restore_checkpoint, labelled_frames, valid_image
+from trajectory_cache import trajectory_key, load_cached_trajectories, save_cached_trajectories
+from profiler import profiler
 
-output_path = os.path.join(os.getcwd(), 'renders')
-if not os.path.isdir(output_path):
-    os.makedirs(output_path)
+logger = logging.getLogger(__name__)
 
-render_flag = sys.argv[-1]
+# The custom robot objects should created and placed inside the scene
+# and then their object names placed inside this array
+ROBOT_NAMES = ['r1_base', 'r2_base', 'r3_base', 'r4_base']
 
 render_configs = {
-    # The rotation units are in radians, the blender UI will display them in degrees
+    'output_path': os.path.join(os.getcwd(), 'renders'),
+    # The rotation units are in radians, the blender UI will display them in degrees. A camera's optional
+    # 'render_profile' overrides render_profile for its images, e.g. 'denoised' for a fast noisy camera
     'cameras': [
         {
             'location': (-2.19561, -1.05119, 3.34377),
@@ -30,73 +45,295 @@ render_configs = {
         }
     ],
     'camera_focal_length': 23,
-    'spawn_blocks': [
-        {
-            'block_name': 'A',
-            'x_range': (1.7, 2.9),
-            'y_range': (3.0, 3.8)
-        },
-        {
-            'block_name': 'B',
-            'x_range': (5.2, 5.8),
-            'y_range': (3.0, 3.8)
-        },
-        {
-            'block_name': 'C',
-            'x_range': (7.4, 7.4),
-            'y_range': (1.7, 3.5)
-        },
-        {
-            'block_name': 'D',
-            'x_range': (5.3, 6.3),
-            'y_range': (0.6, 1.5)
-        },
-        {
-            'block_name': 'E',
-            'x_range': (2.4, 2.9),
-            'y_range': (0.7, 1.5)
-        },
-        {
-            'block_name': 'F',
-            'x_range': (0.76, 0.76),
-            'y_range': (1, 2.5)
-        }
-    ],
+    # Indices into 'cameras' that are rendered, images of camera n are saved to camera{n + 1}
+    'active_cameras': [0],
+    # 'free_space' samples collision-free spawns at least spawn.MIN_SEPARATION apart anywhere in the arena,
+    # 'blocks' spawns one robot in each of the hand-picked 'spawn_blocks'
+    'spawn_mode': 'free_space',
+    'spawn_blocks': SPAWN_BLOCKS,
+    # Team of every robot, e.g. ['blue', 'blue', 'red', 'red'], to spawn each robot on its team's side of
+    # spawn.TEAM_SIDES with the 'free_space' spawn mode, None spawns robots anywhere
+    'spawn_teams': None,
+    # 'mesh' checks scan discs against the obstacle meshes, 'distance_field' uses the precomputed arena field
+    'obstacle_backend': 'mesh',
+    'distance_field_resolution': 0.01,
+    # Robots turn away from each other, found through a spatial hash over their positions
+    'robot_avoidance': True,
+    # Simulated trajectories are saved to cache/trajectories under a hash of the spawns, pathfinder settings,
+    # arena and random state, and replayed when the same scenario is rendered again
+    'trajectory_cache': True,
     'num_of_simulations': 1,
     'frames_per_simulation': 250,
-    'GPU_configs': {
+    # Simulation n is seeded with seed + n, None picks a random base seed that is printed for reproduction
+    'seed': None,
+    # Re-randomize lights, markers, robot poses and camera jitter in place before every simulation
+    'domain_randomization': True,
+    # Overrides the light color used when re-randomizing lights, e.g. 'random', None keeps the scene's setting
+    'randomized_light_color': None,
+    # Maximum camera offset from its configured pose, in metres and radians, e.g. 0.05 and 0.02. Jittered poses are
+    # written to camera_poses.jsonl, one record per simulation and camera, as the labels are in world coordinates
+    'camera_jitter': {
+        'location': 0.0,
+        'rotation': 0.0
+    },
+    # Subset of simulation numbers and (start, end) frames to render, None renders all of them
+    'simulation_numbers': None,
+    'frame_range': None,
+    # 'json' collects every label and writes labels.json at the end, 'jsonl' streams one record per robot per
+    # frame to labels.jsonl, flushed every label_flush_every records or label_flush_interval seconds,
+    # 'npy' writes a [frames, robots, dof] float32 array per simulation to the trajectories directory
+    'label_format': 'json',
+    'label_flush_every': 1000,
+    'label_flush_interval': 5.0,
+    # 'interleaved' simulates and renders frame by frame, 'baked' simulates the whole run, bakes it to
+    # keyframes and then renders one animation per camera
+    'render_mode': 'interleaved',
+    # Name of the entry in render_profiles used to configure the render engine
+    'render_profile': 'production',
+    # Format of the rendered frames: 'format' is 'PNG', 'JPEG' or 'WEBP', 'color_mode' is 'BW', 'RGB' or 'RGBA',
+    # 'bit_depth' is 8 or 16 (PNG only), 'compression' is the PNG compression and 'quality' the JPEG and WebP
+    # quality, both from 0 to 100
+    'image_format': {
+        'format': 'PNG',
+        'color_mode': 'RGB',
+        'bit_depth': 8,
+        'compression': 15,
+        'quality': 90
+    },
+    # Encodes and writes interleaved frames in a pool of image_writer_threads threads while the next frame is
+    # simulated and rendered, holding at most image_writer_max_pending frames in memory. Frames are written with
+    # the Standard view transform instead of the scene's, JPEG and WebP need Pillow. False lets Blender write every
+    # frame with the scene's view transform before moving on, like baked renders
+    'async_image_writer': False,
+    'image_writer_threads': 4,
+    'image_writer_max_pending': 16,
+    # 'files' saves every frame of camera n to camera{n + 1}, 'shards' packs the frames of every camera and their
+    # labels into tar shards of about shard_max_size bytes in the dataset directory, see dataset.py.
+    # Shards need the interleaved render mode
+    'output_mode': 'files',
+    'shard_max_size': DEFAULT_SHARD_SIZE,
+    # Adds each robot's 2D bounding box in every active camera to the json and jsonl labels, and with
+    # panel_bounding_boxes the boxes of its armor panels and light bars. Off by default, as the boxes change the
+    # shape of the label records that existing consumers read
+    'bounding_boxes': False,
+    'panel_bounding_boxes': False,
+    # Also renders every robot's onboard camera to pov/<robot> with its own render profile, and with
+    # pov_skip_unchanged reuses the previous images while no robot has moved
+    'pov_cameras': False,
+    'pov_render_profile': 'pov',
+    'pov_skip_unchanged': False,
+    # Resumes a preempted job in the same output directory, skipping the simulations and frames it completed and
+    # continuing the simulation from its last checkpoint, saved every checkpoint_every frames. The job's seed,
+    # spawns and checkpoints are recorded in job.json and checkpoints/, resuming needs the jsonl label format
+    'resume': False,
+    'checkpoint_every': 25,
+    # Level of the pipeline's log messages, DEBUG also logs every robot's obstacle checks
+    'log_level': 'INFO',
+    # Path of the JSON file the per-stage timings are written to, None skips writing them
+    'profile_output': None
+}
+
+# Render engine settings, picked by name with render_configs['render_profile'] or --render-profile
+# A threads value of 0 lets Blender use every core. Cycles profiles may also set an 'adaptive_threshold' and
+# 'denoise' with OpenImageDenoise, as the profiles found by the calibrate command do
+render_profiles = {
+    # Flat shaded frames for trajectory checks and bounding box labels
+    'draft': {
+        'engine': 'BLENDER_WORKBENCH',
+        'threads': 0,
+        'resolution': (480, 270)
+    },
+    'eevee': {
+        'engine': 'BLENDER_EEVEE',
+        'threads': 0,
+        'samples': 8,
+        'resolution': (960, 540)
+    },
+    # Small tiles keep every core busy when rendering on the CPU
+    'cpu-cycles': {
+        'engine': 'CYCLES',
+        'device': 'CPU',
+        'threads': 0,
+        'samples': 2,
+        'tile_size': 32,
+        'max_bounces': 2,
+        'adaptive_sampling': True,
+        'enable_caustics': False,
+        'resolution': (960, 540)
+    },
+    # Very few samples, denoised on the CPU by the compositor's Denoise node guided by the albedo and normal passes,
+    # so that the denoising is timed as its own 'denoise' stage
+    'denoised': {
+        'engine': 'CYCLES',
+        'device': 'CPU',
+        'threads': 0,
+        'samples': 4,
+        'tile_size': 32,
+        'max_bounces': 2,
+        'adaptive_sampling': False,
+        'enable_caustics': False,
+        'denoise': True,
+        'denoiser': 'compositor',
+        'resolution': (960, 540)
+    },
+    # Low resolution frames for the robots' onboard cameras
+    'pov': {
+        'engine': 'BLENDER_EEVEE',
+        'threads': 0,
+        'samples': 8,
+        'resolution': (320, 240)
+    },
+    # Temporary resolution to reduce testing runtime, default render resolution is 1080p
+    'production': {
+        'engine': 'CYCLES',
         'device': 'GPU',
+        'threads': 0,
         'samples': 2,
         'tile_size': 256,
         'max_bounces': 2,
         'adaptive_sampling': True,
-        'enable_caustics': False
+        'enable_caustics': False,
+        'resolution': (960, 540)
     }
 }
 
+# Profiles written by the calibrate command, which are only valid for the machine they were measured on
+TUNED_PROFILES_PATH = os.path.join(os.getcwd(), 'render_profiles.json')
+
+
+def load_tuned_profiles(path=TUNED_PROFILES_PATH):
+    """
+    Returns the render profiles saved by save_tuned_profile, an empty dict if there are none
+    """
+    if not os.path.isfile(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_tuned_profile(name, profile, path=TUNED_PROFILES_PATH):
+    """
+    Adds a render profile to the tuned profiles file, replacing any profile of the same name
+    """
+    profiles = load_tuned_profiles(path)
+    profiles[name] = profile
+    with open(path, 'w') as f:
+        json.dump(profiles, f, indent=4)
+    render_profiles[name] = profile
+
+
+render_profiles.update(load_tuned_profiles())
+
+
+def parse_render_args(argv):
+    """
+    Parses the script arguments given after '--' on the Blender command line
+    """
+    script_args = argv[argv.index('--') + 1:] if '--' in argv else []
+    parser = argparse.ArgumentParser(prog='blender_env.py')
+    parser.add_argument('command', nargs='?', choices=['render', 'calibrate'],
+                        help="'render' to render frames after setting up the environment, 'calibrate' to find the "
+                             "fastest render settings that meet a quality target")
+    parser.add_argument('--seed', type=int, help='base seed, simulation n is seeded with seed + n')
+    parser.add_argument('--simulations', help='comma separated simulation numbers to render')
+    parser.add_argument('--cameras', help='comma separated indices of the cameras to render')
+    parser.add_argument('--frames', help='start:end range of frames to render, end exclusive')
+    parser.add_argument('--output', help='directory for the rendered frames and labels')
+    parser.add_argument('--render-profile', choices=list(render_profiles), help='render engine settings to use')
+    parser.add_argument('--device', choices=['CPU', 'GPU'], help='Cycles render device, overrides the profile')
+    parser.add_argument('--camera-profile', action='append', metavar='INDEX=PROFILE',
+                        help='render profile of a single camera, e.g. 1=denoised, may be given for several cameras')
+    parser.add_argument('--label-format', choices=['json', 'jsonl', 'npy'],
+                        help='labels.json, streamed labels.jsonl or npy trajectory arrays')
+    parser.add_argument('--output-mode', choices=['files', 'shards'],
+                        help='one image file per frame and camera or tar shards of frames and labels')
+    parser.add_argument('--resume', action='store_true',
+                        help='resume a preempted job in the output directory, skipping the frames it completed')
+    parser.add_argument('--pov-cameras', action='store_true', help="also render the robots' onboard cameras")
+    parser.add_argument('--log-level', choices=['DEBUG', 'INFO', 'WARNING', 'ERROR'], help='level of log messages')
+    parser.add_argument('--profile-output', help='JSON file to write the per-stage timings to')
+    calibration = parser.add_argument_group('calibrate', 'options of the calibrate command')
+    calibration.add_argument('--target-ssim', type=float, default=0.95,
+                             help='lowest SSIM against the reference frames that a profile may reach')
+    calibration.add_argument('--target-psnr', type=float, help='lowest PSNR in dB that a profile may reach')
+    calibration.add_argument('--calibration-frames', type=int, default=3, help='number of reference frames')
+    calibration.add_argument('--reference-samples', type=int, default=512, help='samples of the reference frames')
+    calibration.add_argument('--tuned-profile', default='tuned', help='name the fastest profile is saved under')
+    return parser.parse_args(script_args)
+
 
-def render():
+def apply_render_args(render_args):
+    """
+    Overrides render_configs with the values given on the command line
+    Helper for render()
+    """
+    if render_args.seed is not None:
+        render_configs['seed'] = render_args.seed
+    if render_args.simulations:
+        render_configs['simulation_numbers'] = [int(i) for i in render_args.simulations.split(',')]
+    if render_args.cameras:
+        render_configs['active_cameras'] = [int(i) for i in render_args.cameras.split(',')]
+    if render_args.frames:
+        start, end = render_args.frames.split(':')
+        render_configs['frame_range'] = (int(start), int(end))
+    if render_args.output:
+        render_configs['output_path'] = os.path.abspath(render_args.output)
+    if render_args.render_profile:
+        render_configs['render_profile'] = render_args.render_profile
+    if render_args.device:
+        render_profiles[render_configs['render_profile']]['device'] = render_args.device
+    for camera_profile in render_args.camera_profile or []:
+        index, profile_name = camera_profile.split('=')
+        if profile_name not in render_profiles:
+            raise ValueError(f'Unknown render profile {profile_name} for camera {index}')
+        render_configs['cameras'][int(index)]['render_profile'] = profile_name
+    if render_args.label_format:
+        render_configs['label_format'] = render_args.label_format
+    if render_args.output_mode:
+        render_configs['output_mode'] = render_args.output_mode
+    if render_args.resume:
+        render_configs['resume'] = True
+    if render_args.pov_cameras:
+        render_configs['pov_cameras'] = True
+    if render_args.log_level:
+        render_configs['log_level'] = render_args.log_level
+    if render_args.profile_output:
+        render_configs['profile_output'] = os.path.abspath(render_args.profile_output)
+
+
+def render(blender_env=None):
     """
     Runs the simulation and outputs render frames and object coordinates
+    blender_env is re-randomized between simulations when domain randomization is enabled
     """
-    if str(render_flag) != 'render':
+    render_args = parse_render_args(sys.argv)
+    if render_args.command != 'render':
         return
+    apply_render_args(render_args)
+    logging.basicConfig(level=render_configs['log_level'], format='%(asctime)s %(name)s %(levelname)s: %(message)s')
+    if not os.path.isdir(render_configs['output_path']):
+        os.makedirs(render_configs['output_path'])
+
     start_time = time.time()
     scene = bpy.data.scenes[0]
-    cameras = []
-    outpost_a_location = render_configs['cameras'][0]['location']
-    outpost_a_rotation = render_configs['cameras'][0]['rotation']
-    cameras.append(initialise_camera(outpost_a_location, outpost_a_rotation))
+    cameras = {}
+    for index in render_configs['active_cameras']:
+        camera_config = render_configs['cameras'][index]
+        cameras[index] = initialise_camera(camera_config['location'], camera_config['rotation'])
 
-    outpost_b_location = render_configs['cameras'][1]['location']
-    outpost_b_rotation = render_configs['cameras'][1]['rotation']
-    # cameras.append(initialise_camera(outpost_b_location, outpost_b_rotation))
-
-    # The custom robot objects should created and placed inside the scene
-    # and then their object names placed inside this array
-    robot_names = ['r1_base', 'r2_base', 'r3_base', 'r4_base']
-    batch_render(scene, robot_names, cameras)
-    print(f'Render finished in {time.time() - start_time}!')
+    batch_render(scene, ROBOT_NAMES, cameras, blender_env)
+    logger.info('Render finished in %.2fs!', time.time() - start_time)
+    if 'denoise' in profiler.timings:
+        logger.info('Denoised %d frames in %.2fs', len(profiler.timings['denoise']),
+                    sum(profiler.timings['denoise']))
+    if render_configs['profile_output']:
+        profiler.write(render_configs['profile_output'], metadata={
+            'render_profile': render_configs['render_profile'],
+            'render_mode': render_configs['render_mode'],
+            'obstacle_backend': render_configs['obstacle_backend'],
+            'cameras': render_configs['active_cameras'],
+            'seed': render_configs['seed']
+        })
 
 
 def initialise_camera(coordinates, rotation):
@@ -111,156 +348,779 @@ def initialise_camera(coordinates, rotation):
     return bpy.context.object
 
 
-def batch_render(scene, robot_names, camera_objects):
+def batch_render(scene, robot_names, camera_objects, blender_env=None):
     """
     Sets up the render configurations, simulation configurations and then performs
     individual rendering and label saving
     Helper for render()
     """
 
-    num_of_simulations = render_configs['num_of_simulations']
-    camera_frames = render_configs['frames_per_simulation']
-    labels = []
+    if render_configs['output_mode'] == 'shards' and render_configs['render_mode'] == 'baked':
+        raise ValueError('Shards are packed frame by frame, which needs the interleaved render mode')
+    if render_configs['output_mode'] not in ('files', 'shards'):
+        raise ValueError(f"Unknown output mode {render_configs['output_mode']}")
+
+    simulation_numbers = render_configs['simulation_numbers']
+    if simulation_numbers is None:
+        simulation_numbers = range(0, render_configs['num_of_simulations'])
+    frames = range(*(render_configs['frame_range'] or (0, render_configs['frames_per_simulation'])))
+    dataset_path = os.path.join(render_configs['output_path'], 'dataset')
+    resume = None
+    if render_configs['resume']:
+        if render_configs['label_format'] != 'jsonl':
+            raise ValueError('Resuming needs the jsonl label format, which streams the labels of every frame to disk')
+        # What earlier runs wrote is read before the writers append to it
+        resume = {
+            'manifest': JobManifest(render_configs['output_path'], job_settings(robot_names, frames)),
+            'labelled': labelled_frames(os.path.join(render_configs['output_path'], 'labels.jsonl')),
+            'dataset_samples': None
+        }
+        if render_configs['output_mode'] == 'shards':
+            resume['dataset_samples'] = DatasetReader(dataset_path).samples \
+                if os.path.isfile(os.path.join(dataset_path, INDEX_FILE)) else {}
+        # Animation jobs skip the frames whose images exist
+        scene.render.use_overwrite = False
+    label_writer = make_label_writer(render_configs['label_format'], render_configs['output_path'],
+                                     render_configs['label_flush_every'], render_configs['label_flush_interval'],
+                                     robot_names, frames, render_configs['resume'])
+
+    camera_profiles = [camera_render_profile(index) for index in camera_objects]
+    if render_configs['bounding_boxes']:
+        # Bounding boxes are projected for every camera at the resolution of render_profile
+        resolution = tuple(render_profiles[render_configs['render_profile']]['resolution'])
+        for profile_name in camera_profiles:
+            if tuple(render_profiles[profile_name]['resolution']) != resolution:
+                raise ValueError(f"Camera profile {profile_name} must have the resolution of render profile "
+                                 f"{render_configs['render_profile']} to label bounding boxes")
+    camera_pose_file = None
+    if render_configs['domain_randomization'] and any(render_configs['camera_jitter'].values()):
+        pose_path = os.path.join(render_configs['output_path'], 'camera_poses.jsonl')
+        if render_configs['resume']:
+            truncate_partial_record(pose_path)
+        camera_pose_file = open(pose_path, 'a' if render_configs['resume'] else 'w')
+    denoise_handlers = []
+    if any(uses_compositor_denoising(render_profiles[profile_name]) for profile_name in camera_profiles):
+        denoise_handlers = add_denoise_timer()
+
+    use_render_profile(scene, render_configs['render_profile'])
+    # Animation jobs are written by Blender, with the same image format
+    asynchronous = render_configs['async_image_writer'] and render_configs['render_mode'] != 'baked'
+    image_writer = RenderResultWriter(scene, render_configs['image_format'], asynchronous,
+                                      render_configs['image_writer_threads'],
+                                      render_configs['image_writer_max_pending'])
+    dataset_writer = None
+    if render_configs['output_mode'] == 'shards':
+        dataset_writer = DatasetWriter(dataset_path, render_configs['shard_max_size'],
+                                       render_configs['image_writer_max_pending'], render_configs['resume'])
+    pov_renderer = None
+    if render_configs['pov_cameras']:
+        pov_renderer = PovRenderer(robot_names, render_configs['output_path'], frames, render_configs['label_format'],
+                                   image_writer, render_configs['panel_bounding_boxes'],
+                                   render_configs['pov_skip_unchanged'], render_configs['label_flush_every'],
+                                   render_configs['label_flush_interval'], render_configs['resume'])
+
+    spawn_sampler = make_spawn_sampler()
 
-    # Cycles render engine parameters for optimal quality and performance
-    bpy.context.scene.cycles.device = render_configs['GPU_configs']['device']
-    bpy.context.scene.cycles.samples = render_configs['GPU_configs']['samples']
-    bpy.context.scene.render.tile_x = render_configs['GPU_configs']['tile_size']
-    bpy.context.scene.render.tile_y = render_configs['GPU_configs']['tile_size']
-    bpy.context.scene.cycles.max_bounces = render_configs['GPU_configs']['max_bounces']
+    if render_configs['seed'] is None:
+        if resume is not None and resume['manifest'].seed is not None:
+            render_configs['seed'] = resume['manifest'].seed
+        else:
+            render_configs['seed'] = random.randrange(2 ** 31)
+        logger.info('Using seed %d', render_configs['seed'])
+    if resume is not None:
+        resume['manifest'].set_seed(render_configs['seed'])
 
-    for i in range(0, num_of_simulations):
-        spawn_robots(robot_names, render_configs['spawn_blocks'])
-        simulation_labels = render_helper(scene, robot_names, camera_objects, camera_frames, simulation_number=str(i))
-        labels.append(simulation_labels)
+    for i in simulation_numbers:
+        sim_no = f'simulation_number{i}'
+        if resume is not None and resume['manifest'].is_complete(sim_no):
+            logger.info('Skipping simulation %d, completed by an earlier run', i)
+            continue
+        seed_simulation(i)
+        if render_configs['domain_randomization']:
+            with profiler.stage('randomize'):
+                if blender_env is not None:
+                    blender_env.randomize(render_configs['randomized_light_color'])
+                if any(render_configs['camera_jitter'].values()):
+                    jitter_cameras(camera_objects, i)
+        with profiler.stage('spawn'):
+            spawn_robots(robot_names, render_configs['spawn_blocks'], spawn_sampler, render_configs['spawn_teams'])
+        if camera_pose_file is not None:
+            write_camera_poses(camera_pose_file, sim_no, camera_objects)
+        if resume is not None:
+            record_spawn(robot_names, resume['manifest'], sim_no)
+        render_helper(scene, robot_names, camera_objects, frames, label_writer, image_writer,
+                      simulation_number=str(i), pov_renderer=pov_renderer, dataset_writer=dataset_writer,
+                      resume=resume)
+        if resume is not None:
+            # Frames are written in the background, so they must be on disk before the simulation counts as complete
+            image_writer.wait()
+            if dataset_writer is not None:
+                dataset_writer.wait()
+            label_writer.flush()
+            if pov_renderer is not None:
+                pov_renderer.flush()
+            resume['manifest'].complete(sim_no)
 
-    save_labels_to_file(labels)
+    image_writer.close()
+    if dataset_writer is not None:
+        dataset_writer.close()
+    label_writer.close()
+    if pov_renderer is not None:
+        pov_renderer.close()
+    if camera_pose_file is not None:
+        camera_pose_file.close()
+    remove_frame_timers(denoise_handlers)
 
 
-def setup_animation_paths(mesh_objects):
+def write_camera_poses(pose_file, sim_no, camera_objects):
+    """
+    Writes the jittered pose of every camera in a simulation as a JSON Lines record, its location, rotation and
+    4x4 world matrix, so that the world coordinate labels can be projected into its images
+    Must be called after the view layer was updated, which updates the world matrices
+    Helper for batch_render()
+    """
+    for index, camera in camera_objects.items():
+        pose_file.write(json.dumps({
+            'simulation': sim_no,
+            'camera': index,
+            'location': list(camera.location),
+            'rotation': list(camera.rotation_euler),
+            'matrix_world': [list(row) for row in camera.matrix_world]
+        }) + '\n')
+    pose_file.flush()
+
+
+def make_spawn_sampler():
+    """
+    Returns the sampler of the 'free_space' spawn mode, or None for the 'blocks' spawn mode
+    The free space of the arena is found once and shared by every simulation
+    Helper for batch_render()
+    """
+    if render_configs['spawn_mode'] == 'free_space':
+        return SpawnSampler(load_distance_field(render_configs['distance_field_resolution']))
+    if render_configs['spawn_mode'] == 'blocks':
+        return None
+    raise ValueError(f"Unknown spawn mode {render_configs['spawn_mode']}")
+
+
+def job_settings(robot_names, frames):
+    """
+    Returns the settings that decide the outputs of a job, a job can only be resumed with the same settings
+    Helper for batch_render()
+    """
+    return {
+        'robots': robot_names,
+        'frames': (frames.start, frames.stop),
+        'cameras': render_configs['active_cameras'],
+        'render_mode': render_configs['render_mode'],
+        'output_mode': render_configs['output_mode'],
+        'image_format': render_configs['image_format'],
+        'bounding_boxes': render_configs['bounding_boxes'],
+        'panel_bounding_boxes': render_configs['panel_bounding_boxes'],
+        'pov_cameras': render_configs['pov_cameras'],
+        'spawn_mode': render_configs['spawn_mode'],
+        'obstacle_backend': render_configs['obstacle_backend'],
+        'robot_avoidance': render_configs['robot_avoidance'],
+        'domain_randomization': render_configs['domain_randomization'],
+        'camera_jitter': render_configs['camera_jitter']
+    }
+
+
+def record_spawn(robot_names, manifest, sim_no):
+    """
+    Records the spawn poses of a simulation in the job manifest, or when resuming moves the robots back to the
+    recorded poses should the spawns differ, e.g. because the arena changed in between
+    Helper for batch_render()
+    """
     scene = bpy.data.scenes[0]
-    x_transitions = [-0.5, 0.5]
-    y_transitions = [-0.25, 0.25]
+    locations = np.array([tuple(scene.objects[robot].location) for robot in robot_names])
+    rotations = np.array([scene.objects[robot].rotation_euler.z for robot in robot_names])
+    spawn = manifest.spawn(sim_no)
+    if spawn is None:
+        manifest.record_spawn(sim_no, locations, rotations)
+    elif not (np.allclose(spawn[0], locations) and np.allclose(spawn[1], rotations)):
+        logger.warning('Spawns of %s differ from the recorded ones, restoring the recorded spawns', sim_no)
+        replay_robot_transforms(robot_names, *spawn)
+
+
+def use_render_profile(scene, profile_name):
+    """
+    Applies a render profile unless it is already applied, so that switching between cameras, the fixed cameras
+    with their own profiles and the onboard cameras, only reconfigures the render engine when their profiles differ
+    """
+    global applied_render_profile
+    if applied_render_profile != profile_name:
+        apply_render_profile(scene, render_profiles[profile_name])
+        applied_render_profile = profile_name
 
-    for frame in range(0, 100, 50):
-        scene.frame_set(frame)
-        for robot in mesh_objects:
-            mesh = scene.objects[robot]
-            if frame == 0:
-                mesh.keyframe_insert(data_path='location')
-            else:
-                mesh.location.x = (mesh.location.x + x_transitions[random.randint(0, 1)])
-                mesh.location.y = (mesh.location.y + y_transitions[random.randint(0, 1)])
-                mesh.keyframe_insert(data_path='location')
 
+applied_render_profile = None
 
-def spawn_robots(robot_objects, spawn_blocks: List[dict]):
+
+def apply_render_profile(scene, profile):
     """
-    Randomly spawns the given robots in the given blocks
+    Configures the render engine, device, threads, tiles, samples, bounces, denoising and resolution from a profile
     Helper for batch_render()
     """
-    random.shuffle(spawn_blocks)
+    scene.render.engine = profile['engine']
+    scene.render.resolution_x, scene.render.resolution_y = profile['resolution']
+    scene.render.threads_mode = 'FIXED' if profile['threads'] else 'AUTO'
+    if profile['threads']:
+        scene.render.threads = profile['threads']
+
+    if profile['engine'] == 'CYCLES':
+        scene.cycles.device = profile['device']
+        scene.cycles.samples = profile['samples']
+        scene.cycles.max_bounces = profile['max_bounces']
+        scene.cycles.use_adaptive_sampling = profile['adaptive_sampling']
+        scene.cycles.caustics_reflective = profile['enable_caustics']
+        scene.cycles.caustics_refractive = profile['enable_caustics']
+        # Tiles moved from the render settings to Cycles in Blender 3.0
+        if hasattr(scene.render, 'tile_x'):
+            scene.render.tile_x = profile['tile_size']
+            scene.render.tile_y = profile['tile_size']
+        else:
+            scene.cycles.tile_size = profile['tile_size']
+        if 'adaptive_threshold' in profile:
+            scene.cycles.adaptive_threshold = profile['adaptive_threshold']
+        # Profiles without the key keep the scene's denoising setting, whose default differs between versions
+        if 'denoise' in profile:
+            scene.cycles.use_denoising = profile['denoise'] and not uses_compositor_denoising(profile)
+            if scene.cycles.use_denoising:
+                scene.cycles.denoiser = 'OPENIMAGEDENOISE'
+                scene.cycles.denoising_input_passes = 'RGB_ALBEDO_NORMAL'
+    elif profile['engine'] == 'BLENDER_EEVEE':
+        scene.eevee.taa_render_samples = profile['samples']
+    use_compositor_denoising(scene, uses_compositor_denoising(profile))
+
+
+def uses_compositor_denoising(profile):
+    """
+    Returns whether a render profile denoises in the compositor, 'denoiser' defaults to Cycles' own denoising
+    """
+    return profile['engine'] == 'CYCLES' and profile.get('denoise', False) and profile.get('denoiser') == 'compositor'
+
+
+def use_compositor_denoising(scene, enabled):
+    """
+    Denoises every render with a compositor Denoise node guided by the albedo and normal passes, which runs once
+    Cycles has finished sampling so that it can be timed on its own. The node is added on first use and muted
+    while disabled, which passes the noisy image through to the composite and viewer nodes
+    Helper for apply_render_profile()
+    """
+    tree = scene.node_tree if scene.use_nodes else None
+    denoise = None
+    if tree is not None:
+        denoise = next((node for node in tree.nodes if node.type == 'DENOISE'), None)
+    # The guiding passes are only stored while they are used, as they take memory and time
+    for view_layer in scene.view_layers:
+        view_layer.cycles.denoising_store_passes = enabled
+    if not enabled:
+        if denoise is not None:
+            denoise.mute = True
+        return
+
+    scene.use_nodes = True
+    scene.render.use_compositing = True
+    tree = scene.node_tree
+    if denoise is None:
+        render_layers = next((node for node in tree.nodes if node.type == 'R_LAYERS'), None)
+        if render_layers is None:
+            render_layers = tree.nodes.new('CompositorNodeRLayers')
+        denoise = tree.nodes.new('CompositorNodeDenoise')
+        # Renders are linear HDR images
+        denoise.use_hdr = True
+        for link in list(tree.links):
+            if link.from_socket == render_layers.outputs['Image']:
+                tree.links.new(denoise.outputs['Image'], link.to_socket)
+        tree.links.new(render_layers.outputs['Image'], denoise.inputs['Image'])
+        tree.links.new(render_layers.outputs['Denoising Albedo'], denoise.inputs['Albedo'])
+        tree.links.new(render_layers.outputs['Denoising Normal'], denoise.inputs['Normal'])
+    denoise.mute = False
+
+
+def camera_render_profile(index):
+    """
+    Returns the name of the render profile of a camera, its own 'render_profile' or the job's render_profile
+    """
+    return render_configs['cameras'][index].get('render_profile', render_configs['render_profile'])
+
+
+def seed_scene(seed):
+    """
+    Seeds the random generators before the scene is built, so that every worker given the same seed builds the same
+    lights, markers and robot poses, as the launcher splits one simulation across several workers
+    None leaves the generators unseeded
+    """
+    if seed is not None:
+        random.seed(seed)
+        np.random.seed(seed)
+
+
+def seed_simulation(simulation_number):
+    """
+    Seeds the random generators for a simulation so that every worker reproduces the same spawns and motion
+    Helper for batch_render()
+    """
+    seed = render_configs['seed'] + int(simulation_number)
+    random.seed(seed)
+    np.random.seed(seed)
+
+
+def jitter_cameras(camera_objects, simulation_number):
+    """
+    Moves every camera to a random offset from its configured location and rotation
+    Every camera draws from its own generator seeded by the simulation and camera, so that neither the spawns nor
+    the other cameras depend on which cameras are rendered
+    Helper for batch_render()
+    """
+    jitter = render_configs['camera_jitter']
+    for index, camera in camera_objects.items():
+        rng = random.Random(f"{render_configs['seed'] + int(simulation_number)}-camera{index}")
+        camera_config = render_configs['cameras'][index]
+        camera.location = [c + rng.uniform(-jitter['location'], jitter['location'])
+                           for c in camera_config['location']]
+        camera.rotation_euler = [r + rng.uniform(-jitter['rotation'], jitter['rotation'])
+                                 for r in camera_config['rotation']]
+
+
+def setup_animation_paths(robot_names, locations, rotations, frame_start=0):
+    """
+    Bakes simulated trajectories into location and z rotation keyframes on each robot, one key per frame
+
+    :param locations: array of shape [frames, robots, 3]
+    :param rotations: array of shape [frames, robots] of z rotations
+    """
     scene = bpy.data.scenes[0]
-    for index, robot in enumerate(robot_objects):
+    frames = np.arange(frame_start, frame_start + len(locations), dtype=np.float32)
+    for index, robot in enumerate(robot_names):
+        mesh = scene.objects[robot]
+        mesh.animation_data_create()
+        mesh.animation_data.action = bpy.data.actions.new(name=f'{robot}_action')
+        channels = [('location', axis, locations[:, index, axis]) for axis in range(3)]
+        channels.append(('rotation_euler', 2, rotations[:, index]))
+        for data_path, axis, values in channels:
+            fcurve = mesh.animation_data.action.fcurves.new(data_path=data_path, index=axis)
+            fcurve.keyframe_points.add(len(frames))
+            # Keyframe coordinates are interleaved (frame, value) pairs
+            fcurve.keyframe_points.foreach_set('co', np.column_stack((frames, values)).astype(np.float32).ravel())
+            fcurve.update()
+
+
+def clear_animation_paths(robot_names):
+    """
+    Removes baked keyframes so the robots can be moved freely again
+    """
+    scene = bpy.data.scenes[0]
+    for robot in robot_names:
+        mesh = scene.objects[robot]
+        if mesh.animation_data is not None and mesh.animation_data.action is not None:
+            bpy.data.actions.remove(mesh.animation_data.action)
+        mesh.animation_data_clear()
+
+
+def simulate_trajectories(robot_names, camera_frames):
+    """
+    Runs the whole simulation without touching the scene and returns the robot locations [frames, robots, 3]
+    and z rotations [frames, robots] after each frame
+    """
+    scene = bpy.data.scenes[0]
+    robot_state, collision_world, spatial_hash = initialise_pathfinder(
+        robot_names, render_configs['obstacle_backend'], render_configs['distance_field_resolution'],
+        render_configs['robot_avoidance'])
+
+    locations = np.zeros((camera_frames, len(robot_names), 3))
+    rotations = np.zeros((camera_frames, len(robot_names)))
+    rotation = np.array([scene.objects[robot].rotation_euler.z for robot in robot_names])
+    for frame in range(0, camera_frames):
+        turned = simulate_motion(robot_state, collision_world, spatial_hash, frame, write_back=False)
+        rotation[turned] = robot_state.bearing[turned] - math.pi/2
+        locations[frame] = robot_state.position
+        rotations[frame] = rotation
+    return locations, rotations
+
+
+def trajectory_cache_key(robot_names, camera_frames):
+    """
+    Returns the cache key of the simulation about to run from the robots' current poses
+    Must be called before simulating, as the key covers the current state of the random generator
+    """
+    scene = bpy.data.scenes[0]
+    settings = {
+        'obstacle_backend': render_configs['obstacle_backend'],
+        'distance_field_resolution': render_configs['distance_field_resolution'],
+        'robot_avoidance': render_configs['robot_avoidance'],
+        'motion': motion_parameters()
+    }
+    return trajectory_key(robot_names,
+                          [tuple(scene.objects[robot].location) for robot in robot_names],
+                          [scene.objects[robot].rotation_euler.z for robot in robot_names],
+                          np.random.get_state(), camera_frames, settings)
+
+
+def cached_trajectories(robot_names, camera_frames):
+    """
+    Returns the trajectories of simulate_trajectories(), replayed from the trajectory cache when possible
+    """
+    if not render_configs['trajectory_cache']:
+        return simulate_trajectories(robot_names, camera_frames)
+
+    cache_key = trajectory_cache_key(robot_names, camera_frames)
+    cached = load_cached_trajectories(cache_key)
+    if cached is not None:
+        logger.info('Replaying cached trajectories %s', cache_key)
+        return cached
+    locations, rotations = simulate_trajectories(robot_names, camera_frames)
+    save_cached_trajectories(cache_key, locations, rotations)
+    return locations, rotations
+
+
+def replay_robot_transforms(robot_names, locations, rotations):
+    """
+    Moves the robots to recorded locations [robots, 3] and z rotations [robots], updating the layer once
+    """
+    scene = bpy.data.scenes[0]
+    for index, robot in enumerate(robot_names):
         robot_mesh = scene.objects[robot]
-        spawn_block = spawn_blocks[index]
-        robot_mesh.location.x = random.uniform(spawn_block['x_range'][0], spawn_block['x_range'][1])
-        robot_mesh.location.y = random.uniform(spawn_block['y_range'][0], spawn_block['y_range'][1])
-        robot_mesh.location.z = 0.03
+        robot_mesh.location = locations[index].tolist()
+        robot_mesh.rotation_euler.z = rotations[index]
+
+    with profiler.stage('depsgraph_update'):
+        layer = bpy.context.view_layer
+        layer.update()
+
+
+def spawn_robots(robot_objects, spawn_blocks: List[dict], spawn_sampler: SpawnSampler = None, teams=None):
+    """
+    Randomly spawns the given robots in the free space of the arena if a spawn sampler is given,
+    otherwise in the given blocks
+    Helper for batch_render()
+    """
+    scene = bpy.data.scenes[0]
+    if spawn_sampler is not None:
+        positions = spawn_sampler.sample(len(robot_objects), teams)
+    else:
+        positions = sample_block_spawns(len(robot_objects), spawn_blocks)
+    for robot, position in zip(robot_objects, positions):
+        scene.objects[robot].location = position
 
     layer = bpy.context.view_layer
     layer.update()
 
-    print("Robots successfully spawned")
+    logger.info('Robots successfully spawned')
 
 
-def robot_intersects(robot_object: str, block_list: List[str]):
+def render_helper(scene, robot_names, camera_objects, frames, label_writer, image_writer,
+                  simulation_number='render', pov_renderer=None, dataset_writer=None, resume=None):
     """
-    Returns true if given robot_object overlaps with any block mesh, false otherwise
+    Renders the simulation in the configured render mode and writes each robot's coordinates per frame
+    to the label writer
 
-    Helper function for spawn_robots()
-
-    :param robot_object: name of the object to check for mesh overlap
-    :type robot_object: str
-    :param block_list: string list of all the block obstacles in the environment
-    :type block_list: List[str]
+    :param camera_objects: dict of camera index to camera object
+    :param image_writer: RenderResultWriter that saves the interleaved frames
+    :param frames: range of frames to render and label, the simulation always starts from frame 0
+    :param pov_renderer: also renders the robots' onboard cameras if given
+    :param dataset_writer: packs the frames and labels into the DatasetWriter's shards instead of image files
+    :param resume: when resuming, dict of the job's 'manifest', the robots 'labelled' in every (simulation, frame)
+        and the 'dataset_samples' written by earlier runs
     """
+    bbox_projector = None
+    if render_configs['bounding_boxes'] and camera_objects:
+        use_render_profile(scene, render_configs['render_profile'])
+        bbox_projector = make_bbox_projector(scene, robot_names, camera_objects)
+    if pov_renderer is not None:
+        use_render_profile(scene, render_configs['pov_render_profile'])
+        pov_renderer.start_simulation(scene, simulation_number)
+
+    manifest = None
+    complete_frames = set()
+    if resume is not None:
+        manifest = resume['manifest']
+        complete_frames = completed_frames(simulation_number, robot_names, camera_objects, frames, resume,
+                                           image_writer.extension, pov_renderer)
+        logger.info('%d of %d frames of simulation %s were completed by an earlier run', len(complete_frames),
+                    len(frames), simulation_number)
+
+    if render_configs['render_mode'] == 'baked':
+        render_baked(scene, robot_names, camera_objects, frames, label_writer, simulation_number, bbox_projector,
+                     pov_renderer, complete_frames, resume is not None)
+    else:
+        render_interleaved(scene, robot_names, camera_objects, frames, label_writer, image_writer,
+                           simulation_number, bbox_projector, pov_renderer, dataset_writer, manifest, complete_frames)
+
+
+def camera_image_path(index, simulation_number, frame, extension):
+    return os.path.join(render_configs['output_path'], f'camera{index + 1}',
+                        f'Simulation{simulation_number}-frame{frame}-camera{index}.{extension}')
 
-    scene = bpy.data.scenes[0]
 
-    # Create a copy of the object for matrix transformation
-    copy_mesh = bmesh.new()
-    copy_mesh.from_mesh(scene.objects[robot_object].data)
-    copy_mesh.transform(scene.objects[robot_object].matrix_world)
-    robot_bvtree = BVHTree.FromBMesh(copy_mesh)
-    # Check if spawned robot overlaps with existing meshes
-    for block in block_list:
-        comparison_mesh = bmesh.new()
-        comparison_mesh.from_mesh(scene.objects[block].data)
-        comparison_mesh.transform(scene.objects[block].matrix_world)
-        comparison_bvtree = BVHTree.FromBMesh(comparison_mesh)
-        intersections = comparison_bvtree.overlap(robot_bvtree)
-        if len(intersections) > 0:
-            print(f'{block} intersects with {robot_object} at {len(intersections)} points, respawning...')
-            return True
-    return False
+def completed_frames(simulation_number, robot_names, camera_objects, frames, resume, extension, pov_renderer=None):
+    """
+    Returns the frames of a simulation whose images and labels were all written by earlier runs of the job
+    Helper for render_helper()
+    """
+    sim_no = f'simulation_number{simulation_number}'
+    dataset_samples = resume['dataset_samples']
+    complete = set()
+    for frame in frames:
+        if not set(robot_names) <= resume['labelled'].get((sim_no, frame), set()):
+            continue
+        members = None
+        if dataset_samples is not None:
+            members = dataset_samples.get(sample_key(sim_no, frame), {})
+            if not all(f'camera{index}.{extension}' in members for index in camera_objects):
+                continue
+        elif not all(valid_image(camera_image_path(index, simulation_number, frame, extension))
+                     for index in camera_objects):
+            continue
+        if pov_renderer is not None and not pov_renderer.frame_complete(frame, members):
+            continue
+        complete.add(frame)
+    return complete
 
 
-def render_helper(scene, robot_names, camera_objects, camera_frames, simulation_number='render'):
+def make_bbox_projector(scene, robot_names, camera_objects):
     """
-    Sets render configuration, renders the scene and returns a the individual simulation data in a dict
+    Reads the bounding box corners of every robot part and the matrices of every camera from the scene
+    Must be called after spawning and before simulating, while the robots are at their start poses
+    Helper for render_helper()
     """
+    bbox_projector = projector_from_scene(scene, robot_names, render_configs['panel_bounding_boxes'])
+    depsgraph = bpy.context.evaluated_depsgraph_get()
+    resolution = render_resolution(scene)
+    view_projections = [camera_projection(scene, camera, depsgraph, resolution) @ np.linalg.inv(camera.matrix_world)
+                        for camera in camera_objects.values()]
+    bbox_projector.set_cameras(view_projections, resolution)
+    return bbox_projector
+
 
-    # This stores information about each robot, and its coordinates per frame
+def render_interleaved(scene, robot_names, camera_objects, frames, label_writer, image_writer, simulation_number,
+                       bbox_projector=None, pov_renderer=None, dataset_writer=None, manifest=None,
+                       complete_frames=()):
+    """
+    Steps the simulation and renders every camera one frame at a time
+    With a dataset writer every frame is written as one sample of the images of every camera and the labels
+    With a job manifest the simulation is checkpointed and resumed from its last checkpoint, frames before the
+    checkpoint are replayed from its trajectory and complete_frames are simulated but not rendered
+    Helper for render_helper()
+    """
     sim_no = f'simulation_number{simulation_number}'
-    simulation_log = {
-        sim_no: {
-            f'{robot_names[0]}': {},
-            f'{robot_names[1]}': {},
-            f'{robot_names[2]}': {},
-            f'{robot_names[3]}': {}
-        }
-    }
 
-    pathfinder_configs, obstacle_list, other_robots_map = initialise_pathfinder(robot_names)
+    cache_key = None
+    cached = None
+    if render_configs['trajectory_cache']:
+        cache_key = trajectory_cache_key(robot_names, frames.stop)
+        cached = load_cached_trajectories(cache_key)
+
+    if cached is None:
+        robot_state, collision_world, spatial_hash = initialise_pathfinder(
+            robot_names, render_configs['obstacle_backend'], render_configs['distance_field_resolution'],
+            render_configs['robot_avoidance'])
+        locations = np.zeros((frames.stop, len(robot_names), 3))
+        rotations = np.zeros((frames.stop, len(robot_names)))
+        checkpoint = manifest.load_checkpoint(sim_no) if manifest is not None else None
+        replay_end = 0
+        if checkpoint is not None:
+            replay_end = restore_checkpoint(checkpoint, robot_state) + 1
+            locations[:replay_end] = checkpoint['locations']
+            rotations[:replay_end] = checkpoint['rotations']
+            replay_robot_transforms(robot_names, locations[replay_end - 1], rotations[replay_end - 1])
+            logger.info('Resuming simulation %s from its checkpoint at frame %d', simulation_number, replay_end - 1)
+    else:
+        logger.info('Replaying cached trajectories %s', cache_key)
+        locations, rotations = cached
+        replay_end = frames.stop
+
+    camera_names = [f'camera{index}' for index in camera_objects]
+    if dataset_writer is None:
+        for index in camera_objects:
+            os.makedirs(os.path.join(render_configs['output_path'], f'camera{index + 1}'), exist_ok=True)
 
     # Rendering
     # https://blender.stackexchange.com/questions/1101/blender-rendering-automation-build-script
-    for frame in range(0, camera_frames):
+    for frame in range(0, frames.stop):
+        # Replayed frames do not depend on the previous ones, so frames that are not rendered are skipped
+        replayed = frame < replay_end
+        if replayed and (frame not in frames or frame in complete_frames):
+            continue
         # Changes keyframe to allow passage of time
         scene.frame_set(frame)
-        simulate_motion(robot_names, pathfinder_configs, obstacle_list, other_robots_map, frame)
-        for index, camera in enumerate(camera_objects):
-            filename = f'Simulation{simulation_number}-frame{str(frame)}-camera{index}.png'
-            camera_path = os.path.join(output_path, f'camera{index + 1}')
-            bpy.context.scene.render.filepath = os.path.join(camera_path, filename)
+        if replayed:
+            replay_robot_transforms(robot_names, locations[frame], rotations[frame])
+        else:
+            simulate_motion(robot_state, collision_world, spatial_hash, frame)
+            locations[frame] = robot_state.position
+            rotations[frame] = [scene.objects[robot].rotation_euler.z for robot in robot_names]
+            if manifest is not None and (frame + 1) % render_configs['checkpoint_every'] == 0:
+                manifest.save_checkpoint(sim_no, frame, robot_state, locations, rotations)
+        if frame not in frames or frame in complete_frames:
+            continue
+        # Sample members of the frame, the encoded images of every camera and the labels
+        sample = {}
+        for index, camera in camera_objects.items():
+            use_render_profile(scene, camera_render_profile(index))
             bpy.data.scenes[0].camera = camera
-            # Temporary code to reduce testing runtime, default render resolution is 1080p
-            scene.render.resolution_x = 960
-            scene.render.resolution_y = 540
-            bpy.ops.render.render(write_still=True)
+            # The render result is saved separately so that encoding and writing the file is timed on its own,
+            # with the asynchronous writer this only times copying the pixels out of the render result
+            with profiler.stage('render'):
+                bpy.ops.render.render()
+            with profiler.stage('file_write'):
+                if dataset_writer is None:
+                    image_writer.save(camera_image_path(index, simulation_number, frame, image_writer.extension))
+                else:
+                    sample[f'camera{index}.{image_writer.extension}'] = image_writer.encode()
 
         # Get the placement coordinates of each robot
-        for index, robot in enumerate(robot_names):
-            mesh = bpy.context.scene.objects[robot]
-            position = {
-                "x": mesh.location.x,
-                "y": mesh.location.y,
-                "z": mesh.location.z
-            }
-            simulation_log[sim_no][robot][f'frame_{frame}'] = position
+        with profiler.stage('label_write'):
+            if bbox_projector is not None:
+                box_labels = bbox_projector.labels(locations[frame], rotations[frame], camera_names)
+            for index, robot in enumerate(robot_names):
+                mesh = bpy.context.scene.objects[robot]
+                position = {
+                    "x": mesh.location.x,
+                    "y": mesh.location.y,
+                    "z": mesh.location.z
+                }
+                if bbox_projector is not None:
+                    position.update(box_labels[index])
+                label_writer.write(sim_no, frame, robot, position)
+                sample.setdefault('json', {})[robot] = position
+
+        # The scene was updated once for the frame, so every onboard camera renders the same state
+        if pov_renderer is not None:
+            use_render_profile(scene, render_configs['pov_render_profile'])
+            pov_renderer.render_frame(scene, frame, locations[frame], rotations[frame],
+                                      sample if dataset_writer is not None else None)
 
-    return simulation_log
+        if dataset_writer is not None:
+            dataset_writer.write(sample_key(sim_no, frame), sample)
 
+    if cache_key is not None and cached is None:
+        save_cached_trajectories(cache_key, locations, rotations)
 
-def save_labels_to_file(labels):
+
+def render_baked(scene, robot_names, camera_objects, frames, label_writer, simulation_number, bbox_projector=None,
+                 pov_renderer=None, complete_frames=(), resume=False):
     """
-    Saves the coordinates of the robot objects to a json for each individual frame to a labels.json
-    File is overwritten if it already exists
+    Simulates every frame up front, bakes the trajectories to keyframes and renders each camera as a single
+    animation job, so that Blender keeps the scene synced between frames
+    When resuming, Blender skips the frames whose images exist, so incomplete images are removed beforehand, and
+    the labels of complete_frames are not written again
     Helper for render_helper()
     """
-    with open(os.path.join(output_path, 'labels.json'), 'w+') as f:
-        json.dump(labels, f, sort_keys=True, indent=4, separators=(',', ': '))
+    sim_no = f'simulation_number{simulation_number}'
+
+    simulation_start = time.time()
+    locations, rotations = cached_trajectories(robot_names, frames.stop)
+    logger.info('Simulated %d frames in %.2fs', frames.stop, time.time() - simulation_start)
+
+    setup_animation_paths(robot_names, locations, rotations)
+    scene.frame_start = frames.start
+    scene.frame_end = frames.stop - 1
+
+    render_start = time.time()
+    frame_handlers = add_frame_timers()
+    for index, camera in camera_objects.items():
+        use_render_profile(scene, camera_render_profile(index))
+        if resume:
+            for frame in frames:
+                image_path = camera_image_path(index, simulation_number, frame,
+                                               image_extension(render_configs['image_format']))
+                if os.path.isfile(image_path) and not valid_image(image_path):
+                    os.remove(image_path)
+        # Blender replaces the # with the frame number and appends the file extension
+        filename = f'Simulation{simulation_number}-frame#-camera{index}'
+        camera_path = os.path.join(render_configs['output_path'], f'camera{index + 1}')
+        scene.render.filepath = os.path.join(camera_path, filename)
+        scene.camera = camera
+        bpy.ops.render.render(animation=True)
+    if pov_renderer is not None:
+        use_render_profile(scene, render_configs['pov_render_profile'])
+        pov_renderer.render_animation(scene, frames, locations, rotations, resume)
+    remove_frame_timers(frame_handlers)
+    logger.info('Rendered %d frames in %.2fs', len(frames), time.time() - render_start)
+
+    clear_animation_paths(robot_names)
+
+    camera_names = [f'camera{index}' for index in camera_objects]
+    with profiler.stage('label_write'):
+        for frame in frames:
+            if frame in complete_frames:
+                continue
+            if bbox_projector is not None:
+                box_labels = bbox_projector.labels(locations[frame], rotations[frame], camera_names)
+            for index, robot in enumerate(robot_names):
+                x, y, z = locations[frame, index].tolist()
+                position = {"x": x, "y": y, "z": z}
+                if bbox_projector is not None:
+                    position.update(box_labels[index])
+                label_writer.write(sim_no, frame, robot, position)
+
+
+def add_frame_timers():
+    """
+    Times the render and file write of every frame of an animation job through Blender's render handlers
+    Returns the added handlers for remove_frame_timers()
+    Helper for render_baked()
+    """
+    marks = {}
+
+    # Handlers are called with the scene, and the depsgraph as well in newer Blender versions
+    def render_pre(*args):
+        marks['start'] = time.perf_counter()
+
+    def render_post(*args):
+        marks['rendered'] = time.perf_counter()
+        profiler.record('render', marks['rendered'] - marks['start'])
+
+    def render_write(*args):
+        profiler.record('file_write', time.perf_counter() - marks['rendered'])
+
+    handlers = [
+        (bpy.app.handlers.render_pre, render_pre),
+        (bpy.app.handlers.render_post, render_post),
+        (bpy.app.handlers.render_write, render_write)
+    ]
+    for handler_list, handler in handlers:
+        handler_list.append(handler)
+    return handlers
+
+
+def add_denoise_timer():
+    """
+    Times the compositor denoising of every render through Blender's render handlers, from the compositor's first
+    status message, sent once Cycles has finished sampling, until the render is done. The time is part of the
+    render stage as well. Status messages only reach the handlers when Blender runs in the background
+    Returns the added handlers for remove_frame_timers()
+    Helper for batch_render()
+    """
+    marks = {}
+
+    def render_pre(*args):
+        marks.pop('compositing', None)
+
+    # Called with the status message
+    def render_stats(message, *args):
+        if 'compositing' not in marks and 'Compositing' in message:
+            marks['compositing'] = time.perf_counter()
+
+    def render_post(*args):
+        if 'compositing' in marks and uses_compositor_denoising(render_profiles[applied_render_profile]):
+            profiler.record('denoise', time.perf_counter() - marks['compositing'])
+
+    handlers = [
+        (bpy.app.handlers.render_pre, render_pre),
+        (bpy.app.handlers.render_stats, render_stats),
+        (bpy.app.handlers.render_post, render_post)
+    ]
+    for handler_list, handler in handlers:
+        handler_list.append(handler)
+    return handlers
+
+
+def remove_frame_timers(handlers):
+    for handler_list, handler in handlers:
+        handler_list.remove(handler)
 
 
 if __name__ == '__main__':
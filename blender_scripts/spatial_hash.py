@@ -0,0 +1,60 @@
+'''
+Uniform grid spatial hash over robot positions, used for robot-robot avoidance
+
+Each robot only queries the cells around it, so the cost per robot depends on how many robots are nearby
+rather than on the total number of robots.
+'''
+import math
+import numpy as np
+
+
+class SpatialHash():
+    '''
+    Maps grid cells to the indices of the robots inside them
+    update() only moves the robots whose cell changed since the previous frame
+    '''
+
+    def __init__(self, cell_size: float):
+        self.cell_size = cell_size
+        self.cells = {}
+        self.robot_cells = {}
+
+    def update(self, positions: np.ndarray):
+        '''Moves every robot whose position is now in a different cell, positions is [robots, 2 or 3]'''
+        cells = np.floor(np.asarray(positions)[:, :2] / self.cell_size).astype(int)
+        for index, cell in enumerate(map(tuple, cells.tolist())):
+            old_cell = self.robot_cells.get(index)
+            if old_cell == cell:
+                continue
+            if old_cell is not None:
+                self.cells[old_cell].discard(index)
+                if not self.cells[old_cell]:
+                    del self.cells[old_cell]
+            self.cells.setdefault(cell, set()).add(index)
+            self.robot_cells[index] = cell
+
+    def query(self, x: float, y: float, radius: float):
+        '''Returns the indices of the robots in every cell overlapping the square of half size radius around x, y'''
+        min_x = math.floor((x - radius) / self.cell_size)
+        max_x = math.floor((x + radius) / self.cell_size)
+        min_y = math.floor((y - radius) / self.cell_size)
+        max_y = math.floor((y + radius) / self.cell_size)
+        neighbours = []
+        for cell_x in range(min_x, max_x + 1):
+            for cell_y in range(min_y, max_y + 1):
+                neighbours.extend(self.cells.get((cell_x, cell_y), ()))
+        return neighbours
+
+    def robots_in_range(self, positions: np.ndarray, radii: np.ndarray):
+        '''
+        Returns a boolean array marking the robots that have another robot within their radius
+        The hash must have been updated with the same positions
+        '''
+        positions = np.asarray(positions)
+        in_range = np.zeros(len(positions), dtype=bool)
+        for index, ((x, y), radius) in enumerate(zip(positions[:, :2].tolist(), radii.tolist())):
+            neighbours = [i for i in self.query(x, y, radius) if i != index]
+            if neighbours:
+                offsets = positions[neighbours, :2] - (x, y)
+                in_range[index] = np.any(np.hypot(offsets[:, 0], offsets[:, 1]) < radius)
+        return in_range
@@ -0,0 +1,168 @@
+'''
+Collision-free spawn sampler over the free space of the arena
+
+The cells of the arena distance field that are further than a robot radius (plus a margin) from every block and
+the wall are collected once. Robots are then placed one after another by dart throwing: a batch of random points
+of the free cells is drawn at once and checked against the robots placed so far through a background grid, so
+every check only looks at the few robots in the neighbouring grid cells. A robot that misses every batch of darts
+restarts the placement, and counts the darts keep missing are spawned on a randomly shifted hexagonal packing of
+the free space, which also bounds how many robots fit. No robot spawns inside an obstacle or on top of another robot.
+'''
+import numpy as np
+
+from arena import FIELD_X, FIELD_Y, ROBOT_RADIUS, ROBOT_Z
+
+SPAWN_CLEARANCE = 0.05   # extra gap between a spawned robot and the nearest obstacle
+MIN_SEPARATION = 2 * ROBOT_RADIUS + 0.2
+DARTS_PER_BATCH = 64
+MAX_BATCHES = 32         # batches of darts thrown for a single robot before the placement restarts
+MAX_ATTEMPTS = 10
+# Shifts of the hexagonal packings along each axis, tried in both orientations
+LATTICE_SHIFTS = 8
+
+# Range of x each team spawns in when team sides are enforced
+TEAM_SIDES = {
+    'blue': (0, FIELD_X / 2),
+    'red': (FIELD_X / 2, FIELD_X)
+}
+
+# Offsets of the background grid cells that can hold a robot closer than the separation, whose diagonal it is
+NEIGHBOUR_OFFSETS = np.array([(x, y) for x in range(-2, 3) for y in range(-2, 3)])
+
+
+def hexagonal_lattices(free_mask, resolution, spacing):
+    '''
+    Returns the points [points, 2] in the free cells of a mask of hexagonal lattices of the given spacing, shifted
+    and with rows along x and along y, the densest ways to place points spacing apart
+    '''
+    lattices = []
+    row_spacing = spacing * np.sqrt(3) / 2
+    for transpose in (False, True):
+        length, width = (FIELD_Y, FIELD_X) if transpose else (FIELD_X, FIELD_Y)
+        for shift_x in np.linspace(0, spacing, LATTICE_SHIFTS, endpoint=False):
+            for shift_y in np.linspace(0, 2 * row_spacing, LATTICE_SHIFTS, endpoint=False):
+                rows = np.arange(shift_y, width, row_spacing)
+                points = np.array([(x, y) for row, y in enumerate(rows)
+                                   for x in np.arange(shift_x + spacing / 2 * (row % 2), length, spacing)])
+                if transpose:
+                    points = points[:, ::-1]
+                cells = (points / resolution).astype(int)
+                inside = (cells[:, 0] < free_mask.shape[0]) & (cells[:, 1] < free_mask.shape[1])
+                points, cells = points[inside], cells[inside]
+                lattices.append(points[free_mask[cells[:, 0], cells[:, 1]]])
+    return lattices
+
+
+class SpawnSampler():
+    '''
+    Samples robot spawn positions in the free space of a distance field
+    Draws from np.random, so that seeding it reproduces the spawns
+    '''
+
+    def __init__(self, distance_field, clearance=ROBOT_RADIUS + SPAWN_CLEARANCE, min_separation=MIN_SEPARATION):
+        self.resolution = distance_field.resolution
+        self.min_separation = min_separation
+        free_mask = distance_field.field > clearance
+        ix, iy = np.nonzero(free_mask)
+        self.free_cells = (np.column_stack((ix, iy)) + 0.5) * self.resolution
+        self.team_cells = {}
+        for team, (x_min, x_max) in TEAM_SIDES.items():
+            on_side = (self.free_cells[:, 0] >= x_min) & (self.free_cells[:, 0] < x_max)
+            self.team_cells[team] = self.free_cells[on_side]
+        self.lattices = hexagonal_lattices(free_mask, self.resolution, min_separation)
+        # About the most robots that fit the free space, more are rejected up front
+        self.capacity = max(len(lattice) for lattice in self.lattices)
+
+        # A grid cell's diagonal is the separation, so a cell holds at most one robot
+        self.grid_size = min_separation / np.sqrt(2)
+        # Padded by two cells on every side, so that the neighbours of every cell are in the grid
+        self.grid_shape = (int(np.ceil(FIELD_X / self.grid_size)) + 5, int(np.ceil(FIELD_Y / self.grid_size)) + 5)
+
+    def candidates(self, cells, count):
+        '''Returns count random points of the given free cells, jittered within their cell'''
+        points = cells[np.random.randint(0, len(cells), size=count)]
+        return points + np.random.uniform(-self.resolution / 2, self.resolution / 2, size=points.shape)
+
+    def lattice_points(self, lattice, team):
+        '''Returns the points of a lattice on a team's side, or all of them without a team'''
+        if team is None:
+            return lattice
+        x_min, x_max = TEAM_SIDES[team]
+        return lattice[(lattice[:, 0] >= x_min) & (lattice[:, 0] < x_max)]
+
+    def fitting_lattices(self, count, teams):
+        '''Returns the lattices with enough points for count robots, on their sides with teams'''
+        if teams is None:
+            return [lattice for lattice in self.lattices if len(lattice) >= count]
+        team_counts = {team: teams.count(team) for team in set(teams)}
+        return [lattice for lattice in self.lattices
+                if all(len(self.lattice_points(lattice, team)) >= team_count
+                       for team, team_count in team_counts.items())]
+
+    def check_capacity(self, count, teams):
+        '''Raises a ValueError unless every robot has a known team and the robots fit the free space'''
+        if teams is not None:
+            if len(teams) != count:
+                raise ValueError(f'Got {len(teams)} teams for {count} robots, give the team of every robot')
+            unknown = set(teams) - set(TEAM_SIDES)
+            if unknown:
+                raise ValueError(f'Unknown teams {", ".join(sorted(unknown))}, teams are {", ".join(TEAM_SIDES)}')
+        if self.fitting_lattices(count, teams):
+            return
+        if teams is None:
+            raise ValueError(f'{count} robots cannot be placed {self.min_separation}m apart in the free space of '
+                             f'the arena, which fits about {self.capacity} in a hexagonal packing')
+        capacity = max(len(self.lattice_points(lattice, 'blue')) for lattice in self.lattices)
+        raise ValueError(f'{count} robots of teams {", ".join(sorted(set(teams)))} cannot be placed '
+                         f'{self.min_separation}m apart on their sides of the arena, which fit about {capacity} '
+                         f'robots each in a hexagonal packing')
+
+    def sample(self, count, teams=None):
+        '''
+        Returns count (x, y, z) spawn positions at least min_separation apart
+
+        :param teams: team name of every robot, each robot then spawns on its team's side in TEAM_SIDES
+        '''
+        if teams is not None:
+            teams = list(teams)
+        self.check_capacity(count, teams)
+
+        for _ in range(MAX_ATTEMPTS):
+            # Index of the robot in every background grid cell, -1 for empty cells
+            grid = np.full(self.grid_shape, -1)
+            placed = np.empty((count, 2))
+            for index in range(count):
+                cells = self.free_cells if teams is None else self.team_cells[teams[index]]
+                if not self.place(index, cells, grid, placed):
+                    break
+            else:
+                return np.column_stack((placed, np.full(count, ROBOT_Z))).tolist()
+
+        # Too dense for dart throwing, the robots take random points of a packing that fits them
+        lattices = self.fitting_lattices(count, teams)
+        lattice = lattices[np.random.randint(len(lattices))]
+        placed = np.empty((count, 2))
+        # Teams in a fixed order, so that seeding reproduces the spawns
+        for team in ([None] if teams is None else [team for team in TEAM_SIDES if team in teams]):
+            robots = np.arange(count) if team is None else np.flatnonzero(np.array(teams) == team)
+            points = self.lattice_points(lattice, team)
+            placed[robots] = points[np.random.choice(len(points), len(robots), replace=False)]
+        return np.column_stack((placed, np.full(count, ROBOT_Z))).tolist()
+
+    def place(self, index, cells, grid, placed):
+        '''Places robot index at the first dart of the cells clear of the placed robots, returns whether it hit'''
+        for _ in range(MAX_BATCHES):
+            darts = self.candidates(cells, DARTS_PER_BATCH)
+            grid_cells = (darts / self.grid_size).astype(int) + 2
+            # Robots in the neighbouring grid cells of every dart, [darts, neighbours]
+            neighbour_cells = grid_cells[:, None] + NEIGHBOUR_OFFSETS
+            neighbours = grid[neighbour_cells[..., 0], neighbour_cells[..., 1]]
+            offsets = darts[:, None] - placed[np.maximum(neighbours, 0)]
+            far = np.hypot(offsets[..., 0], offsets[..., 1]) >= self.min_separation
+            clear = np.all((neighbours < 0) | far, axis=1)
+            if clear.any():
+                dart = np.argmax(clear)
+                placed[index] = darts[dart]
+                grid[grid_cells[dart, 0], grid_cells[dart, 1]] = index
+                return True
+        return False
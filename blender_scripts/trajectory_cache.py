@@ -0,0 +1,75 @@
+'''
+Content-addressed cache of simulated robot trajectories
+
+The robot motion only depends on the spawn poses, the pathfinder settings and code, the arena layout and the state
+of the random generator when the simulation starts. Trajectories are saved under a hash of those inputs, so
+re-rendering the same scenario with other cameras or render settings replays them instead of re-simulating.
+'''
+import os
+import json
+import hashlib
+import numpy as np
+
+from arena import FIELD_X, FIELD_Y, ALL_BLOCKS, ROBOT_RADIUS
+
+TRAJECTORY_CACHE_PATH = os.path.join(os.getcwd(), 'cache', 'trajectories')
+# Bump when the stored arrays change so that stale cached trajectories are not reused
+TRAJECTORY_CACHE_VERSION = 1
+MOTION_SOURCES = ['motion.py', 'pathfinder.py', 'spatial_hash.py', 'distance_field.py']
+
+
+def trajectory_key(robot_names, spawn_locations, spawn_rotations, rng_state, frames, settings):
+    '''
+    Returns a hash of every input of a simulation, used to name its cached trajectories
+
+    :param rng_state: state of the NumPy random generator when the simulation starts, from np.random.get_state()
+    :param frames: number of simulated frames
+    :param settings: dict of the pathfinder constants and obstacle settings
+    '''
+    key = hashlib.sha256(json.dumps({
+        'version': TRAJECTORY_CACHE_VERSION,
+        'robots': list(robot_names),
+        'spawn_locations': np.asarray(spawn_locations, dtype=float).tolist(),
+        'spawn_rotations': np.asarray(spawn_rotations, dtype=float).tolist(),
+        'frames': frames,
+        'settings': settings,
+        'field': (FIELD_X, FIELD_Y),
+        'blocks': ALL_BLOCKS,
+        'robot_radius': ROBOT_RADIUS
+    }, sort_keys=True).encode())
+
+    generator, keys, position, has_gauss, cached_gaussian = rng_state
+    key.update(f'{generator}-{position}-{has_gauss}-{cached_gaussian!r}'.encode())
+    key.update(np.ascontiguousarray(keys).tobytes())
+
+    dirname = os.path.dirname(os.path.realpath(__file__))
+    for source in MOTION_SOURCES:
+        with open(os.path.join(dirname, source), 'rb') as f:
+            key.update(f.read())
+    return key.hexdigest()[:16]
+
+
+def cached_trajectory_path(key, cache_path=TRAJECTORY_CACHE_PATH):
+    return os.path.join(cache_path, f'trajectory_{key}.npz')
+
+
+def load_cached_trajectories(key, cache_path=TRAJECTORY_CACHE_PATH):
+    '''Returns the cached locations [frames, robots, 3] and z rotations [frames, robots], or None if missing'''
+    path = cached_trajectory_path(key, cache_path)
+    if not os.path.isfile(path):
+        return None
+    with np.load(path) as cached:
+        return cached['locations'], cached['rotations']
+
+
+def save_cached_trajectories(key, locations, rotations, cache_path=TRAJECTORY_CACHE_PATH):
+    '''
+    Saves simulated trajectories to the cache
+    They are written to a temporary file first, so that concurrent workers never read a partial file
+    '''
+    os.makedirs(cache_path, exist_ok=True)
+    path = cached_trajectory_path(key, cache_path)
+    temp_path = f'{path[:-len(".npz")]}.{os.getpid()}.tmp.npz'
+    np.savez(temp_path, locations=np.asarray(locations, dtype=np.float64),
+             rotations=np.asarray(rotations, dtype=np.float64))
+    os.replace(temp_path, path)
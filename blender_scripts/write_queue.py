@@ -0,0 +1,43 @@
+'''
+Bounded queue of background writes, shared by the asynchronous image writer and the dataset writer
+
+Writes run in a thread pool while the render loop carries on. At most max_pending writes are queued, so that a slow
+disk holds back the render loop instead of filling memory, and the error of a failed write is raised in the render
+loop the next time it has to wait for one.
+'''
+from concurrent.futures import ThreadPoolExecutor
+
+
+class WriteQueue():
+    '''
+    Runs writes in a pool of threads, oldest first
+    Every write is queued under a key, e.g. its file path, so that later writes can wait for it
+    '''
+
+    def __init__(self, threads=1, max_pending=16):
+        self.max_pending = max_pending
+        self.executor = ThreadPoolExecutor(max_workers=threads)
+        # (key, future) of every queued write, oldest first
+        self.pending = []
+
+    def submit(self, key, function, *args):
+        '''Queues function(*args) and returns its future, waiting for the oldest writes while too many are queued'''
+        future = self.executor.submit(function, *args)
+        self.pending.append((key, future))
+        while len(self.pending) > self.max_pending:
+            self.pending.pop(0)[1].result()
+        return future
+
+    def find(self, key):
+        '''Returns the future of the queued write of a key, or None once it is no longer queued'''
+        return next((future for pending_key, future in self.pending if pending_key == key), None)
+
+    def wait(self):
+        '''Waits until every queued write is done'''
+        for _, future in self.pending:
+            future.result()
+        self.pending = []
+
+    def close(self):
+        self.wait()
+        self.executor.shutdown()